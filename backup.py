@@ -25,24 +25,21 @@ import collections
 import copy
 import re
 import logging
-import logging.handlers
 import signal
 import datetime
+import time
 import contextlib
 import tempfile
 import subprocess
-import platform
 import json
-import email.utils
-import smtplib
-import email.mime.text
-import syslog
-import glob
-import importlib
 import fnmatch
 import math
 import locale
-import getpass
+import hashlib
+import binascii
+import threading
+import bisect
+# The modules only used by some commands or some configs are imported where they are used, for a quick startup
 
 
 script_path = os.path.dirname(os.path.realpath(os.path.abspath(__file__)))
@@ -58,8 +55,8 @@ logging.getLogger('urllib3').setLevel(logging.ERROR)
 # Python 2/3 compatibility mapping
 # ----------------------------------------------------------------------------
 if sys.version_info[0] == 2:  # Python 2 version
-    import ConfigParser
-    configparser = ConfigParser
+    import cPickle as pickle
+    from collections import Iterable
 
     def is_string(var):
         """
@@ -155,7 +152,8 @@ if sys.version_info[0] == 2:  # Python 2 version
         return pipes.quote(arg)
 
 else:  # Python 3 version
-    import configparser
+    import pickle
+    from collections.abc import Iterable
 
     StandardError = Exception
 
@@ -267,7 +265,7 @@ def is_array(var):
         return False
     if is_dict(var):
         return False
-    return isinstance(var, collections.Iterable)
+    return isinstance(var, Iterable)
 
 
 def is_dict(var):
@@ -443,6 +441,8 @@ def index_by(array, key):
 
 def deep_merge(src, new):
     """
+    Merge two values without modifying them. Only the lists and dicts along the merged keys are copied, the other
+    values are shared with src and new.
 
     :param src:
     :param new:
@@ -454,7 +454,7 @@ def deep_merge(src, new):
     if src is None:
         return new
     if is_array(src):
-        result = copy.deepcopy(src)
+        result = list(src)
         if is_array(new):
             result.extend(new)
         else:
@@ -462,12 +462,12 @@ def deep_merge(src, new):
         return result
     elif is_dict(src):
         if is_array(new):
-            result = copy.deepcopy(new)
+            result = list(new)
             result.append(src)
             return result
         if not is_dict(new):
             return [src, new]
-        result = copy.deepcopy(src)
+        result = dict(src)
         for key, val in new.items():
             if key in result.keys():
                 result[key] = deep_merge(result[key], val)
@@ -533,6 +533,7 @@ def which(exec_name):
     :return:                The path to the executable file
     :rtype:                 str
     """
+    import platform
     path = os.getenv('PATH')
     available_exts = ['']
     if "windows" in platform.system().lower():
@@ -572,7 +573,8 @@ def init_log(log_output=None):
         log_handler = logging.StreamHandler(stream=log_file)
         log_handler.setFormatter(logging.Formatter('%(message)s'))
     elif log_output == "syslog":
-        log_handler = logging.handlers.SysLogHandler(address='/dev/log')
+        from logging.handlers import SysLogHandler
+        log_handler = SysLogHandler(address='/dev/log')
         log_handler.setFormatter(logging.Formatter('%(name)s[%(process)d]: %(levelname)s %(message)s'))
     else:
         log_handler = logging.FileHandler(log_output)
@@ -610,6 +612,205 @@ def check_run_cmd(*cmd_args):
     return out
 
 
+def run_cmd_to_file(cmd_args, dest_file):
+    """
+    Run a command writing its standard output in a file, and compute the digests of the output while it is written
+
+    :param cmd_args:    The command
+    :type cmd_args:     list[str]
+    :param dest_file:   The file receiving the output
+    :type dest_file:    str
+    :return:            The digests of the file content
+    :rtype:             ArchiveDigest
+    """
+    digest = ArchiveDigest()
+    with tempfile.TemporaryFile() as err_fh:
+        with open(dest_file, "wb") as out_fh:
+            process = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=err_fh)
+            try:
+                digest.copy(process.stdout, out_fh)
+            except BaseException:
+                if process.poll() is None:
+                    process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                exit_code = process.wait()
+        if exit_code != 0:
+            err_fh.seek(0)
+            error = "Command failed with exit code " + to_str(exit_code) + os.linesep
+            error += "  Command: " + " ".join([shell_quote(arg) for arg in cmd_args])
+            err = to_str(err_fh.read()).strip()
+            if err:
+                error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
+            raise RuntimeError(error)
+    return digest
+
+
+class RateLimiter(object):
+    """
+    Space out the operations of several threads to a maximum rate
+    """
+    def __init__(self, rate):
+        """
+        :param rate:    The maximum number of operations per second, None for no limit
+        :type rate:     float|None
+        """
+        self._interval = 1.0 / rate if rate else 0
+        self._next_slot = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run_concurrently(function, items, thread_count, rate=None, progress=None):
+    """
+    Call a function on every item from a pool of threads. A failing call doesn't stop the other ones.
+
+    :param function:        The function to call, with an item as argument
+    :type function:         callable
+    :param items:           The items
+    :type items:            list[any]
+    :param thread_count:    The maximum number of calls running at the same time
+    :type thread_count:     int
+    :param rate:            The maximum number of calls started per second, None for no limit
+    :type rate:             float|None
+    :param progress:        Called with the number of finished calls and the total number of calls, after each call
+    :type progress:         callable|None
+    :return:                The errors, by item
+    :rtype:                 dict[any, Exception]
+    """
+    pending = list(reversed(items))
+    errors = {}
+    finished = [0]
+    lock = threading.Lock()
+    limiter = RateLimiter(rate)
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                item = pending.pop()
+            limiter.wait()
+            try:
+                function(item)
+            except StandardError as e:
+                with lock:
+                    errors[item] = e
+            with lock:
+                finished[0] += 1
+                if progress is not None:
+                    progress(finished[0], len(items))
+
+    if thread_count <= 1:
+        worker()
+        return errors
+    threads = []
+    for _ in range(min(thread_count, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    try:
+        for thread in threads:
+            # With a timeout, so that the main thread stays interruptible on python 2
+            while thread.is_alive():
+                thread.join(1.0)
+    except BaseException:
+        # Interrupted: the other calls are not started, and the running ones are waited for, so that the caller knows
+        # what they did. Interrupting again stops waiting.
+        with lock:
+            del pending[:]
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1.0)
+        raise
+    return errors
+
+
+class TaskQueue(object):
+    """
+    Run tasks in background threads, in submission order
+    """
+    def __init__(self, thread_count):
+        """
+        :param thread_count:    The maximum number of tasks running at the same time
+        :type thread_count:     int
+        """
+        self._thread_count = thread_count
+        self._tasks = collections.deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._running = 0
+        self._errors = {}
+
+    def submit(self, key, function, *args):
+        """
+        Queue a task
+
+        :param key:         The task identifier, used to report its failure
+        :type key:          any
+        :param function:    The function to call
+        :type function:     callable
+        :param args:        The function arguments
+        :type args:         any
+        """
+        with self._condition:
+            self._tasks.append((key, function, args))
+            if len(self._threads) < self._thread_count:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._condition.notify()
+
+    def wait(self, key_filter=None):
+        """
+        Wait for every queued task to finish
+
+        :param key_filter:  Select the errors to return, by task key. The other errors are kept for the next waits.
+                            Optional, all the errors by default.
+        :type key_filter:   callable|None
+        :return:            The errors of the failed tasks, by task key
+        :rtype:             dict[any, Exception]
+        """
+        with self._condition:
+            while self._tasks or self._running:
+                # With a timeout, so that the main thread stays interruptible on python 2
+                self._condition.wait(1.0)
+            errors = {}
+            for key in list(self._errors.keys()):
+                if key_filter is None or key_filter(key):
+                    errors[key] = self._errors.pop(key)
+        return errors
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._tasks:
+                    self._condition.wait()
+                key, function, args = self._tasks.popleft()
+                self._running += 1
+            try:
+                function(*args)
+            except StandardError as e:
+                with self._condition:
+                    self._errors[key] = e
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._condition.notify_all()
+
+
 class KillEventHandler(object):
     """ Static class used to force killing of the script if too many and quit signals are received."""
     INTERVAL = datetime.timedelta(seconds=1)
@@ -678,11 +879,344 @@ class TimeReference(object):
         return TimeReference._now
 
 
+class LinkStats(object):
+    """
+    Static class recording, from one run to another, the bandwidth of the link to each server and the cpu
+    available on it. It is used to choose where the data should be compressed.
+    """
+    STATS_FILE = os.path.expanduser("~/.backuper_link_stats")
+    # Links faster than this (bytes/s) go faster than the compression, data is shipped raw
+    FAST_LINK_BANDWIDTH = 50 * 1024 * 1024
+    # Minimum idle cores on a server to let it compress the data
+    MIN_CPU_HEADROOM = 1.0
+
+    _stats = None
+
+    @staticmethod
+    def _load():
+        if LinkStats._stats is None:
+            LinkStats._stats = {}
+            if os.path.exists(LinkStats.STATS_FILE):
+                try:
+                    with open(LinkStats.STATS_FILE, "r") as fh:
+                        LinkStats._stats = json.load(fh)
+                except (StandardError, ValueError) as e:
+                    log.warning("Ignoring invalid link stats file " + LinkStats.STATS_FILE + ": " + to_str(e))
+        return LinkStats._stats
+
+    @staticmethod
+    def _update(server_name, key, value):
+        stats = LinkStats._load()
+        server_stats = stats.setdefault(server_name, {})
+        if key in server_stats.keys():
+            # Smooth the measures, a single slow run should not change the policy
+            value = (server_stats[key] + value) / 2.0
+        server_stats[key] = value
+        server_stats["updated"] = TimeReference.get().strftime("%Y-%m-%d")
+        try:
+            with open(LinkStats.STATS_FILE + ".tmp", "w") as fh:
+                json.dump(stats, fh, indent=2, sort_keys=True)
+            os.rename(LinkStats.STATS_FILE + ".tmp", LinkStats.STATS_FILE)
+        except (IOError, OSError) as e:
+            log.warning("Unable to save link stats file " + LinkStats.STATS_FILE + ": " + to_str(e))
+
+    @staticmethod
+    def record_transfer(server_name, byte_count, duration):
+        # Small transfers are dominated by the connection setup, they don't tell anything about the link
+        if byte_count < 10 * 1024 * 1024 or duration <= 0:
+            return
+        LinkStats._update(server_name, "bandwidth", byte_count / float(duration))
+
+    @staticmethod
+    def record_cpu_headroom(server_name, idle_cores):
+        LinkStats._update(server_name, "cpu_headroom", float(idle_cores))
+
+    @staticmethod
+    def choose_compression(server_name):
+        """
+        Choose where to compress the data of a server, from the measures of the previous runs
+
+        :param server_name:     The server
+        :type server_name:      str
+        :return:                One of Action.TRANSPORT_* values
+        :rtype:                 str
+        """
+        server_stats = LinkStats._load().get(server_name, {})
+        if "bandwidth" in server_stats.keys() and server_stats["bandwidth"] >= LinkStats.FAST_LINK_BANDWIDTH:
+            return Action.TRANSPORT_LOCAL
+        if server_stats.get("cpu_headroom", LinkStats.MIN_CPU_HEADROOM) >= LinkStats.MIN_CPU_HEADROOM:
+            return Action.TRANSPORT_REMOTE
+        return Action.TRANSPORT_SSH
+
+    def __init__(self):
+        raise RuntimeError("Should not be called: LinkStats.__init__")
+
+
 # Business logic classes
 # ----------------------------------------------------------------------------
 
 
+class ProcessOutputReader(object):
+    """
+    Standard output of a running process, as a readable stream.
+    Reading the end of the output raises a RuntimeError if the process failed.
+    """
+    def __init__(self, process, err_fh, cmd_str):
+        """
+        :param process:     The process, started with stdout=PIPE
+        :type process:      subprocess.Popen
+        :param err_fh:      The file receiving the error output of the process
+        :type err_fh:       file
+        :param cmd_str:     The command, for error messages
+        :type cmd_str:      str
+        """
+        self._process = process
+        self._err_fh = err_fh
+        self._cmd_str = cmd_str
+
+    def read(self, size=-1):
+        data = self._process.stdout.read(size)
+        if not data and size != 0:
+            exit_code = self._process.wait()
+            if exit_code != 0:
+                self._err_fh.seek(0)
+                error = "Command failed with exit code " + to_str(exit_code) + os.linesep
+                error += "  Command: " + self._cmd_str
+                err = to_str(self._err_fh.read()).strip()
+                if err:
+                    error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
+                raise RuntimeError(error)
+        return data
+
+
+class AgeEncryption(object):
+    """
+    Encryption of archives for a list of age recipients.
+    Age encrypts in authenticated 64KiB chunks, as a stream: the encrypted archives are not written on the local disk.
+    """
+    EXTENSION = "age"
+
+    def __init__(self, recipients):
+        """
+        :param recipients:  The age or ssh public keys, or the path of files listing recipients
+        :type recipients:   list[str]
+        """
+        self._recipients = recipients
+
+    @property
+    def recipients(self):
+        return self._recipients
+
+    @staticmethod
+    def plain_name(archive):
+        """
+        :return:    The archive name, without the encryption extension
+        :rtype:     str
+        """
+        if archive.endswith("." + AgeEncryption.EXTENSION):
+            return archive[:-len(AgeEncryption.EXTENSION) - 1]
+        return archive
+
+    def get_cmd(self):
+        """
+        :return:    The command encrypting its standard input on its standard output
+        :rtype:     list[str]
+        """
+        cmd = ["age"]
+        for recipient in self._recipients:
+            if recipient.startswith("/") or recipient.startswith("~"):
+                cmd.extend(["-R", os.path.expanduser(recipient)])
+            else:
+                cmd.extend(["-r", recipient])
+        return cmd
+
+    def encrypt_file(self, source_file, dest_file):
+        check_run_cmd(*(self.get_cmd() + ["-o", dest_file + ".part", source_file]))
+        os.rename(dest_file + ".part", dest_file)
+
+    @contextlib.contextmanager
+    def encrypt(self, source_file):
+        """
+        Encrypt a file on the fly, while the encrypted data is consumed
+
+        :param source_file:     The file to encrypt
+        :type source_file:      str
+        :return:                A context manager giving the encrypted stream
+        :rtype:                 ProcessOutputReader
+        """
+        cmd = self.get_cmd()
+        with open(source_file, "rb") as fh:
+            with tempfile.TemporaryFile() as err_fh:
+                process = subprocess.Popen(cmd, stdin=fh, stdout=subprocess.PIPE, stderr=err_fh)
+                try:
+                    yield ProcessOutputReader(process, err_fh, " ".join(map(shell_quote, cmd)))
+                finally:
+                    if process.poll() is None:
+                        process.kill()
+                    process.wait()
+                    process.stdout.close()
+
+    def __str__(self):
+        return "age, recipients: " + ", ".join(self._recipients)
+
+
+class ArchiveDigest(object):
+    """
+    SHA-256 digest and glacier tree hash of an archive, computed while its content is produced or copied,
+    so that the archive never has to be read again to be checked
+    """
+    _TREE_HASH_CHUNK = 1024 * 1024
+    _COPY_CHUNK = 1024 * 1024
+
+    def __init__(self, sha256=None, tree_hash=None, size=None):
+        """
+        Start a new digest, or load recorded digests when they are given
+
+        :param sha256:      The recorded hexadecimal SHA-256 digest
+        :type sha256:       str|None
+        :param tree_hash:   The recorded hexadecimal tree hash
+        :type tree_hash:    str|None
+        :param size:        The recorded size, in bytes
+        :type size:         int|None
+        """
+        self._sha256 = hashlib.sha256()
+        self._chunk = hashlib.sha256()
+        self._chunk_length = 0
+        self._chunk_hashes = []
+        self._size = 0
+        self._result = None
+        if sha256 is not None:
+            self._result = (sha256, tree_hash, size)
+
+    def update(self, data):
+        if self._result is not None:
+            raise RuntimeError("The digest is already complete")
+        self._sha256.update(data)
+        self._size += len(data)
+        offset = 0
+        while offset < len(data):
+            length = min(len(data) - offset, ArchiveDigest._TREE_HASH_CHUNK - self._chunk_length)
+            self._chunk.update(data[offset:offset + length] if length != len(data) else data)
+            self._chunk_length += length
+            offset += length
+            if self._chunk_length == ArchiveDigest._TREE_HASH_CHUNK:
+                self._chunk_hashes.append(self._chunk.digest())
+                self._chunk = hashlib.sha256()
+                self._chunk_length = 0
+
+    def copy(self, source, dest=None):
+        """
+        Read a stream until its end, writing its content in another stream
+
+        :param source:  The stream to read
+        :type source:   any
+        :param dest:    The stream to write, None to only compute the digests
+        :type dest:     any
+        """
+        while True:
+            chunk = source.read(ArchiveDigest._COPY_CHUNK)
+            if not chunk:
+                break
+            self.update(chunk)
+            if dest is not None:
+                dest.write(chunk)
+
+    @staticmethod
+    def of_file(filename):
+        """
+        Compute the digests of an existing file. Only for files which are not produced by the backup itself.
+
+        :rtype:     ArchiveDigest
+        """
+        digest = ArchiveDigest()
+        with open(filename, "rb") as fh:
+            digest.copy(fh)
+        return digest
+
+    @staticmethod
+    def from_dict(values):
+        return ArchiveDigest(values["sha256"], values.get("tree_hash"), values.get("size"))
+
+    def to_dict(self):
+        return {"sha256": self.sha256, "tree_hash": self.tree_hash, "size": self.size}
+
+    @property
+    def sha256(self):
+        return self._get_result()[0]
+
+    @property
+    def tree_hash(self):
+        return self._get_result()[1]
+
+    @property
+    def size(self):
+        return self._get_result()[2]
+
+    def _get_result(self):
+        if self._result is None:
+            hashes = list(self._chunk_hashes)
+            if self._chunk_length or not hashes:
+                hashes.append(self._chunk.digest())
+            tree_hash = GlacierMultipartUpload.tree_hash(hashes)
+            self._result = (self._sha256.hexdigest(), to_str(binascii.hexlify(tree_hash)), self._size)
+        return self._result
+
+    def __eq__(self, other):
+        if not isinstance(other, ArchiveDigest):
+            return False
+        return self.sha256 == other.sha256 and self.size == other.size
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class ArchiveFileWriter(object):
+    """
+    Write an archive in a local file. The file is written under a temporary name and only appears once completed.
+    """
+    def __init__(self, filename, on_close=None):
+        """
+        :param filename:    The archive file
+        :type filename:     str
+        :param on_close:    Called with the archive file once completed
+        :type on_close:     callable|None
+        """
+        super(ArchiveFileWriter, self).__init__()
+        self._filename = filename
+        self._on_close = on_close
+        self._fh = open(filename + ".part", "wb")
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def write(self, data):
+        self._fh.write(data)
+
+    def close(self):
+        self._fh.close()
+        os.rename(self._filename + ".part", self._filename)
+        if self._on_close is not None:
+            self._on_close(self._filename)
+
+    def abort(self):
+        self._fh.close()
+        if os.path.exists(self._filename + ".part"):
+            os.remove(self._filename + ".part")
+
+
 class MemoryStorage(object):
+    # No instance dict: thousands of them are created for large configs
+    __slots__ = ("_freq", "_encryption")
+    # Removals running at the same time, and started per second (None for no limit)
+    REMOVE_THREADS = 1
+    REMOVE_RATE = None
+    # The same limits for the removals running in background, while archives are being sent
+    THROTTLED_REMOVE_THREADS = 1
+    THROTTLED_REMOVE_RATE = 2
+    # Archives checked at the same time
+    VERIFY_THREADS = 1
+
     def __init__(self, freq):
         """
 
@@ -691,21 +1225,124 @@ class MemoryStorage(object):
         """
         super(MemoryStorage, self).__init__()
         self._freq = freq
+        self._encryption = None
 
     @property
     def freq(self):
         """ :rtype:     BackupFrequency """
         return self._freq
 
+    @property
+    def encryption(self):
+        """ :rtype:     AgeEncryption|None """
+        return self._encryption
+
+    def set_encryption(self, encryption):
+        """
+        Encrypt the archives saved on this storage
+
+        :param encryption:  The encryption, None to store plain archives
+        :type encryption:   AgeEncryption|None
+        """
+        self._encryption = encryption
+
     def should_save(self):
         return self._freq.should_keep(TimeReference.get().date())
 
-    def save(self, source_file, action_fullname, extension):
+    def save(self, source_file, action_fullname, extension, digest=None):
+        """
+        Save an archive
+
+        :param source_file:         The local archive file
+        :type source_file:          str
+        :param action_fullname:     The action full name
+        :type action_fullname:      str
+        :param extension:           The archive extension
+        :type extension:            str
+        :param digest:              The digests of the archive, computed when it was produced
+        :type digest:               ArchiveDigest|None
+        """
         raise NotImplemented(self.__class__.__name__ + "::save")
 
+    def open_writer(self, action_fullname, extension, size=0):
+        """
+        Open a writer to save an archive while it is produced.
+        The writer has write(data), close() to commit the archive and abort() methods.
+
+        :param size:    The projected size of the archive, as the archive size is only known once written
+        :type size:     int
+        :return:        The writer, or None if this storage can only save existing files
+        :rtype:         ArchiveFileWriter|None
+        """
+        return None
+
     def remove(self, archive_name):
         raise NotImplemented(self.__class__.__name__ + "::remove")
 
+    def remove_many(self, archives, progress=None, throttled=False):
+        """
+        Remove several archives, a failure doesn't stop the removal of the other ones
+
+        :param archives:    The archives to remove
+        :type archives:     list[str]
+        :param progress:    Called with the number of processed archives and the number of archives
+        :type progress:     callable|None
+        :param throttled:   Should the removals be slowed down, not to compete with the archives being sent?
+        :type throttled:    bool
+        :return:            The errors, by archive
+        :rtype:             dict[str, Exception]
+        """
+        thread_count, rate = self._get_remove_limits(throttled)
+        return run_concurrently(self.remove, archives, thread_count, rate, progress)
+
+    def _get_remove_limits(self, throttled):
+        """
+        :return:    The number of removals running at the same time, and started per second
+        :rtype:     (int, float|None)
+        """
+        if throttled:
+            return self.THROTTLED_REMOVE_THREADS, self.THROTTLED_REMOVE_RATE
+        return self.REMOVE_THREADS, self.REMOVE_RATE
+
+    def verify(self, archive, digest):
+        """
+        Check a stored archive matches the digests recorded when it was produced
+
+        :param archive:     The archive, as returned by list_archives
+        :type archive:      str
+        :param digest:      The recorded digests
+        :type digest:       ArchiveDigest
+        :raise RuntimeError:    If the archive doesn't match
+        """
+        raise NotImplementedError(self.__class__.__name__ + "::verify")
+
+    def verify_many(self, archives, digests, progress=None):
+        """
+        Check several archives, a failure doesn't stop the check of the other ones
+
+        :param archives:    The archives to check, as returned by list_archives
+        :type archives:     list[str]
+        :param digests:     The recorded digests, by archive name
+        :type digests:      dict[str, ArchiveDigest]
+        :param progress:    Called with the number of processed archives and the number of archives
+        :type progress:     callable|None
+        :return:            The errors, by archive
+        :rtype:             dict[str, Exception]
+        """
+        return run_concurrently(lambda archive: self.verify(archive, digests[os.path.basename(archive)]), archives,
+                                self.VERIFY_THREADS, progress=progress)
+
+    def wait_pending(self, action_fullname):
+        """
+        Wait for the archives of an action still being saved in background
+
+        :param action_fullname:     The action full name
+        :type action_fullname:      str
+        :return:                    The errors of the failed saves, by archive name
+        :rtype:                     dict[str, Exception]
+        """
+        return {}
+
     def check_writable(self):
         raise NotImplemented(self.__class__.__name__+"::check_writable")
 
@@ -728,11 +1365,25 @@ class MemoryStorage(object):
         return self._freq.should_keep(archive_date)
 
     def _archive_name(self, action_fullname, extension):
+        if self._encryption is not None:
+            extension += "." + AgeEncryption.EXTENSION
+        return MemoryStorage.archive_name(action_fullname, extension)
+
+    @staticmethod
+    def archive_name(action_fullname, extension):
         return TimeReference.get().strftime("%Y%m%d")+"_"+action_fullname+"."+extension
 
     def is_local(self):
         return False
 
+    @property
+    def listing_key(self):
+        """
+        :return:    The location of the archives: the storages with the same key list the same archives
+        :rtype:     str
+        """
+        return self.__class__.__name__ + ":" + self.small_descr
+
     @property
     def small_descr(self):
         return "generic storage"
@@ -743,42 +1394,350 @@ class MemoryStorage(object):
         return self._freq == other._freq
 
 
+class DiskSpace(object):
+    """
+    Free space of the file systems receiving the dumps and the archives
+    """
+    _UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+    @staticmethod
+    def get_usage(path):
+        """
+        :param path:    A file or folder, maybe not created yet
+        :type path:     str
+        :return:        The bytes available to unprivileged users, the size of the file system and its device id
+        :rtype:         (int, int, int)
+        """
+        path = os.path.abspath(path)
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        stats = os.statvfs(path)
+        return stats.f_bavail * stats.f_frsize, stats.f_blocks * stats.f_frsize, os.stat(path).st_dev
+
+    @staticmethod
+    def parse_quota(value):
+        """
+        Parse a free space quota, like '10%', '50G', '500M' or a number of bytes
+
+        :return:    The quota amount, and True if it is a percentage of the file system size
+        :rtype:     (float, bool)
+        :raise ValueError:  On an invalid quota
+        """
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            amount, unit = value, ""
+        elif is_string(value):
+            match = re.match(r"^\s*([0-9]+(?:\.[0-9]+)?)\s*(%|[bkmgt]?)(?:i?b)?\s*$", value, re.IGNORECASE)
+            if not match:
+                raise ValueError("invalid quota " + value)
+            amount, unit = float(match.group(1)), match.group(2).upper()
+        else:
+            raise ValueError("invalid quota " + to_str(value))
+        if amount < 0 or (unit == "%" and amount >= 100):
+            raise ValueError("invalid quota " + to_str(value))
+        if unit == "%":
+            return float(amount), True
+        return float(amount * DiskSpace._UNITS[unit]), False
+
+    @staticmethod
+    def format_size(size):
+        """
+        :param size:    A number of bytes
+        :type size:     int|float
+        :rtype:         str
+        """
+        if abs(size) < 1024:
+            return to_str(int(size)) + "B"
+        for unit in ("KiB", "MiB", "GiB"):
+            size /= 1024.0
+            if abs(size) < 1024:
+                return "%.1f%s" % (size, unit)
+        return "%.1fTiB" % (size / 1024.0)
+
+
+class LocalFolderIndex(object):
+    """
+    Archives of a local folder, grouped by action name. The folder is scanned once per process, then the index is
+    updated by the storages saving and removing archives in it.
+    The index can be persisted in the folder: it is reused as long as the folder is not modified by another process.
+    """
+    INDEX_FILENAME = ".backuper_index"
+    # Indexes of the folders, by real path: shared by the storages of every action
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._persisted = False
+        self._lock = threading.Lock()
+        # Archive file names, by name of the archive before its first extension
+        self._archives = None
+
+    @staticmethod
+    def get(folder, persisted=False):
+        """
+        :param folder:      The folder
+        :type folder:       str
+        :param persisted:   Should the index be stored in the folder?
+        :type persisted:    bool
+        :rtype:             LocalFolderIndex
+        """
+        key = os.path.realpath(folder)
+        with LocalFolderIndex._indexes_lock:
+            if key not in LocalFolderIndex._indexes:
+                LocalFolderIndex._indexes[key] = LocalFolderIndex(folder)
+            index = LocalFolderIndex._indexes[key]
+            index._persisted = index._persisted or persisted
+            return index
+
+    def list_archives(self, action_fullname=None):
+        """
+        :param action_fullname:     The action full name, None for the archives of every action
+        :type action_fullname:      str|None
+        :return:                    The archive paths, sorted
+        :rtype:                     list[str]
+        """
+        with self._lock:
+            archives = self._load()
+            if action_fullname is None:
+                filenames = [filename for group in archives.values() for filename in group]
+            else:
+                filenames = [filename for filename in archives.get(LocalFolderIndex._get_key(action_fullname), ())
+                             if filename[9:].startswith(action_fullname + ".")]
+        return [os.path.join(self._folder, filename) for filename in sorted(filenames)]
+
+    def add(self, archive):
+        """
+        Record an archive file written in the folder
+
+        :param archive:     The archive path
+        :type archive:      str
+        """
+        filename = os.path.basename(archive)
+        archive_name = LocalFolderIndex._parse_filename(filename)
+        with self._lock:
+            if self._archives is not None and archive_name is not None:
+                self._archives.setdefault(LocalFolderIndex._get_key(archive_name), set()).add(filename)
+                self._persist()
+
+    def discard(self, archive, persist=True):
+        """
+        Forget an archive file removed from the folder
+
+        :param archive:     The archive path
+        :type archive:      str
+        :param persist:     Should the index file be updated? False when several archives are removed
+        :type persist:      bool
+        """
+        filename = os.path.basename(archive)
+        archive_name = LocalFolderIndex._parse_filename(filename)
+        with self._lock:
+            if self._archives is not None and archive_name is not None:
+                self._archives.get(LocalFolderIndex._get_key(archive_name), set()).discard(filename)
+                if persist:
+                    self._persist()
+
+    def persist(self):
+        with self._lock:
+            self._persist()
+
+    def _load(self):
+        if self._archives is not None:
+            return self._archives
+        filenames = self._read_index_file() if self._persisted else None
+        scanned = filenames is None
+        if scanned:
+            filenames = self._scan()
+        self._archives = {}
+        for filename in filenames:
+            archive_name = LocalFolderIndex._parse_filename(filename)
+            if archive_name is not None:
+                self._archives.setdefault(LocalFolderIndex._get_key(archive_name), set()).add(filename)
+        if scanned:
+            self._persist()
+        return self._archives
+
+    def _scan(self):
+        if not hasattr(os, "scandir"):
+            return [filename for filename in os.listdir(self._folder)
+                    if os.path.isfile(os.path.join(self._folder, filename))]
+        # The file type comes with the directory entries: no stat per file
+        scanner = os.scandir(self._folder)
+        try:
+            return [entry.name for entry in scanner if entry.is_file()]
+        finally:
+            if hasattr(scanner, "close"):
+                scanner.close()
+
+    def _read_index_file(self):
+        index_file = os.path.join(self._folder, LocalFolderIndex.INDEX_FILENAME)
+        if not os.path.exists(index_file):
+            return None
+        try:
+            with open(index_file, "r") as fh:
+                content = json.load(fh)
+            if content["mtime"] != LocalFolderIndex._get_mtime(self._folder):
+                return None
+            return content["archives"]
+        except (StandardError, ValueError) as e:
+            log.warning("Ignoring invalid index file " + index_file + ": " + to_str(e))
+            return None
+
+    def _persist(self):
+        if not self._persisted or self._archives is None:
+            return
+        index_file = os.path.join(self._folder, LocalFolderIndex.INDEX_FILENAME)
+        try:
+            if not os.path.exists(index_file):
+                open(index_file, "a").close()
+            # Rewritten in place, so that the folder modification time recorded in it stays valid
+            mtime = LocalFolderIndex._get_mtime(self._folder)
+            with open(index_file, "w") as fh:
+                json.dump({"mtime": mtime, "archives": sorted([filename for group in self._archives.values()
+                                                               for filename in group])}, fh)
+        except (IOError, OSError) as e:
+            log.warning("Unable to write the index file " + index_file + ": " + to_str(e))
+
+    @staticmethod
+    def _get_mtime(folder):
+        stat = os.stat(folder)
+        return getattr(stat, "st_mtime_ns", None) or repr(stat.st_mtime)
+
+    @staticmethod
+    def _get_key(archive_name):
+        return archive_name.split(".", 1)[0]
+
+    @staticmethod
+    def _parse_filename(filename):
+        """
+        :return:    The archive name, without its date, None if the file is not an archive
+        :rtype:     str|None
+        """
+        if filename.endswith(".part"):
+            # Archive being written, or left by an interrupted write
+            return None
+        if len(filename) < 10 or filename[8] != '_' or '_' in filename[0:8]:
+            return None
+        archive_date, archive_name = filename.split("_", 1)
+        if not re.match(r"^[0-9]+$", archive_date):
+            return None
+        try:
+            datetime.date(year=int(archive_date[0:4]), month=int(archive_date[4:6]), day=int(archive_date[6:8]))
+        except ValueError:
+            return None
+        return archive_name
+
+
 class LocalFolderStorage(MemoryStorage):
-    def __init__(self, freq, folder_name):
+    __slots__ = ("_local_folder", "_index_file", "_min_free", "_index")
+
+    def __init__(self, freq, folder_name, index_file=False, min_free=None):
+        """
+        :param index_file:  Should the index of the folder be stored in it, for huge history folders?
+        :type index_file:   bool
+        :param min_free:    The space to keep free on the file system, as parsed by DiskSpace.parse_quota, None for
+                            no quota
+        :type min_free:     (float, bool)|None
+        """
         super(LocalFolderStorage, self).__init__(freq)
         self._local_folder = folder_name
+        self._index_file = index_file
+        self._min_free = min_free
+        self._index = LocalFolderIndex.get(folder_name, index_file)
 
-    def save(self, source_file, action_fullname, extension):
-        dest_file = self._archive_name(action_fullname, extension)
-        check_run_cmd("cp", source_file, os.path.join(self._local_folder, dest_file))
+    def save(self, source_file, action_fullname, extension, digest=None):
+        dest_file = os.path.join(self._local_folder, self._archive_name(action_fullname, extension))
+        self._check_space(os.path.getsize(source_file))
+        self._copy_file(source_file, dest_file, digest)
+        self._index.add(dest_file)
 
-    def list_archives(self, action_fullname=None):
-        results = []
-        for filename in os.listdir(self._local_folder):
-            full_path = os.path.join(self._local_folder, filename)
-            if not os.path.isfile(full_path):
-                continue
-            if len(filename) < 10 or filename[8] != '_' or '_' in filename[0:8]:
-                continue
-            archive_date, archive_name = filename.split("_", 1)
-            if not re.match(r"^[0-9]+$", archive_date):
-                continue
+    @property
+    def min_free(self):
+        """:rtype: (float, bool)|None"""
+        return self._min_free
+
+    def get_space(self):
+        """
+        :return:    The free bytes of the folder file system, the bytes the quota keeps free and the file system
+                    device id
+        :rtype:     (int, int, int)
+        """
+        free, total, device = DiskSpace.get_usage(self._local_folder)
+        if self._min_free is None:
+            return free, 0, device
+        amount, is_percent = self._min_free
+        return free, int(total * amount / 100 if is_percent else amount), device
+
+    def _check_space(self, size):
+        if self._min_free is None:
+            return
+        free, reserved, device = self.get_space()
+        if free - size < reserved:
+            raise RuntimeError("Not enough space in " + self._local_folder + " for " + DiskSpace.format_size(size) +
+                               ": " + DiskSpace.format_size(free) + " free, " + DiskSpace.format_size(reserved) +
+                               " to keep free")
+
+    def _copy_file(self, source_file, dest_file, digest):
+        if self._encryption is not None:
+            self._encryption.encrypt_file(source_file, dest_file)
+        elif digest is not None:
+            # The copy is checked against the digests computed when the archive was produced, while it is read
+            copied = ArchiveDigest()
+            writer = ArchiveFileWriter(dest_file)
             try:
-                archive_date = datetime.date(year=int(archive_date[0:4]),
-                                             month=int(archive_date[4:6]),
-                                             day=int(archive_date[6:8]))
-            except ValueError:
-                continue
-            if action_fullname and not archive_name.startswith(action_fullname+"."):
-                continue
-            results.append(full_path)
-        return results
+                with open(source_file, "rb") as fh:
+                    copied.copy(fh, writer)
+                if copied != digest:
+                    raise RuntimeError(source_file + " changed since it was produced: sha256 " + copied.sha256 +
+                                       " instead of " + digest.sha256)
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
+        else:
+            check_run_cmd("cp", source_file, dest_file)
+
+    def open_writer(self, action_fullname, extension, size=0):
+        if self._encryption is not None:
+            return None
+        self._check_space(size)
+        return ArchiveFileWriter(self.get_local_path(action_fullname, extension), self._index.add)
+
+    def add_archive(self, archive):
+        """
+        Record an archive written directly in the folder, at the path given by get_local_path
+
+        :param archive:     The archive path
+        :type archive:      str
+        """
+        self._index.add(archive)
+
+    def list_archives(self, action_fullname=None):
+        return self._index.list_archives(action_fullname)
 
     def check_writable(self):
         return Action.check_folder_writable(self._local_folder)
 
     def remove(self, archive_name):
         os.remove(archive_name)
+        self._index.discard(archive_name)
+
+    def remove_many(self, archives, progress=None, throttled=False):
+        thread_count, rate = self._get_remove_limits(throttled)
+        errors = run_concurrently(self._remove_file, archives, thread_count, rate, progress)
+        self._index.persist()
+        return errors
+
+    def _remove_file(self, archive_name):
+        os.remove(archive_name)
+        self._index.discard(archive_name, False)
+
+    def verify(self, archive, digest):
+        size = os.path.getsize(archive)
+        if size != digest.size:
+            raise RuntimeError("size is " + to_str(size) + " instead of " + to_str(digest.size))
+        actual = ArchiveDigest.of_file(archive)
+        if actual != digest:
+            raise RuntimeError("sha256 is " + actual.sha256 + " instead of " + digest.sha256)
 
     def is_local(self):
         return True
@@ -793,6 +1752,11 @@ class LocalFolderStorage(MemoryStorage):
 
     def __str__(self):
         details = "folder: " + self._local_folder + os.linesep + to_str(self.freq)
+        details += os.linesep + "index file: " + ("yes" if self._index_file else "no")
+        if self._min_free is not None:
+            amount, is_percent = self._min_free
+            details += os.linesep + "min free: " + ("%g%%" % amount if is_percent else DiskSpace.format_size(amount))
+        details += os.linesep + "encryption: " + (to_str(self._encryption) if self._encryption else "none")
         return "Local folder storage:" + os.linesep + indent(details)
 
     def __eq__(self, other):
@@ -801,15 +1765,597 @@ class LocalFolderStorage(MemoryStorage):
         return other._local_folder == self._local_folder and self._freq == other._freq
 
 
+class AwsClients(object):
+    """
+    Aws clients, created once per region and shared by every operation of the process
+    """
+    # Enough connections for the parallel parts uploads
+    MAX_POOL_CONNECTIONS = 32
+    MAX_ATTEMPTS = 10
+    _boto3_clients = {}
+    _boto2_connections = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_boto3(service, region, endpoint_url=None):
+        """
+        Get the boto3 client of a service, with a connection pool and adaptive retries
+
+        :param service:         The aws service, like 'glacier'
+        :type service:          str
+        :param region:          The aws region, None for the default one
+        :type region:           str|None
+        :param endpoint_url:    The url of an aws compatible service, None for aws
+        :type endpoint_url:     str|None
+        :return:                The boto3 client, safe to use from several threads
+        :rtype:                 any
+        """
+        import boto3
+        import botocore.config
+        import botocore.exceptions
+        with AwsClients._lock:
+            if (service, region, endpoint_url) not in AwsClients._boto3_clients:
+                try:
+                    config = botocore.config.Config(max_pool_connections=AwsClients.MAX_POOL_CONNECTIONS,
+                                                    retries={"max_attempts": AwsClients.MAX_ATTEMPTS,
+                                                             "mode": "adaptive"})
+                except botocore.exceptions.BotoCoreError:
+                    # botocore before 1.15 has no retry modes
+                    config = botocore.config.Config(max_pool_connections=AwsClients.MAX_POOL_CONNECTIONS,
+                                                    retries={"max_attempts": AwsClients.MAX_ATTEMPTS})
+                # Sessions are not thread safe, the clients they create are
+                session = boto3.session.Session()
+                AwsClients._boto3_clients[(service, region, endpoint_url)] = session.client(
+                    service, region_name=region, endpoint_url=endpoint_url, config=config)
+            return AwsClients._boto3_clients[(service, region, endpoint_url)]
+
+    @staticmethod
+    def get_boto2_glacier(region):
+        import boto.glacier
+        with AwsClients._lock:
+            if region not in AwsClients._boto2_connections:
+                AwsClients._boto2_connections[region] = boto.glacier.connect_to_region(region)
+            return AwsClients._boto2_connections[region]
+
+
+class GlacierMultipartUpload(object):
+    """
+    Upload of a file or a stream in a glacier vault, in parts sent in parallel.
+    The upload id of a file is recorded in a journal file, so that an interrupted upload resumes where it stopped.
+    The journal is keyed by the archive name without its date: the upload is also resumed by the runs of the next
+    days, as long as the file produced has the same size and digest.
+    """
+    _TREE_HASH_CHUNK = 1024 * 1024
+    _PART_RETRIES = 3
+    # Recorded uploads older than this are considered abandoned and aborted
+    _STALE_DAYS = 2
+    _journal_lock = threading.Lock()
+
+    def __init__(self, client, vault_name, archive_name, part_size, thread_count):
+        """
+        :param client:          The boto3 glacier client
+        :type client:           any
+        :param vault_name:      The vault name, without region
+        :type vault_name:       str
+        :param archive_name:    The archive description
+        :type archive_name:     str
+        :param part_size:       The size of the parts, a power of two multiple of 1MiB
+        :type part_size:        int
+        :param thread_count:    The number of parts sent at the same time
+        :type thread_count:     int
+        """
+        self._client = client
+        self._vault_name = vault_name
+        self._archive_name = archive_name
+        self._part_size = part_size
+        self._thread_count = thread_count
+        self._journal_file = None
+        self._key = vault_name + "/" + archive_name.split("_", 1)[-1]
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._upload_id = None
+        self._uploaded = {}
+        self._part_hashes = {}
+        self._part_count = 0
+        self._archive_size = 0
+        self._end_reached = False
+        self._error = None
+        self._expected_tree_hash = None
+
+    @property
+    def archive_size(self):
+        return self._archive_size
+
+    @staticmethod
+    def tree_hash(hashes):
+        """
+        Combine sha256 digests, two by two, up to the root of the tree
+
+        :param hashes:  The digests of the consecutive 1MiB chunks (or of aligned sub trees)
+        :type hashes:   list[bytes]
+        :return:        The root digest
+        :rtype:         bytes
+        """
+        if not hashes:
+            return hashlib.sha256(b"").digest()
+        while len(hashes) > 1:
+            combined = []
+            for i in range(0, len(hashes) - 1, 2):
+                combined.append(hashlib.sha256(hashes[i] + hashes[i + 1]).digest())
+            if len(hashes) % 2 == 1:
+                combined.append(hashes[-1])
+            hashes = combined
+        return hashes[0]
+
+    def upload_file(self, filename, journal_file, expected_tree_hash=None):
+        """
+        Send the parts of a file not uploaded yet, and complete the upload
+
+        :param filename:            The file to upload
+        :type filename:             str
+        :param journal_file:        The json file recording the started uploads
+        :type journal_file:         str
+        :param expected_tree_hash:  The tree hash computed when the file was produced: the upload is not completed if
+                                    the sent parts don't match it
+        :type expected_tree_hash:   str|None
+        :return:                    The archive id and its tree hash
+        :rtype:                     (str, str)
+        """
+        self._expected_tree_hash = expected_tree_hash
+        self._journal_file = journal_file
+        file_size = os.path.getsize(filename)
+        self._resume_or_initiate(file_size)
+        with open(filename, "rb") as fh:
+            self._send_parts(fh)
+        if self._archive_size != file_size:
+            raise RuntimeError("File " + filename + " changed during its upload")
+        result = self._complete()
+        self._update_journal(self._key, None)
+        return result
+
+    def upload_stream(self, stream):
+        """
+        Send the content of a stream, read part by part, and complete the upload. Such an upload can't be resumed.
+
+        :param stream:      The stream to read until its end
+        :type stream:       any
+        :return:            The archive id and its tree hash
+        :rtype:             (str, str)
+        """
+        response = self._client.initiate_multipart_upload(vaultName=self._vault_name,
+                                                          archiveDescription=self._archive_name,
+                                                          partSize=str(self._part_size))
+        self._upload_id = response["uploadId"]
+        try:
+            self._send_parts(stream)
+            return self._complete()
+        except BaseException:
+            try:
+                self._client.abort_multipart_upload(vaultName=self._vault_name, uploadId=self._upload_id)
+            except StandardError as e:
+                log.warning("Unable to abort glacier upload of " + self._key + ": " + to_str(e))
+            raise
+
+    def _send_parts(self, stream):
+        threads = []
+        for _ in range(self._thread_count):
+            thread = threading.Thread(target=self._work, args=(stream,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _complete(self):
+        hashes = [binascii.unhexlify(self._part_hashes[i]) for i in range(self._part_count)]
+        tree_hash = to_str(binascii.hexlify(self.tree_hash(hashes)))
+        if self._expected_tree_hash is not None and tree_hash != self._expected_tree_hash:
+            # The file changed: its parts are useless
+            self._client.abort_multipart_upload(vaultName=self._vault_name, uploadId=self._upload_id)
+            self._update_journal(self._key, None)
+            raise RuntimeError("The parts sent for " + self._key + " don't match the archive produced: tree hash " +
+                               tree_hash + " instead of " + self._expected_tree_hash)
+        response = self._client.complete_multipart_upload(vaultName=self._vault_name, uploadId=self._upload_id,
+                                                          archiveSize=str(self._archive_size),
+                                                          checksum=tree_hash)
+        return response['archiveId'], response['checksum']
+
+    def _resume_or_initiate(self, file_size):
+        entry = self._load_journal().get(self._key)
+        if entry and self._can_resume(entry, file_size):
+            try:
+                self._uploaded = self._list_uploaded_parts(entry["upload_id"])
+                self._upload_id = entry["upload_id"]
+                log.info(self._archive_name + ": resuming glacier upload, " + to_str(len(self._uploaded)) + "/" +
+                         to_str(int(math.ceil(float(file_size) / self._part_size))) + " parts already sent")
+                return
+            except StandardError as e:
+                log.warning(self._archive_name + ": unable to resume glacier upload: " + to_str(e))
+        if entry:
+            # Upload of another content of the same archive: replaced by the new one
+            self._abort_upload(self._key, entry["upload_id"])
+        self._abort_stale_uploads()
+        response = self._client.initiate_multipart_upload(vaultName=self._vault_name,
+                                                          archiveDescription=self._archive_name,
+                                                          partSize=str(self._part_size))
+        self._upload_id = response["uploadId"]
+        self._update_journal(self._key, {
+            "upload_id": self._upload_id,
+            "archive_name": self._archive_name,
+            "part_size": self._part_size,
+            "file_size": file_size,
+            "tree_hash": self._expected_tree_hash,
+            "started": TimeReference.get().strftime("%Y%m%d"),
+        })
+
+    def _can_resume(self, entry, file_size):
+        """
+        :param entry:       The journal entry of an upload of the same archive, started by this run or a previous one
+        :type entry:        dict[str, any]
+        :param file_size:   The size of the file to upload
+        :type file_size:    int
+        :return:            True if the upload sends the same content as the file
+        :rtype:             bool
+        """
+        if entry["part_size"] != self._part_size or entry["file_size"] != file_size:
+            return False
+        if entry.get("archive_name") == self._archive_name:
+            # The sent parts are checked against the file anyway
+            return True
+        # Started another day: the glacier archive will keep the description of that day, the content must be the
+        # same
+        return self._expected_tree_hash is not None and entry.get("tree_hash") == self._expected_tree_hash
+
+    def _abort_upload(self, key, upload_id):
+        try:
+            self._client.abort_multipart_upload(vaultName=self._vault_name, uploadId=upload_id)
+        except StandardError as e:
+            log.warning("Unable to abort glacier upload of " + key + ": " + to_str(e))
+        self._update_journal(key, None)
+
+    def _list_uploaded_parts(self, upload_id):
+        """
+        :return:    The tree hash of the parts already received by glacier, by part index
+        :rtype:     dict[int, str]
+        """
+        uploaded = {}
+        params = {"vaultName": self._vault_name, "uploadId": upload_id}
+        while True:
+            response = self._client.list_parts(**params)
+            for part in response.get("Parts", []):
+                start = int(part["RangeInBytes"].split("-", 1)[0])
+                if start % self._part_size == 0:
+                    uploaded[start // self._part_size] = part["SHA256TreeHash"]
+            if not response.get("Marker"):
+                return uploaded
+            params["marker"] = response["Marker"]
+
+    def _abort_stale_uploads(self):
+        journal = self._load_journal()
+        for key, entry in journal.items():
+            if not key.startswith(self._vault_name + "/"):
+                continue
+            started = datetime.datetime.strptime(entry["started"], "%Y%m%d")
+            if (TimeReference.get() - started).days < GlacierMultipartUpload._STALE_DAYS:
+                continue
+            self._abort_upload(key, entry["upload_id"])
+
+    def _work(self, stream):
+        while True:
+            try:
+                # Parts are read in order, then hashed and sent in parallel
+                with self._read_lock:
+                    if self._end_reached or self._error is not None:
+                        return
+                    index = self._part_count
+                    chunks = self._read_part(stream)
+                    if not chunks:
+                        self._end_reached = True
+                        return
+                    self._part_count += 1
+                    self._archive_size += sum([len(chunk) for chunk in chunks])
+                self._send_part(index, chunks)
+            except StandardError as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+                return
+
+    def _read_part(self, stream):
+        """
+        :return:    The 1MiB chunks of the next part, empty at the end of the stream
+        :rtype:     list[bytes]
+        """
+        chunks = []
+        remaining = self._part_size
+        while remaining > 0:
+            chunk = stream.read(min(GlacierMultipartUpload._TREE_HASH_CHUNK, remaining))
+            if not chunk:
+                self._end_reached = True
+                break
+            # A pipe can return less than asked: complete the chunk so that it matches a tree hash leaf
+            while len(chunk) < min(GlacierMultipartUpload._TREE_HASH_CHUNK, remaining):
+                more = stream.read(min(GlacierMultipartUpload._TREE_HASH_CHUNK, remaining) - len(chunk))
+                if not more:
+                    self._end_reached = True
+                    break
+                chunk += more
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            if self._end_reached:
+                break
+        return chunks
+
+    def _send_part(self, index, chunks):
+        start = index * self._part_size
+        checksum = to_str(binascii.hexlify(self.tree_hash([hashlib.sha256(chunk).digest() for chunk in chunks])))
+        if self._uploaded.get(index) != checksum:
+            body = b"".join(chunks)
+            byte_range = "bytes " + to_str(start) + "-" + to_str(start + len(body) - 1) + "/*"
+            for attempt in range(GlacierMultipartUpload._PART_RETRIES):
+                try:
+                    self._client.upload_multipart_part(vaultName=self._vault_name, uploadId=self._upload_id,
+                                                       range=byte_range, checksum=checksum, body=body)
+                    break
+                except StandardError as e:
+                    if attempt + 1 == GlacierMultipartUpload._PART_RETRIES:
+                        raise
+                    log.warning(self._archive_name + ": glacier upload of part " + to_str(index) + " failed, " +
+                                "retrying: " + to_str(e))
+                    time.sleep(2 ** attempt)
+        with self._lock:
+            self._part_hashes[index] = checksum
+
+    def _load_journal(self):
+        """
+        :return:    The started uploads, by vault and archive name
+        :rtype:     dict[str, dict[str, any]]
+        """
+        with self._lock_journal():
+            return self._read_journal()
+
+    @contextlib.contextmanager
+    def _lock_journal(self):
+        """
+        Lock the journal against the other uploads of this process, and of the other runs sharing the glacier index
+        """
+        import fcntl
+        with GlacierMultipartUpload._journal_lock:
+            # A lock file: the journal itself is replaced on each update
+            with open(self._journal_file + ".lock", "a") as lock_fh:
+                fcntl.flock(lock_fh.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fh.fileno(), fcntl.LOCK_UN)
+
+    def _read_journal(self):
+        if not os.path.exists(self._journal_file):
+            return {}
+        try:
+            with open(self._journal_file, "r") as fh:
+                return json.load(fh)
+        except (StandardError, ValueError) as e:
+            log.warning("Ignoring invalid glacier upload journal " + self._journal_file + ": " + to_str(e))
+            return {}
+
+    def _update_journal(self, key, entry):
+        # Locked from the read to the write, not to lose the changes of the other uploads
+        with self._lock_journal():
+            journal = self._read_journal()
+            if entry is None:
+                journal.pop(key, None)
+            else:
+                journal[key] = entry
+            fd, tmp_filename = tempfile.mkstemp(".tmp", os.path.basename(self._journal_file) + ".",
+                                                os.path.dirname(os.path.abspath(self._journal_file)))
+            try:
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(journal, fh, indent=2, sort_keys=True)
+                os.rename(tmp_filename, self._journal_file)
+            except BaseException:
+                os.remove(tmp_filename)
+                raise
+
+
+class GlacierIndex(object):
+    """
+    Index of the archives sent to glacier vaults, stored in a sqlite database.
+    Several archive names can share the same glacier archive id, when their content is identical.
+    The archives of the legacy ini index file are imported on first use, without vault.
+    """
+    _LEGACY_SECTION = "glacier"
+    # Seconds to wait for the lock of another backup run
+    _LOCK_TIMEOUT = 300
+
+    def __init__(self, legacy_file):
+        """
+        :param legacy_file:     The ini index file, the database is stored next to it
+        :type legacy_file:      str
+        """
+        self._legacy_file = legacy_file
+        self._db_file = legacy_file + ".sqlite"
+        self._initialized = False
+
+    @property
+    def filename(self):
+        return self._db_file
+
+    def add(self, vault, archive_name, archive_id, size, tree_hash):
+        """
+        Record an archive sent to glacier, replacing any previous archive with the same name
+
+        :param vault:           The vault, as region:name
+        :type vault:            str
+        :param archive_name:    The archive name
+        :type archive_name:     str
+        :param archive_id:      The glacier archive id
+        :type archive_id:       str
+        :param size:            The archive size, in bytes
+        :type size:             int
+        :param tree_hash:       The SHA-256 tree hash of the archive, if known
+        :type tree_hash:        str|None
+        """
+        uploaded = TimeReference.get().strftime("%Y-%m-%d %H:%M:%S")
+        with contextlib.closing(self._connect()) as connection:
+            with GlacierIndex._transaction(connection):
+                connection.execute("DELETE FROM archives WHERE vault = '' AND name = ?", (archive_name,))
+                connection.execute("INSERT OR REPLACE INTO archives (vault, name, archive_id, size, tree_hash, " +
+                                   "uploaded) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (vault, archive_name, archive_id, size, tree_hash, uploaded))
+
+    def get_archive_id(self, vault, archive_name):
+        """
+        :return:    The glacier archive id, None if the archive is not recorded
+        :rtype:     str|None
+        """
+        with contextlib.closing(self._connect()) as connection:
+            row = connection.execute("SELECT archive_id FROM archives WHERE vault IN (?, '') AND name = ? " +
+                                     "ORDER BY vault DESC", (vault, archive_name)).fetchone()
+        return row[0] if row else None
+
+    def get_archive_ids(self, vault):
+        """
+        :return:    The glacier archive ids of the vault, by archive name
+        :rtype:     dict[str, str]
+        """
+        archive_ids = {}
+        with contextlib.closing(self._connect()) as connection:
+            # Archives recorded with their vault take precedence over the legacy ones
+            for name, archive_id in connection.execute("SELECT name, archive_id FROM archives " +
+                                                       "WHERE vault IN (?, '') ORDER BY vault", (vault,)):
+                archive_ids[name] = archive_id
+        return archive_ids
+
+    def find_payloads(self, vault, tree_hash, size):
+        """
+        Find the archives of a vault with a given content
+
+        :param vault:       The vault, as region:name
+        :type vault:        str
+        :param tree_hash:   The SHA-256 tree hash of the content
+        :type tree_hash:    str
+        :param size:        The size of the content, in bytes
+        :type size:         int
+        :return:            The archive names and glacier archive ids, most recent first
+        :rtype:             list[(str, str)]
+        """
+        with contextlib.closing(self._connect()) as connection:
+            return connection.execute("SELECT name, archive_id FROM archives WHERE vault = ? AND tree_hash = ? " +
+                                      "AND size = ? ORDER BY uploaded DESC, name DESC",
+                                      (vault, tree_hash, size)).fetchall()
+
+    def get_entries(self, vault):
+        """
+        :return:    The size and tree hash of the archives of the vault, by archive name
+        :rtype:     dict[str, (int|None, str|None)]
+        """
+        entries = {}
+        with contextlib.closing(self._connect()) as connection:
+            for name, size, tree_hash in connection.execute("SELECT name, size, tree_hash FROM archives " +
+                                                            "WHERE vault IN (?, '') ORDER BY vault", (vault,)):
+                entries[name] = (size, tree_hash)
+        return entries
+
+    def remove(self, vault, archive_name):
+        self.remove_many(vault, [archive_name])
+
+    def remove_many(self, vault, archive_names):
+        with contextlib.closing(self._connect()) as connection:
+            with GlacierIndex._transaction(connection):
+                connection.executemany("DELETE FROM archives WHERE vault IN (?, '') AND name = ?",
+                                       [(vault, archive_name) for archive_name in archive_names])
+
+    def list_names(self, vault):
+        """
+        :return:    The name of the archives recorded for the vault
+        :rtype:     list[str]
+        """
+        with contextlib.closing(self._connect()) as connection:
+            rows = connection.execute("SELECT DISTINCT name FROM archives WHERE vault IN (?, '') ORDER BY name",
+                                      (vault,)).fetchall()
+        return [row[0] for row in rows]
+
+    def _connect(self):
+        import sqlite3
+        connection = sqlite3.connect(self._db_file, timeout=GlacierIndex._LOCK_TIMEOUT, isolation_level=None)
+        if self._initialized:
+            return connection
+        try:
+            with GlacierIndex._transaction(connection):
+                connection.execute("CREATE TABLE IF NOT EXISTS archives (vault TEXT NOT NULL, name TEXT NOT NULL, " +
+                                   "archive_id TEXT NOT NULL, size INTEGER, tree_hash TEXT, uploaded TEXT, " +
+                                   "PRIMARY KEY (vault, name))")
+                connection.execute("CREATE INDEX IF NOT EXISTS archives_tree_hash ON archives (vault, tree_hash)")
+                connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+                if not connection.execute("SELECT 1 FROM settings WHERE key = 'legacy_imported'").fetchone():
+                    self._import_legacy_file(connection)
+                    connection.execute("INSERT INTO settings (key, value) VALUES ('legacy_imported', ?)",
+                                       (TimeReference.get().strftime("%Y-%m-%d %H:%M:%S"),))
+        except BaseException:
+            connection.close()
+            raise
+        self._initialized = True
+        return connection
+
+    def _import_legacy_file(self, connection):
+        if not os.path.exists(self._legacy_file):
+            return
+        try:
+            import configparser
+        except ImportError:
+            import ConfigParser as configparser
+        file_list = configparser.ConfigParser()
+        with open(self._legacy_file, "r") as fh:
+            # readfp is the only one on python 2, and was removed from python 3.12
+            if hasattr(file_list, "read_file"):
+                file_list.read_file(fh)
+            else:
+                file_list.readfp(fh)
+        if not file_list.has_section(GlacierIndex._LEGACY_SECTION):
+            return
+        for archive_name, archive_id in file_list.items(GlacierIndex._LEGACY_SECTION):
+            connection.execute("INSERT OR REPLACE INTO archives (vault, name, archive_id) VALUES ('', ?, ?)",
+                               (archive_name, archive_id))
+        log.info("Imported glacier index " + self._legacy_file + " into " + self._db_file)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(connection):
+        # Immediate: take the write lock first, so that concurrent runs wait instead of failing on upgrade
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
 class GlacierStorage(MemoryStorage):
-    def __init__(self, freq, vault_name, index_file):
+    __slots__ = ("_vault_name", "_glacier_list_file", "_index", "_part_size", "_upload_threads")
+    DEFAULT_PART_SIZE = 64 * 1024 * 1024
+    DEFAULT_UPLOAD_THREADS = 4
+    REMOVE_THREADS = 8
+    # Removed archives recorded in the index at once
+    _INDEX_BATCH_SIZE = 100
+    REMOVE_RATE = 20
+
+    def __init__(self, freq, vault_name, index_file, part_size=None, upload_threads=None):
         super(GlacierStorage, self).__init__(freq)
         self._vault_name = vault_name
         self._glacier_list_file = index_file
+        self._index = GlacierIndex(index_file)
+        self._part_size = part_size if part_size else GlacierStorage.DEFAULT_PART_SIZE
+        self._upload_threads = upload_threads if upload_threads else GlacierStorage.DEFAULT_UPLOAD_THREADS
 
-    def save(self, source_file, action_fullname, extension):
+    def save(self, source_file, action_fullname, extension, digest=None):
         dest_file = self._archive_name(action_fullname, extension)
-        self._send_glacier_file(source_file, dest_file)
+        if digest is not None and self._encryption is None and self._add_alias(action_fullname, dest_file, digest):
+            return
+        self._send_glacier_file(source_file, dest_file, digest)
 
     def list_archives(self, action_fullname=None):
         results = []
@@ -824,15 +2370,83 @@ class GlacierStorage(MemoryStorage):
         return self._check_glacier_access()
 
     def remove(self, archive):
-        self._delete_glacier_file(archive)
+        errors = self.remove_many([archive])
+        if errors:
+            raise errors[archive]
+
+    def remove_many(self, archives, progress=None, throttled=False):
+        archive_ids = self._index.get_archive_ids(self._vault_name)
+        errors = {}
+        for archive in archives:
+            if archive not in archive_ids:
+                errors[archive] = RuntimeError("Unable to find glacier archive file " + archive)
+        to_delete = [archive for archive in archives if archive in archive_ids]
+        # A payload is only deleted with its last alias
+        removed = set(to_delete)
+        referenced = set([archive_id for name, archive_id in archive_ids.items() if name not in removed])
+        archives_by_id = {}
+        for archive in to_delete:
+            if archive_ids[archive] not in referenced:
+                archives_by_id.setdefault(archive_ids[archive], []).append(archive)
+        # The aliases of a payload which is kept only have to be forgotten
+        self._index.remove_many(self._vault_name, [archive for archive in to_delete
+                                                   if archive_ids[archive] in referenced])
+        # The deleted payloads are recorded in batches while the deletions proceed: an interrupted removal leaves no
+        # deleted archive in the index
+        deleted = []
+        lock = threading.Lock()
+
+        def record_deleted(force=False):
+            with lock:
+                if deleted and (force or len(deleted) >= GlacierStorage._INDEX_BATCH_SIZE):
+                    self._index.remove_many(self._vault_name, deleted)
+                    del deleted[:]
+
+        def delete(archive_id):
+            self._delete_glacier_archive(archive_id)
+            with lock:
+                deleted.extend(archives_by_id[archive_id])
+            record_deleted()
+
+        thread_count, rate = self._get_remove_limits(throttled)
+        try:
+            id_errors = run_concurrently(delete, list(archives_by_id.keys()), thread_count, rate, progress)
+        finally:
+            record_deleted(True)
+        for archive_id, error in id_errors.items():
+            for archive in archives_by_id[archive_id]:
+                errors[archive] = error
+        return errors
+
+    def verify_many(self, archives, digests, progress=None):
+        # Glacier checked the tree hash of each upload: compare the recorded ones, without retrieving the archives
+        entries = self._index.get_entries(self._vault_name)
+        errors = {}
+        for archive in archives:
+            digest = digests[archive]
+            size, tree_hash = entries.get(archive, (None, None))
+            if archive not in entries:
+                errors[archive] = RuntimeError("not recorded in the glacier index")
+            elif tree_hash is None:
+                errors[archive] = RuntimeError("no tree hash recorded in the glacier index")
+            elif size is not None and size != digest.size:
+                errors[archive] = RuntimeError("size is " + to_str(size) + " instead of " + to_str(digest.size))
+            elif tree_hash != digest.tree_hash:
+                errors[archive] = RuntimeError("tree hash is " + tree_hash + " instead of " + digest.tree_hash)
+        if progress is not None and archives:
+            progress(len(archives), len(archives))
+        return errors
 
     @property
     def small_descr(self):
         return "aws glacier "+self._vault_name
 
     def __str__(self):
-        details = "vault: " + self._vault_name + os.linesep + "index_file: " + self._glacier_list_file
+        details = "vault: " + self._vault_name + os.linesep + "index_file: " + self._index.filename
+        details += os.linesep + "part size: " + to_str(self._part_size // (1024 * 1024)) + "MiB"
+        details += os.linesep + "upload threads: " + to_str(self._upload_threads)
         details += os.linesep + to_str(self.freq)
+        details += os.linesep + "encryption: " + (to_str(self._encryption) if self._encryption else "none")
         return "Aws glacier storage:" + os.linesep + indent(details)
 
     def __eq__(self, other):
@@ -840,12 +2454,10 @@ class GlacierStorage(MemoryStorage):
             return False
         if other._vault_name != self._vault_name:
             return False
+        if other._part_size != self._part_size or other._upload_threads != self._upload_threads:
+            return False
         return self._glacier_list_file == other._glacier_list_file and self._freq == other._freq
 
-    @property
-    def _section_name(self):
-        return "glacier"
-
     def _check_glacier_access(self):
         cache_value = WriteTestCache.is_glacier_success(self._vault_name)
         if cache_value is None:
@@ -864,95 +2476,132 @@ class GlacierStorage(MemoryStorage):
         return []
 
     def _list_glacier_memories(self):
-        file_list = configparser.ConfigParser()
-        if not os.path.exists(self._glacier_list_file):
-            return []
-        with open(self._glacier_list_file, "r") as fh:
-            file_list.readfp(fh)
-        if not file_list.has_section(self._section_name):
-            return []
-        return file_list.options(self._section_name)
+        return self._index.list_names(self._vault_name)
+
+    def _add_alias(self, action_fullname, archive_name, digest):
+        """
+        Record an archive as an alias of an identical archive of the same action already in the vault
+
+        :return:    True if the archive has been recorded, False if it has to be uploaded
+        :rtype:     bool
+        """
+        for name, archive_id in self._index.find_payloads(self._vault_name, digest.tree_hash, digest.size):
+            if name.split("_", 1)[-1].startswith(action_fullname + "."):
+                self._index.add(self._vault_name, archive_name, archive_id, digest.size, digest.tree_hash)
+                log.info(archive_name + " is identical to " + name + ", recorded as an alias of it in " +
+                         self.small_descr)
+                return True
+        return False
 
-    def _send_glacier_file(self, filename, archive_name=None):
+    def _send_glacier_file(self, filename, archive_name=None, digest=None):
         if archive_name is None:
             archive_name = os.path.basename(filename)
         vault_region, vault_name = self._vault_name.split(":", 2)
+        if self._encryption is not None:
+            archive_id, tree_hash, size = self._send_encrypted_glacier_file(vault_region, vault_name, filename,
+                                                                            archive_name)
+            self._index.add(self._vault_name, archive_name, archive_id, size, tree_hash)
+            return
+        expected_tree_hash = digest.tree_hash if digest is not None else None
         try:
-            archive_id = GlacierStorage._send_glacier_file_boto3(vault_region, vault_name, filename, archive_name)
+            archive_id, tree_hash = self._send_glacier_file_boto3(vault_region, vault_name, filename, archive_name,
+                                                                  expected_tree_hash)
         except ImportError:
             try:
-                archive_id = GlacierStorage._send_glacier_file_boto2(vault_region, vault_name, filename, archive_name)
+                archive_id, tree_hash = GlacierStorage._send_glacier_file_boto2(vault_region, vault_name, filename,
+                                                                                archive_name)
             except ImportError:
-                archive_id = GlacierStorage._send_glacier_file_awscli(vault_region, vault_name, filename, archive_name)
+                archive_id, tree_hash = GlacierStorage._send_glacier_file_awscli(vault_region, vault_name, filename,
+                                                                                 archive_name, expected_tree_hash)
+        if expected_tree_hash is not None and tree_hash is not None and tree_hash != expected_tree_hash:
+            raise RuntimeError("Glacier received " + archive_name + " with tree hash " + tree_hash + " instead of " +
+                               expected_tree_hash)
+        self._index.add(self._vault_name, archive_name, archive_id, os.path.getsize(filename), tree_hash)
 
-        file_list = configparser.ConfigParser()
-        if os.path.exists(self._glacier_list_file):
-            with open(self._glacier_list_file, "r") as fh:
-                file_list.readfp(fh)
-        if not file_list.has_section(self._section_name):
-            file_list.add_section(self._section_name)
-        file_list.set(self._section_name, archive_name, archive_id)
-        with open(self._glacier_list_file, "w") as fh:
-            file_list.write(fh)
-
-    def _delete_glacier_file(self, archive_name):
-        file_list = configparser.ConfigParser()
-        if not os.path.exists(self._glacier_list_file):
-            raise RuntimeError("Unable to find glacier archive list file "+self._glacier_list_file)
-        with open(self._glacier_list_file, "r") as fh:
-            file_list.readfp(fh)
-        if not file_list.has_section(self._section_name):
-            raise RuntimeError("Unable to find glacier archive file " + archive_name)
-        if not file_list.has_option(self._section_name, archive_name):
+    def _delete_glacier_file(self, archive_name):
+        archive_id = self._index.get_archive_id(self._vault_name, archive_name)
+        if archive_id is None:
             raise RuntimeError("Unable to find glacier archive file " + archive_name)
-        archive_id = file_list.get(self._section_name, archive_name)
 
+        self._delete_glacier_archive(archive_id)
+        self._index.remove(self._vault_name, archive_name)
+
+    def _delete_glacier_archive(self, archive_id):
         vault_region, vault_name = self._vault_name.split(":", 2)
         try:
-            GlacierStorage._delete_glacier_file_boto3(vault_region, vault_name, archive_id)
-        except ImportError:
             try:
-                GlacierStorage._delete_glacier_file_boto2(vault_region, vault_name, archive_id)
+                GlacierStorage._delete_glacier_file_boto3(vault_region, vault_name, archive_id)
             except ImportError:
-                GlacierStorage._delete_glacier_file_awscli(vault_region, vault_name, archive_id)
+                try:
+                    GlacierStorage._delete_glacier_file_boto2(vault_region, vault_name, archive_id)
+                except ImportError:
+                    GlacierStorage._delete_glacier_file_awscli(vault_region, vault_name, archive_id)
+        except StandardError as e:
+            if not GlacierStorage._is_not_found(e):
+                raise
+            # Deleted by a previous run, interrupted before recording it
+            log.info("Glacier archive " + archive_id + " was already removed from " + self._vault_name)
 
-        file_list = configparser.ConfigParser()
-        if not os.path.exists(self._glacier_list_file):
-            return
-        with open(self._glacier_list_file, "r") as fh:
-            file_list.readfp(fh)
-        if not file_list.has_section(self._section_name):
-            return
-        file_list.remove_option(self._section_name, archive_name)
-        with open(self._glacier_list_file, "w") as fh:
-            file_list.write(fh)
+    @staticmethod
+    def _is_not_found(error):
+        """
+        :param error:   An error of boto3, boto or the aws command line
+        :type error:    Exception
+        :return:        True if the archive doesn't exist in the vault
+        :rtype:         bool
+        """
+        response = getattr(error, "response", None)
+        if isinstance(response, dict) and response.get("Error", {}).get("Code") == "ResourceNotFoundException":
+            return True
+        return "ResourceNotFoundException" in to_str(error)
 
     @staticmethod
-    def _send_glacier_file_awscli(vault_region, vault_name, filename, archive_name):
+    def _send_glacier_file_awscli(vault_region, vault_name, filename, archive_name, tree_hash=None):
         aws_cli_path = which("aws")
-        out = check_run_cmd(aws_cli_path, 'glacier', 'upload-archive', '--account-id', '-', "--body", filename,
-                            '--archive-description', archive_name, "--region", vault_region, "--vault-name", vault_name)
+        cmd = [aws_cli_path, 'glacier', 'upload-archive', '--account-id', '-', "--body", filename,
+               '--archive-description', archive_name, "--region", vault_region, "--vault-name", vault_name]
+        if tree_hash is not None:
+            cmd.extend(["--checksum", tree_hash])
+        out = check_run_cmd(cmd)
         upload_info = json.loads(out)
         if 'archiveId' not in upload_info or not upload_info['archiveId'] or not upload_info['archiveId'].strip():
             raise RuntimeError("Unable to start glacier upload")
-        return upload_info['archiveId'].strip()
+        return upload_info['archiveId'].strip(), upload_info.get('checksum')
 
     @staticmethod
     def _send_glacier_file_boto2(vault_region, vault_name, filename, archive_name):
-        import boto, boto.glacier
-        conn = boto.glacier.connect_to_region(vault_region)
+        conn = AwsClients.get_boto2_glacier(vault_region)
         vault = conn.get_vault(vault_name)
-        return vault.upload_archive(filename, description=archive_name)
+        return vault.upload_archive(filename, description=archive_name), None
 
-    @staticmethod
-    def _send_glacier_file_boto3(vault_region, vault_name, filename, archive_name):
-        import boto3
-        client = boto3.client('glacier', region_name=vault_region)
+    def _send_encrypted_glacier_file(self, vault_region, vault_name, filename, archive_name):
+        """
+        Encrypt a file while sending it, as a multipart upload
+
+        :return:    The archive id, its tree hash and its size
+        :rtype:     (str, str, int)
+        """
+        try:
+            client = AwsClients.get_boto3('glacier', vault_region)
+        except ImportError:
+            raise RuntimeError("boto3 is required to send encrypted archives to glacier")
+        upload = GlacierMultipartUpload(client, vault_name, archive_name, self._part_size, self._upload_threads)
+        with self._encryption.encrypt(filename) as stream:
+            archive_id, tree_hash = upload.upload_stream(stream)
+        return archive_id, tree_hash, upload.archive_size
+
+    def _send_glacier_file_boto3(self, vault_region, vault_name, filename, archive_name, tree_hash=None):
+        client = AwsClients.get_boto3('glacier', vault_region)
+        if os.path.getsize(filename) > self._part_size:
+            upload = GlacierMultipartUpload(client, vault_name, archive_name, self._part_size, self._upload_threads)
+            return upload.upload_file(filename, self._glacier_list_file + ".uploads", tree_hash)
+        params = {"vaultName": vault_name, "archiveDescription": archive_name}
+        if tree_hash is not None:
+            # Given, botocore doesn't read the file again to compute it
+            params["checksum"] = tree_hash
         with open(filename, 'rb') as f:
-            response = client.upload_archive(vaultName=vault_name,
-                                             archiveDescription=archive_name,
-                                             body=f)
-            return response['archiveId']
+            response = client.upload_archive(body=f, **params)
+            return response['archiveId'], response.get('checksum')
 
     @staticmethod
     def _delete_glacier_file_awscli(vault_region, vault_name, archive_id):
@@ -962,18 +2611,471 @@ class GlacierStorage(MemoryStorage):
 
     @staticmethod
     def _delete_glacier_file_boto2(vault_region, vault_name, archive_id):
-        import boto, boto.glacier
-        conn = boto.glacier.connect_to_region(vault_region)
+        conn = AwsClients.get_boto2_glacier(vault_region)
         vault = conn.get_vault(vault_name)
         return vault.delete_archive(archive_id)
 
     @staticmethod
     def _delete_glacier_file_boto3(vault_region, vault_name, archive_id):
-        import boto3
-        client = boto3.client('glacier', region_name=vault_region)
+        client = AwsClients.get_boto3('glacier', vault_region)
         client.delete_archive(vaultName=vault_name, archiveId=archive_id)
 
 
+class S3Storage(MemoryStorage):
+    __slots__ = ("_bucket", "_prefix", "_storage_class", "_endpoint_url", "_region", "_part_size", "_upload_threads")
+    DEFAULT_PART_SIZE = 64 * 1024 * 1024
+    DEFAULT_UPLOAD_THREADS = 4
+    VERIFY_THREADS = 8
+    # Object metadata holding the SHA-256 digest of the archive
+    _SHA256_METADATA = "sha256"
+    # DeleteObjects accepts up to 1000 keys per request
+    _DELETE_BATCH_SIZE = 1000
+    # Object keys of the listed buckets, by endpoint, bucket and prefix: listed once per run
+    _listing_cache = {}
+    _listing_lock = threading.Lock()
+
+    def __init__(self, freq, bucket, prefix="", storage_class=None, endpoint_url=None, region=None, part_size=None,
+                 upload_threads=None):
+        super(S3Storage, self).__init__(freq)
+        self._bucket = bucket
+        self._prefix = prefix
+        self._storage_class = storage_class
+        self._endpoint_url = endpoint_url
+        self._region = region
+        self._part_size = part_size if part_size else S3Storage.DEFAULT_PART_SIZE
+        self._upload_threads = upload_threads if upload_threads else S3Storage.DEFAULT_UPLOAD_THREADS
+
+    def save(self, source_file, action_fullname, extension, digest=None):
+        from boto3.s3.transfer import TransferConfig
+        key = self._prefix + self._archive_name(action_fullname, extension)
+        # Parts of part_size, sent upload_threads at a time, each part retried on its own by the transfer manager
+        transfer_config = TransferConfig(multipart_threshold=self._part_size, multipart_chunksize=self._part_size,
+                                         max_concurrency=self._upload_threads)
+        extra_args = {}
+        if self._storage_class:
+            extra_args["StorageClass"] = self._storage_class
+        if digest is not None and self._encryption is None:
+            # The etag of multipart uploads is not a digest of the content: keep the one computed while packing
+            extra_args["Metadata"] = {S3Storage._SHA256_METADATA: digest.sha256}
+        extra_args = extra_args if extra_args else None
+        identical_key = None
+        if digest is not None and self._encryption is None:
+            identical_key = self._find_identical(action_fullname, key, digest)
+        if identical_key is not None:
+            # Copied by the server, nothing is uploaded
+            extra_args["MetadataDirective"] = "REPLACE"
+            self._get_client().copy({"Bucket": self._bucket, "Key": identical_key}, self._bucket, key,
+                                    ExtraArgs=extra_args, Config=transfer_config)
+            log.info(key + " is identical to " + identical_key + ", copied in " + self.small_descr)
+        elif self._encryption is not None:
+            with self._encryption.encrypt(source_file) as stream:
+                self._get_client().upload_fileobj(stream, self._bucket, key, ExtraArgs=extra_args,
+                                                  Config=transfer_config)
+        else:
+            self._get_client().upload_file(source_file, self._bucket, key, ExtraArgs=extra_args,
+                                           Config=transfer_config)
+        with S3Storage._listing_lock:
+            if self._cache_key in S3Storage._listing_cache:
+                S3Storage._listing_cache[self._cache_key].add(key)
+
+    def list_archives(self, action_fullname=None):
+        results = []
+        for key in sorted(self._list_keys()):
+            filename = key[len(self._prefix):]
+            if "/" in filename or len(filename) < 10 or filename[8] != '_' or '_' in filename[0:8]:
+                continue
+            archive_date, archive_name = filename.split("_", 1)
+            if not re.match(r"^[0-9]{8}$", archive_date):
+                continue
+            if action_fullname and not archive_name.startswith(action_fullname+"."):
+                continue
+            results.append(key)
+        return results
+
+    def check_writable(self):
+        location = "s3 bucket " + self._bucket + " (" + self.small_descr + ")"
+        cache_value = WriteTestCache.is_s3_success(self._cache_key)
+        if cache_value is None:
+            try:
+                key = self._prefix + ".backup_access_test"
+                client = self._get_client()
+                client.put_object(Bucket=self._bucket, Key=key, Body=b"foo bar")
+                client.delete_object(Bucket=self._bucket, Key=key)
+                self._list_keys()
+                WriteTestCache.set_s3_success(self._cache_key, True)
+            except ImportError:
+                WriteTestCache.set_s3_success(self._cache_key, False)
+                return ["Unable to write to " + location + ": boto3 is required for s3 storages"]
+            except StandardError as e:
+                WriteTestCache.set_s3_success(self._cache_key, False)
+                return ["Unable to write to " + location + ": " + to_str(e)]
+        elif not cache_value:
+            return ["Unable to write to " + location]
+        return []
+
+    def remove(self, archive):
+        self._get_client().delete_object(Bucket=self._bucket, Key=archive)
+        with S3Storage._listing_lock:
+            if self._cache_key in S3Storage._listing_cache:
+                S3Storage._listing_cache[self._cache_key].discard(archive)
+
+    def remove_many(self, archives, progress=None, throttled=False):
+        errors = {}
+        client = self._get_client()
+        # Throttled by batch, each batch is a single request
+        limiter = RateLimiter(self._get_remove_limits(throttled)[1])
+        for start in range(0, len(archives), S3Storage._DELETE_BATCH_SIZE):
+            batch = archives[start:start + S3Storage._DELETE_BATCH_SIZE]
+            limiter.wait()
+            try:
+                response = client.delete_objects(Bucket=self._bucket,
+                                                 Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+                for error in response.get("Errors", []):
+                    errors[error["Key"]] = RuntimeError(error.get("Code", "") + ": " + error.get("Message", ""))
+            except StandardError as e:
+                for key in batch:
+                    errors[key] = e
+            with S3Storage._listing_lock:
+                if self._cache_key in S3Storage._listing_cache:
+                    S3Storage._listing_cache[self._cache_key].difference_update(
+                        [key for key in batch if key not in errors])
+            if progress is not None:
+                progress(min(start + S3Storage._DELETE_BATCH_SIZE, len(archives)), len(archives))
+        return errors
+
+    def verify(self, archive, digest):
+        response = self._get_client().head_object(Bucket=self._bucket, Key=archive)
+        if response["ContentLength"] != digest.size:
+            raise RuntimeError("size is " + to_str(response["ContentLength"]) + " instead of " + to_str(digest.size))
+        sha256 = response.get("Metadata", {}).get(S3Storage._SHA256_METADATA)
+        if sha256 is None:
+            raise RuntimeError("no sha256 recorded in the object metadata")
+        if sha256 != digest.sha256:
+            raise RuntimeError("sha256 is " + sha256 + " instead of " + digest.sha256)
+
+    @property
+    def small_descr(self):
+        return "s3 " + self._bucket + "/" + self._prefix
+
+    def __str__(self):
+        details = "bucket: " + self._bucket
+        details += os.linesep + "prefix: " + (self._prefix if self._prefix else "none")
+        details += os.linesep + "storage class: " + (self._storage_class if self._storage_class else "Default")
+        details += os.linesep + "endpoint: " + (self._endpoint_url if self._endpoint_url else "Default")
+        details += os.linesep + "region: " + (self._region if self._region else "Default")
+        details += os.linesep + "part size: " + to_str(self._part_size // (1024 * 1024)) + "MiB"
+        details += os.linesep + "upload threads: " + to_str(self._upload_threads)
+        details += os.linesep + to_str(self.freq)
+        details += os.linesep + "encryption: " + (to_str(self._encryption) if self._encryption else "none")
+        return "S3 storage:" + os.linesep + indent(details)
+
+    def __eq__(self, other):
+        if not isinstance(other, S3Storage):
+            return False
+        if other._cache_key != self._cache_key or other._storage_class != self._storage_class:
+            return False
+        if other._part_size != self._part_size or other._upload_threads != self._upload_threads:
+            return False
+        return other._region == self._region and self._freq == other._freq
+
+    @property
+    def listing_key(self):
+        return "S3Storage:" + self._cache_key
+
+    @property
+    def _cache_key(self):
+        return "|".join([self._endpoint_url or "", self._bucket, self._prefix])
+
+    def _get_client(self):
+        return AwsClients.get_boto3('s3', self._region, self._endpoint_url)
+
+    def _find_identical(self, action_fullname, key, digest):
+        """
+        Check if the last archive of the action with the same extension has the content of a new archive
+
+        :param action_fullname:     The action full name
+        :type action_fullname:      str
+        :param key:                 The key of the new archive
+        :type key:                  str
+        :param digest:              The digests of the new archive
+        :type digest:               ArchiveDigest
+        :return:                    The key of the identical archive, None if there is none
+        :rtype:                     str|None
+        """
+        suffix = "_" + key[len(self._prefix):].split("_", 1)[1]
+        previous_keys = [previous_key for previous_key in self.list_archives(action_fullname)
+                         if previous_key.endswith(suffix) and previous_key != key]
+        if not previous_keys:
+            return None
+        previous_key = max(previous_keys)
+        try:
+            response = self._get_client().head_object(Bucket=self._bucket, Key=previous_key)
+        except StandardError as e:
+            log.warning("Unable to read the metadata of " + previous_key + " in " + self.small_descr + ": " + to_str(e))
+            return None
+        if response["ContentLength"] != digest.size:
+            return None
+        if response.get("Metadata", {}).get(S3Storage._SHA256_METADATA) != digest.sha256:
+            return None
+        return previous_key
+
+    def _list_keys(self):
+        """
+        :return:    The keys of the objects under the prefix, listed once per run
+        :rtype:     set[str]
+        """
+        with S3Storage._listing_lock:
+            if self._cache_key in S3Storage._listing_cache:
+                return set(S3Storage._listing_cache[self._cache_key])
+        keys = set()
+        paginator = self._get_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self._bucket, Prefix=self._prefix):
+            for item in page.get("Contents", []):
+                keys.add(item["Key"])
+        with S3Storage._listing_lock:
+            S3Storage._listing_cache[self._cache_key] = keys
+            return set(keys)
+
+
+class SshRemoteStorage(MemoryStorage):
+    """
+    Folder of another machine, archives are pushed with rsync in background while the next actions run
+    """
+    __slots__ = ("_user", "_host", "_folder", "_port", "_ssh_key", "_transfers", "_bwlimit")
+    DEFAULT_TRANSFERS = 2
+    _REMOVE_BATCH_SIZE = 200
+    # Every command to the same destination goes through one master connection
+    _CONTROL_PATH = "~/.backuper_ssh_%r@%h:%p"
+    # Transfer queues, by destination: shared by the storages of every action
+    _queues = {}
+    _queues_lock = threading.Lock()
+
+    def __init__(self, freq, user, host, folder, port=None, ssh_key=None, transfers=None, bwlimit=None):
+        """
+        :param bwlimit:     The maximum bandwidth of all the transfers, in KiB/s, None for no limit
+        :type bwlimit:      int|None
+        """
+        super(SshRemoteStorage, self).__init__(freq)
+        self._user = user
+        self._host = host
+        self._folder = folder.rstrip("/") if folder != "/" else folder
+        self._port = port
+        self._ssh_key = ssh_key
+        self._transfers = transfers if transfers else SshRemoteStorage.DEFAULT_TRANSFERS
+        self._bwlimit = bwlimit
+
+    def save(self, source_file, action_fullname, extension, digest=None):
+        dest_file = self._archive_name(action_fullname, extension)
+        # The source can be replaced by the next dump: keep our own link to its content until it is sent
+        fd, spool_file = tempfile.mkstemp("." + extension, ".bkp_push_", os.path.dirname(source_file))
+        os.close(fd)
+        os.remove(spool_file)
+        try:
+            os.link(source_file, spool_file)
+        except OSError:
+            check_run_cmd("cp", source_file, spool_file)
+        sha256 = digest.sha256 if digest is not None and self._encryption is None else None
+        self._get_queue().submit((action_fullname, dest_file), self._push, spool_file, dest_file, action_fullname,
+                                 sha256)
+
+    def wait_pending(self, action_fullname):
+        errors = self._get_queue().wait(lambda key: key[0] == action_fullname)
+        return dict([(archive, error) for (fullname, archive), error in errors.items()])
+
+    def list_archives(self, action_fullname=None):
+        cmd = self._get_ssh_args()
+        cmd.append("ls -1 " + shell_quote(self._folder))
+        results = []
+        for filename in to_str(check_run_cmd(*cmd)).splitlines():
+            filename = filename.strip()
+            if len(filename) < 10 or filename[8] != '_' or '_' in filename[0:8]:
+                continue
+            archive_date, archive_name = filename.split("_", 1)
+            if not re.match(r"^[0-9]{8}$", archive_date) or filename.endswith(".part"):
+                continue
+            if action_fullname and not archive_name.startswith(action_fullname+"."):
+                continue
+            results.append(self._folder.rstrip("/") + "/" + filename)
+        return results
+
+    def check_writable(self):
+        location = self.small_descr
+        cache_value = WriteTestCache.is_folder_success(location)
+        if cache_value is None:
+            test_file = shell_quote(self._folder.rstrip("/") + "/.backup_access_test")
+            cmd = self._get_ssh_args()
+            cmd.append("mkdir -p " + shell_quote(self._folder) + " && touch " + test_file + " && rm " + test_file +
+                       " && command -v rsync >/dev/null")
+            try:
+                check_run_cmd(*cmd)
+                WriteTestCache.set_folder_success(location, True)
+            except StandardError as e:
+                WriteTestCache.set_folder_success(location, False)
+                return ["Unable to write to " + location + ": " + to_str(e)]
+        elif not cache_value:
+            return ["Unable to write to " + location]
+        return []
+
+    def remove(self, archive_name):
+        cmd = self._get_ssh_args()
+        cmd.append("rm -f -- " + shell_quote(archive_name))
+        check_run_cmd(*cmd)
+
+    def remove_many(self, archives, progress=None, throttled=False):
+        errors = {}
+        # Throttled by batch, each batch is a single command
+        limiter = RateLimiter(self._get_remove_limits(throttled)[1])
+        for start in range(0, len(archives), SshRemoteStorage._REMOVE_BATCH_SIZE):
+            batch = archives[start:start + SshRemoteStorage._REMOVE_BATCH_SIZE]
+            limiter.wait()
+            cmd = self._get_ssh_args()
+            cmd.append("rm -f -- " + " ".join(map(shell_quote, batch)))
+            try:
+                check_run_cmd(*cmd)
+            except StandardError:
+                # Find out which ones failed
+                errors.update(run_concurrently(self.remove, batch, 1))
+            if progress is not None:
+                progress(min(start + SshRemoteStorage._REMOVE_BATCH_SIZE, len(archives)), len(archives))
+        return errors
+
+    def verify_many(self, archives, digests, progress=None):
+        # Hashed on the remote machine, several archives per command
+        errors = {}
+        for start in range(0, len(archives), SshRemoteStorage._REMOVE_BATCH_SIZE):
+            batch = archives[start:start + SshRemoteStorage._REMOVE_BATCH_SIZE]
+            cmd = self._get_ssh_args()
+            cmd.append("sha256sum -- " + " ".join(map(shell_quote, batch)))
+            code, out, err = run_cmd(*cmd)
+            sums = {}
+            for line in to_str(out).splitlines():
+                parts = line.split(None, 1)
+                if len(parts) == 2:
+                    sums[parts[1].lstrip("*")] = parts[0]
+            for archive in batch:
+                sha256 = digests[os.path.basename(archive)].sha256
+                if archive not in sums:
+                    errors[archive] = RuntimeError("unable to hash the archive: " + to_str(err).strip())
+                elif sums[archive] != sha256:
+                    errors[archive] = RuntimeError("sha256 is " + sums[archive] + " instead of " + sha256)
+            if progress is not None:
+                progress(min(start + SshRemoteStorage._REMOVE_BATCH_SIZE, len(archives)), len(archives))
+        return errors
+
+    @property
+    def small_descr(self):
+        return "remote folder " + self._user + "@" + self._host + ":" + self._folder
+
+    def __str__(self):
+        details = "destination: " + self._user + "@" + self._host + ":" + self._folder
+        details += os.linesep + "port: " + (to_str(self._port) if self._port else "Default")
+        details += os.linesep + "ssh key: " + (self._ssh_key if self._ssh_key else "Default")
+        details += os.linesep + "transfers: " + to_str(self._transfers)
+        details += os.linesep + "bandwidth limit: " + (to_str(self._bwlimit) + "KiB/s" if self._bwlimit else "none")
+        details += os.linesep + to_str(self.freq)
+        details += os.linesep + "encryption: " + (to_str(self._encryption) if self._encryption else "none")
+        return "Ssh remote storage:" + os.linesep + indent(details)
+
+    def __eq__(self, other):
+        if not isinstance(other, SshRemoteStorage):
+            return False
+        if (other._user, other._host, other._folder, other._port) != (self._user, self._host, self._folder,
+                                                                      self._port):
+            return False
+        if (other._ssh_key, other._transfers, other._bwlimit) != (self._ssh_key, self._transfers, self._bwlimit):
+            return False
+        return self._freq == other._freq
+
+    def _get_queue(self):
+        key = (self._user, self._host, self._port, self._folder)
+        with SshRemoteStorage._queues_lock:
+            if key not in SshRemoteStorage._queues:
+                SshRemoteStorage._queues[key] = TaskQueue(self._transfers)
+            return SshRemoteStorage._queues[key]
+
+    def _get_ssh_args(self, include_remote=True):
+        args = copy.copy(Action._SSH_CMD)
+        args.extend(["-o", "ControlMaster=auto", "-o", "ControlPersist=60",
+                     "-o", "ControlPath=" + os.path.expanduser(SshRemoteStorage._CONTROL_PATH)])
+        if self._port:
+            args.extend(["-p", to_str(self._port)])
+        if self._ssh_key:
+            args.extend(['-o', 'IdentitiesOnly=yes', '-i', self._ssh_key])
+        if include_remote:
+            args.append(self._user + "@" + self._host)
+        return args
+
+    def _push(self, spool_file, dest_file, action_fullname=None, sha256=None):
+        try:
+            if self._encryption is not None:
+                self._push_encrypted(spool_file, dest_file)
+                return
+            if sha256 is not None and self._link_identical(action_fullname, dest_file, sha256):
+                return
+            # Sent under a temporary name, renamed once complete: an interrupted push never leaves a truncated
+            # archive listed, and the partial file is resumed by the next push of the same archive
+            remote_file = self._folder.rstrip("/") + "/" + dest_file
+            # -s: the remote path is not interpreted by the remote shell
+            cmd = ["rsync", "-s", "--times", "--partial", "-e",
+                   " ".join(map(shell_quote, self._get_ssh_args(False)))]
+            if self._bwlimit:
+                cmd.append("--bwlimit=" + to_str(max(1, self._bwlimit // self._transfers)))
+            cmd.extend([spool_file, self._user + "@" + self._host + ":" + remote_file + ".part"])
+            log.info("pushing " + dest_file + " to " + self.small_descr + "...")
+            check_run_cmd(*cmd)
+            cmd = self._get_ssh_args()
+            cmd.append("mv -f -- " + shell_quote(remote_file + ".part") + " " + shell_quote(remote_file))
+            check_run_cmd(*cmd)
+            log.info(dest_file + " pushed to " + self.small_descr)
+        finally:
+            os.remove(spool_file)
+
+    def _link_identical(self, action_fullname, dest_file, sha256):
+        """
+        Hard link the last archive of the action with the same extension as the new archive, when it has its content
+
+        :param action_fullname:     The action full name
+        :type action_fullname:      str
+        :param dest_file:           The name of the new archive
+        :type dest_file:            str
+        :param sha256:              The SHA-256 digest of the new archive
+        :type sha256:               str
+        :return:                    True if the archive has been linked, False if it has to be sent
+        :rtype:                     bool
+        """
+        suffix = "_" + dest_file.split("_", 1)[1]
+        remote_file = self._folder.rstrip("/") + "/" + dest_file
+        previous_files = [archive for archive in self.list_archives(action_fullname)
+                          if archive.endswith(suffix) and archive != remote_file]
+        if not previous_files:
+            return False
+        previous_file = max(previous_files)
+        # Hashed on the remote machine: the archive doesn't cross the network
+        cmd = self._get_ssh_args()
+        cmd.append("sum=$(sha256sum < " + shell_quote(previous_file) + ") && [ \"${sum%% *}\" = " +
+                   shell_quote(sha256) + " ] && ln -f -- " + shell_quote(previous_file) + " " +
+                   shell_quote(remote_file + ".part") + " && mv -f -- " + shell_quote(remote_file + ".part") + " " +
+                   shell_quote(remote_file))
+        code, out, err = run_cmd(*cmd)
+        if code != 0:
+            return False
+        log.info(dest_file + " is identical to " + os.path.basename(previous_file) + ", linked in " +
+                 self.small_descr)
+        return True
+
+    def _push_encrypted(self, spool_file, dest_file):
+        # Encrypted while sent: rsync can't be used, and the bandwidth is not limited
+        remote_file = self._folder.rstrip("/") + "/" + dest_file
+        cmd = self._get_ssh_args()
+        cmd.append("cat > " + shell_quote(remote_file + ".part") + " && mv " + shell_quote(remote_file + ".part") +
+                   " " + shell_quote(remote_file))
+        cmd_str = "set -o pipefail; " + " ".join(map(shell_quote, self._encryption.get_cmd())) + " < " + \
+                  shell_quote(spool_file) + " | " + " ".join(map(shell_quote, cmd))
+        log.info("pushing " + dest_file + " to " + self.small_descr + "...")
+        check_run_cmd("bash", "-c", cmd_str)
+        log.info(dest_file + " pushed to " + self.small_descr)
+
+
 class Report(object):
     def __init__(self):
         self._server_issues = {}
@@ -1060,8 +3162,22 @@ class Report(object):
 
 
 class Action(object):
+    # No instance dict: thousands of them are created for large configs
+    __slots__ = ("_server_name", "_prefix", "_name", "_dest_folder", "_ssh_user", "_ssh_key", "_storage_list",
+                 "_transport_compression")
     _SSH_CMD = ["ssh", '-F', '/dev/null', '-o', 'UserKnownHostsFile=/dev/null', '-o', 'StrictHostKeyChecking=no',
                 '-o', 'BatchMode=yes', "-o", "LogLevel=ERROR"]
+    # Shell snippet compressing its input with the fastest available tool
+    _REMOTE_COMPRESS_CMD = "if command -v pigz >/dev/null 2>&1; then pigz; else gzip; fi"
+
+    # Where the data is compressed before crossing the network
+    TRANSPORT_REMOTE = "remote"  # On the server, with pigz if installed
+    TRANSPORT_LOCAL = "local"    # Shipped raw, compressed on the backup machine
+    TRANSPORT_SSH = "ssh"        # Compressed by ssh (or rsync) on the wire, archives compressed locally
+    TRANSPORT_AUTO = "auto"      # Chosen from the link bandwidth and server load measured by previous runs
+    TRANSPORT_COMPRESSIONS = (TRANSPORT_REMOTE, TRANSPORT_LOCAL, TRANSPORT_SSH, TRANSPORT_AUTO)
+    # Key of the action state recording the digests of the archives
+    _DIGESTS_STATE_KEY = "digests"
 
     def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key):
         super(Action, self).__init__()
@@ -1072,6 +3188,7 @@ class Action(object):
         self._ssh_user = ssh_user
         self._ssh_key = ssh_key
         self._storage_list = []
+        self._transport_compression = Action.TRANSPORT_REMOTE
 
     @property
     def storage_list(self):
@@ -1081,6 +3198,51 @@ class Action(object):
     def add_storage(self, storage):
         self._storage_list.append(storage)
 
+    @property
+    def transport_compression(self):
+        return self._transport_compression
+
+    def set_transport_compression(self, transport_compression):
+        self._transport_compression = transport_compression
+
+    def _get_transport_compression(self):
+        """
+        Get the compression policy to use for this run, resolving the 'auto' policy
+
+        :return:        One of TRANSPORT_REMOTE, TRANSPORT_LOCAL or TRANSPORT_SSH
+        :rtype:         str
+        """
+        if self.is_local:
+            return Action.TRANSPORT_REMOTE
+        if self._transport_compression != Action.TRANSPORT_AUTO:
+            return self._transport_compression
+        try:
+            cmd = self._get_ssh_args()
+            cmd.append("nproc && cat /proc/loadavg")
+            cpu_count, load_avg = to_str(check_run_cmd(cmd)).splitlines()[0:2]
+            LinkStats.record_cpu_headroom(self._server_name, int(cpu_count) - float(load_avg.split()[0]))
+        except (StandardError, ValueError) as e:
+            log.warning(self.small_descr + ": unable to measure server load: " + to_str(e))
+        compression = LinkStats.choose_compression(self._server_name)
+        log.info(self.small_descr + ": " + indent() + "using " + compression + " compression")
+        return compression
+
+    def _get_rsync_transport_args(self, compression):
+        """
+        Get the rsync arguments to fetch data from the server, according to the compression policy
+
+        :param compression:     One of TRANSPORT_REMOTE, TRANSPORT_LOCAL or TRANSPORT_SSH
+        :type compression:      str
+        :rtype:                 list[str]
+        """
+        if self.is_local:
+            return []
+        ssh_args = self._get_ssh_args(False, compression == Action.TRANSPORT_SSH)
+        args = ["-e", " ".join(map(shell_quote, ssh_args))]
+        if compression == Action.TRANSPORT_REMOTE:
+            args.append("-z")
+        return args
+
     @property
     def server_name(self):
         return self._server_name
@@ -1113,6 +3275,103 @@ class Action(object):
     def run_backup(self):
         raise NotImplemented(self.__class__.__name__ + "::run_backup")
 
+    def is_chained_archive(self, archive):
+        """
+        Tell if an archive can only be restored on top of the previous archives of this action
+
+        :param archive:     The archive name or path, as returned by MemoryStorage.list_archives
+        :type archive:      str
+        :return:            True if the archive depends on the previous ones
+        :rtype:             bool
+        """
+        return False
+
+    def get_projected_size(self):
+        """
+        Estimate the size of the next archive from the history: the biggest recorded archive, or the newest archive
+        of a local storage when no digest was recorded yet
+
+        :return:    The estimated size in bytes, 0 without history
+        :rtype:     int
+        """
+        sizes = [digest.size for digest in self.get_digests().values() if digest.size]
+        if sizes:
+            return max(sizes)
+        for storage in self._storage_list:
+            if storage.is_local():
+                archives = storage.list_archives(self.full_name)
+                if archives:
+                    return os.path.getsize(archives[-1])
+        return 0
+
+    def get_work_folders(self):
+        """
+        :return:    The folders receiving a copy of the archive while it is produced, besides the local storages
+        :rtype:     list[str]
+        """
+        return [self._dest_folder]
+
+    def record_digest(self, archive_name, digest):
+        """
+        Record the digests of an archive, computed while it was produced
+
+        :param archive_name:    The archive name, without encryption extension
+        :type archive_name:     str
+        :param digest:          The digests of the archive content
+        :type digest:           ArchiveDigest
+        """
+        digests = self._load_state().get(Action._DIGESTS_STATE_KEY) or {}
+        digests[archive_name] = digest.to_dict()
+        self._save_state(Action._DIGESTS_STATE_KEY, digests)
+
+    def get_digests(self):
+        """
+        :return:    The recorded digests, by archive name
+        :rtype:     dict[str, ArchiveDigest]
+        """
+        digests = self._load_state().get(Action._DIGESTS_STATE_KEY) or {}
+        return dict([(name, ArchiveDigest.from_dict(values)) for name, values in digests.items()])
+
+    def prune_digests(self, archive_names):
+        """
+        Forget the digests of the archives no storage holds anymore
+
+        :param archive_names:   The names of the archives still stored, without encryption extension
+        :type archive_names:    set[str]
+        """
+        digests = self._load_state().get(Action._DIGESTS_STATE_KEY) or {}
+        kept = dict([(name, values) for name, values in digests.items() if name in archive_names])
+        if len(kept) != len(digests):
+            self._save_state(Action._DIGESTS_STATE_KEY, kept)
+
+    def _get_state_file(self):
+        return os.path.join(self._dest_folder, "." + self.full_name + ".state")
+
+    def _load_state(self):
+        """
+        Load the data the previous runs recorded for this action
+
+        :return:        The recorded state, an empty dict if nothing was recorded
+        :rtype:         dict[str, any]
+        """
+        state_file = self._get_state_file()
+        if not os.path.exists(state_file):
+            return {}
+        try:
+            with open(state_file, "r") as fh:
+                return json.load(fh)
+        except (StandardError, ValueError) as e:
+            log.warning(self.small_descr + ": ignoring invalid state file " + state_file + ": " + to_str(e))
+            return {}
+
+    def _save_state(self, key, value):
+        state = self._load_state()
+        state[key] = value
+        state_file = self._get_state_file()
+        with open(state_file + ".tmp", "w") as fh:
+            json.dump(state, fh, indent=2, sort_keys=True)
+        os.rename(state_file + ".tmp", state_file)
+
     def check_dest_access(self):
         detected_errors = []
         detected_errors.extend(Action.check_folder_writable(self._dest_folder))
@@ -1123,14 +3382,42 @@ class Action(object):
                 detected_errors.append(to_str(e))
         return detected_errors
 
-    def _get_ssh_args(self, include_remote=True):
+    def _get_ssh_args(self, include_remote=True, compression=False):
         args = copy.copy(Action._SSH_CMD)
+        if compression:
+            args.append("-C")
         if self._ssh_key:
             args.extend(['-o', 'IdentitiesOnly=yes', '-i', self._ssh_key])
         if include_remote:
             args.append(self._ssh_user + "@" + self._server_name)
         return args
 
+    def _record_rsync_stats(self, rsync_output, duration):
+        """
+        Record the link bandwidth from the output of a rsync --stats command
+
+        :param rsync_output:    The standard output of rsync
+        :type rsync_output:     str|bytes
+        :param duration:        The duration of the transfer, in seconds
+        :type duration:         float
+        """
+        if self.is_local:
+            return
+        match = re.search(r"Total bytes received: ([0-9,.]+)", to_str(rsync_output))
+        if match:
+            LinkStats.record_transfer(self._server_name, int(re.sub(r"[,.]", "", match.group(1))), duration)
+
+    def _quote_arg(self, arg):
+        """
+        Quote an argument of a command run with check_run_cmd, if this command is interpreted by a remote shell
+
+        :param arg:     The argument to protect
+        :type arg:      str
+        :return:        The argument, quoted if needed
+        :rtype:         str
+        """
+        return arg if self.is_local else shell_quote(arg)
+
     def _check_ssh_connection(self):
         cmd = self._get_ssh_args()
         cmd.extend(["echo", "ping_test"])
@@ -1159,6 +3446,8 @@ class Action(object):
 
 
 class FileAction(Action):
+    __slots__ = ("_remote_folder", "_exclusions")
+
     def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, remote_folder, exclusions):
         super(FileAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key)
         self._remote_folder = remote_folder
@@ -1182,25 +3471,34 @@ class FileAction(Action):
         detected_errors.extend(self._check_folder_readable(self._remote_folder, self._exclusions))
         return detected_errors
 
+    def get_work_folders(self):
+        # The tarball is written in place in a local storage, or in a temporary file
+        for storage in self.storage_list:
+            if storage.should_save() and storage.is_local() and storage.encryption is None:
+                return []
+        return [tempfile.gettempdir()]
+
     def run_backup(self):
         log.info(self.small_descr+": Starting backup...")
 
         log.info(self.small_descr + ": " + indent() + "fetching data...")
-        cmd = ["rsync", "--delete", "-a", "-og", "--chown="+getpass.getuser()]
-        if not self.is_local:
-            cmd.extend(["-e", " ".join(map(shell_quote, self._get_ssh_args(False)))])
+        import getpass
+        cmd = ["rsync", "--delete", "-a", "-og", "--chown="+getpass.getuser(), "--stats"]
+        cmd.extend(self._get_rsync_transport_args(self._get_transport_compression()))
         for exclusion in self._exclusions:
             cmd += ["--exclude="+exclusion[len(self.remote_folder)+1:]]
         src = self._remote_folder if self.is_local else self._ssh_user+"@"+self._server_name+":"+self._remote_folder
         cmd.extend([src, os.path.join(self._dest_folder, self.full_name)])
-        check_run_cmd(cmd)
+        start_time = time.time()
+        out = check_run_cmd(cmd)
+        self._record_rsync_stats(out, time.time() - start_time)
         check_run_cmd("touch", os.path.join(self._dest_folder, self.full_name, ".backup_date"))
         log.info(self.small_descr+": " + indent() + "data fetch")
 
         log.info(self.small_descr + ": " + indent() + "compressing data...")
         local_storage = None
         for storage in self.storage_list:
-            if storage.should_save() and storage.is_local():
+            if storage.should_save() and storage.is_local() and storage.encryption is None:
                 local_storage = storage
                 break
 
@@ -1216,9 +3514,12 @@ class FileAction(Action):
             cmd = ["nice", "-2", "tar", "-c"]
             if Pigz.is_installed():
                 cmd.append("--use-compress-program=pigz")
-            cmd.extend(["-C", self._dest_folder, '-f', archive_filename, self.full_name])
-            check_run_cmd(cmd)
-            log.info(self.small_descr + ": " + indent() + "data compressed")
+            cmd.extend(["-C", self._dest_folder, '-f', '-', self.full_name])
+            digest = run_cmd_to_file(cmd, archive_filename)
+            if local_storage:
+                local_storage.add_archive(archive_filename)
+            self.record_digest(MemoryStorage.archive_name(self.full_name, "tgz"), digest)
+            log.info(self.small_descr + ": " + indent() + "data compressed, sha256: " + digest.sha256)
 
             log.info(self.small_descr + ": " + indent() + "saving data...")
             for storage in self.storage_list:
@@ -1226,7 +3527,7 @@ class FileAction(Action):
                     continue
                 log.info(self.small_descr + ": " + indent() + indent() + "saving on " + storage.small_descr + "...")
                 if storage != local_storage:
-                    storage.save(archive_filename, self.full_name, "tgz")
+                    storage.save(archive_filename, self.full_name, "tgz", digest)
                 log.info(self.small_descr + ": " + indent() + indent() + "saved on " + storage.small_descr)
             log.info(self.small_descr + ": " + indent() + "data saved")
 
@@ -1243,6 +3544,7 @@ class FileAction(Action):
         details += os.linesep + "exclusions: " + ", ".join([shell_quote(f) for f in self._exclusions])
         details += os.linesep + "ssh user: " + (self._ssh_user if self._ssh_user else "Default")
         details += os.linesep + "ssh key: " + (self._ssh_key if self._ssh_key else "Default")
+        details += os.linesep + "transport compression: " + self._transport_compression
         details += os.linesep + "local destination: " + self._dest_folder
         details += os.linesep + "storage_list: "
         if self._storage_list:
@@ -1273,30 +3575,393 @@ class FileAction(Action):
         return []
 
 
-class DbAction(Action):
-    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port):
-        super(DbAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key)
-        self._db_user = db_user
-        self._db_name = db_name
-        self._db_port = db_port
+class DbAction(Action):
+    __slots__ = ("_db_user", "_db_name", "_db_port", "_options")
+    # Folder, relative to the ssh user home, where dumps are written when fetched with delta transfer
+    _STAGING_FOLDER = ".backuper_staging"
+    DELTA_TRANSFER_MODES = ("no", "raw", "rsyncable")
+    _DELTA_EXTENSION = "xdelta"
+    _CHUNK_SIZE = 1024 * 1024
+    _DELTA_STATE_KEY = "delta_chain"
+    _PROBE_STATE_KEY = "change_probe"
+
+    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port,
+                 options=None):
+        super(DbAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key)
+        self._db_user = db_user
+        self._db_name = db_name
+        self._db_port = db_port
+        self._options = options if options else {}
+
+    def run_backup(self):
+        log.info(self.small_descr+": Starting backup...")
+
+        log.info(self.small_descr + ": " + indent() + "fetching data...")
+        ext = self._get_extension()+".gz"
+        if self._options.get("delta_storage"):
+            local_archive = os.path.join(self._dest_folder, self.full_name + "." + ext)
+            digest = self._save_database(local_archive)
+            log.info(self.small_descr + ": " + indent() + "data fetch, sha256: " + digest.sha256)
+            self._save_delta_on_storages(local_archive, ext, digest)
+        elif self._options.get("skip_unchanged"):
+            self._dump_if_changed(ext)
+        else:
+            self._dump_and_save(ext)
+        log.info(self.small_descr + ": Backup completed")
+
+    def _dump_if_changed(self, ext):
+        """
+        Probe the database for changes, and save the previous dump again instead of dumping the database when nothing
+        changed since it was taken
+
+        :param ext:     The extension of the dump
+        :type ext:      str
+        """
+        fingerprint = self._get_change_fingerprint()
+        probe_state = self._load_state().get(DbAction._PROBE_STATE_KEY)
+        if fingerprint is not None and probe_state and probe_state["fingerprint"] == fingerprint:
+            previous_dump, digest = self._find_previous_dump(probe_state, ext)
+            if previous_dump is not None:
+                log.info(self.small_descr + ": " + indent() + "unchanged since " + probe_state["archive"] +
+                         ", reusing " + previous_dump)
+                self._save_on_storages(previous_dump, ext, digest)
+                return
+            log.info(self.small_descr + ": " + indent() + "unchanged, but the previous dump is no longer available")
+        if probe_state:
+            # The local dump is about to be replaced: forget it until the new dump is complete
+            self._save_state(DbAction._PROBE_STATE_KEY, None)
+        # Truncated, for the file systems keeping the modification times in seconds
+        start_time = int(time.time())
+        self._dump_and_save(ext)
+        if fingerprint is None:
+            return
+        archive_name = MemoryStorage.archive_name(self.full_name, ext)
+        digest = self.get_digests().get(archive_name)
+        files = {}
+        if digest is not None:
+            # The local copies written by this dump: reused by the next runs without reading them again
+            for candidate in self._get_dump_candidates(archive_name, ext):
+                signature = DbAction._get_file_signature(candidate)
+                if signature is not None and signature[0] == digest.size and signature[1] >= start_time:
+                    files[candidate] = signature
+        self._save_state(DbAction._PROBE_STATE_KEY, {
+            "fingerprint": fingerprint,
+            "archive": archive_name,
+            "size": digest.size if digest is not None else None,
+            "sha256": digest.sha256 if digest is not None else None,
+            "tree_hash": digest.tree_hash if digest is not None else None,
+            "files": files,
+        })
+
+    def _get_change_fingerprint(self):
+        """
+        Get a digest of the database change markers, taken before the dump
+
+        :return:        The digest, None if the database can't be probed
+        :rtype:         str|None
+        """
+        try:
+            return hashlib.sha256(self._probe_changes()).hexdigest()
+        except StandardError as e:
+            log.warning(self.small_descr + ": unable to probe the database for changes, dumping it: " + to_str(e))
+            return None
+
+    def _probe_changes(self):
+        """
+        Read markers which change whenever the database content changes, without reading the data itself
+
+        :rtype:     bytes
+        """
+        raise NotImplementedError(self.__class__.__name__ + "::_probe_changes")
+
+    def _find_previous_dump(self, probe_state, ext):
+        """
+        Find a local copy of the dump recorded along with the last fingerprint. A copy is only reused when its content
+        is the one of the recorded dump: a file left by another run (a dump streamed without local copy, an older
+        dump) is never saved again as the current dump.
+
+        A copy whose size, modification time and inode are the recorded ones is not read again.
+
+        :param probe_state:     The recorded probe, with the 'archive' name, the 'size', the 'sha256' and the
+                                'tree_hash' of the dump, and the signatures of its local copies
+        :type probe_state:      dict[str, any]
+        :param ext:             The extension of the dump
+        :type ext:              str
+        :return:                The dump file and its digests, None if no intact copy remains
+        :rtype:                 (str|None, ArchiveDigest|None)
+        """
+        size, sha256, tree_hash = probe_state.get("size"), probe_state.get("sha256"), probe_state.get("tree_hash")
+        if sha256 is None:
+            # Recorded before the digests were kept along with the probe
+            digest = self.get_digests().get(probe_state["archive"])
+            if digest is None or digest.size != size:
+                return None, None
+            sha256, tree_hash = digest.sha256, digest.tree_hash
+        signatures = probe_state.get("files") or {}
+        candidates = [(candidate, DbAction._get_file_signature(candidate))
+                      for candidate in self._get_dump_candidates(probe_state["archive"], ext)]
+        for candidate, signature in candidates:
+            if tree_hash is not None and signature is not None and signatures.get(candidate) == signature:
+                # Unmodified since its digests were computed
+                return candidate, ArchiveDigest(sha256, tree_hash, size)
+        for candidate, signature in candidates:
+            if signature is None or signature[0] != size:
+                continue
+            digest = ArchiveDigest.of_file(candidate)
+            if digest.sha256 == sha256:
+                signatures[candidate] = signature
+                self._save_state(DbAction._PROBE_STATE_KEY, dict(probe_state, files=signatures))
+                return candidate, digest
+            log.info(self.small_descr + ": " + indent() + candidate + " is not the recorded dump")
+        return None, None
+
+    def _get_dump_candidates(self, archive_name, ext):
+        """
+        :return:    The local files which may hold a dump: the dump of the destination folder, and the archive of the
+                    local storages
+        :rtype:     list[str]
+        """
+        candidates = [os.path.join(self._dest_folder, self.full_name + "." + ext)]
+        for storage in self.storage_list:
+            if storage.is_local():
+                candidates.extend([archive for archive in storage.list_archives(self.full_name)
+                                   if os.path.basename(archive) == archive_name])
+        return candidates
+
+    @staticmethod
+    def _get_file_signature(filename):
+        """
+        :return:    The size, modification time and inode of a file, None if it is not a file
+        :rtype:     list[int|float]|None
+        """
+        if not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        # A list, as read back from the state file
+        return [stat.st_size, stat.st_mtime, stat.st_ino]
+
+    def _dump_and_save(self, ext):
+        """
+        Dump the database and save the dump on the storages
+
+        :param ext:     The extension of the dump
+        :type ext:      str
+        """
+        if self._options.get("stream"):
+            self._stream_database(ext)
+            return
+        local_archive = os.path.join(self._dest_folder, self.full_name + "." + ext)
+        digest = self._save_database(local_archive)
+        log.info(self.small_descr + ": " + indent() + "data fetch, sha256: " + digest.sha256)
+        self._save_on_storages(local_archive, ext, digest)
+
+    def _stream_database(self, ext):
+        """
+        Dump the database and write the dump on every storage able to receive a stream in a single pass.
+        The other storages save the dump once written, from the local copy.
+
+        :param ext:     The extension of the dump
+        :type ext:      str
+        """
+        log.info(self.small_descr + ": " + indent() + "streaming dump to storages...")
+        writers = []
+        spool_file = None
+        remaining_storages = []
+        try:
+            try:
+                if self._options.get("keep_dump", True):
+                    writers.append(ArchiveFileWriter(os.path.join(self._dest_folder, self.full_name + "." + ext)))
+                projected = self.get_projected_size()
+                for storage in self.storage_list:
+                    if not storage.should_save():
+                        continue
+                    writer = storage.open_writer(self.full_name, ext, projected)
+                    if writer is None:
+                        remaining_storages.append(storage)
+                    else:
+                        writers.append(writer)
+                local_files = [writer.filename for writer in writers if isinstance(writer, ArchiveFileWriter)]
+                if remaining_storages and not local_files:
+                    # Some storages can only read a file: spool the dump on the disk of the destination folder
+                    fd, spool_file = tempfile.mkstemp("." + ext, ".bkp_spool_", self._dest_folder)
+                    os.close(fd)
+                    writers.append(ArchiveFileWriter(spool_file))
+                    local_files.append(spool_file)
+
+                digest = self._run_dump_stream(writers)
+                for writer in writers:
+                    writer.close()
+                writers = []
+            finally:
+                for writer in writers:
+                    try:
+                        writer.abort()
+                    except StandardError as e:
+                        log.warning(self.small_descr + ": unable to abort an archive: " + to_str(e))
+            log.info(self.small_descr + ": " + indent() + "dump streamed, sha256: " + digest.sha256)
+            self.record_digest(MemoryStorage.archive_name(self.full_name, ext), digest)
 
-    def run_backup(self):
-        log.info(self.small_descr+": Starting backup...")
+            for storage in remaining_storages:
+                log.info(self.small_descr + ": " + indent() + indent() + "saving on " + storage.small_descr + "...")
+                storage.save(local_files[0], self.full_name, ext, digest)
+                log.info(self.small_descr + ": " + indent() + indent() + "saved on " + storage.small_descr)
+        finally:
+            if spool_file is not None and os.path.exists(spool_file):
+                os.remove(spool_file)
 
-        log.info(self.small_descr + ": " + indent() + "fetching data...")
-        ext = self._get_extension()+".gz"
-        local_archive = os.path.join(self._dest_folder, self.full_name+"."+ext)
-        self._save_database(local_archive)
-        log.info(self.small_descr + ": " + indent() + "data fetch")
+    def _run_dump_stream(self, writers):
+        """
+        Run the dump and copy its compressed output to the writers, chunk by chunk
+
+        :param writers:     The archive writers
+        :type writers:      list[ArchiveFileWriter]
+        :return:            The digests of the compressed dump
+        :rtype:             ArchiveDigest
+        """
+        compression = self._get_transport_compression()
+        processes = []
+        digest = ArchiveDigest()
+        start_time = time.time()
+        with tempfile.TemporaryFile() as err_fh:
+            try:
+                if self.is_local:
+                    cmd_str = self._get_dump_shell_cmd()
+                    processes.append(subprocess.Popen(["bash", "-c", cmd_str], stdout=subprocess.PIPE, stderr=err_fh))
+                elif compression == Action.TRANSPORT_REMOTE:
+                    cmd = self._get_ssh_args()
+                    cmd.append(self._get_dump_shell_cmd())
+                    cmd_str = " ".join(map(shell_quote, cmd))
+                    processes.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_fh))
+                else:
+                    cmd = self._get_ssh_args(True, compression == Action.TRANSPORT_SSH)
+                    cmd.append(self._get_dump_shell_cmd(False))
+                    compress_cmd = ["pigz" if Pigz.is_installed() else "gzip", "-c"]
+                    cmd_str = " ".join(map(shell_quote, cmd)) + " | " + " ".join(compress_cmd)
+                    processes.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_fh))
+                    processes.append(subprocess.Popen(compress_cmd, stdin=processes[0].stdout,
+                                                      stdout=subprocess.PIPE, stderr=err_fh))
+                    processes[0].stdout.close()
+                stream = processes[-1].stdout
+                while True:
+                    chunk = stream.read(DbAction._CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    for writer in writers:
+                        writer.write(chunk)
+            except BaseException:
+                for process in processes:
+                    if process.poll() is None:
+                        process.kill()
+                raise
+            finally:
+                exit_codes = [process.wait() for process in processes]
+            if [code for code in exit_codes if code != 0]:
+                err_fh.seek(0)
+                error = "Command failed with exit code " + to_str(max(exit_codes)) + os.linesep
+                error += "  Command: " + cmd_str
+                err = to_str(err_fh.read()).strip()
+                if err:
+                    error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
+                raise RuntimeError(error)
+        if compression == Action.TRANSPORT_REMOTE and not self.is_local:
+            LinkStats.record_transfer(self._server_name, digest.size, time.time() - start_time)
+        return digest
+
+    def is_chained_archive(self, archive):
+        return archive.endswith("." + DbAction._DELTA_EXTENSION)
+
+    def _save_delta_on_storages(self, dump_file, ext, digest):
+        """
+        Save the dump as a keyframe, or as a binary delta against the previous dump when the current chain of deltas
+        can be extended
+
+        :param dump_file:       The gzipped dump
+        :type dump_file:        str
+        :param ext:             The extension of the gzipped dump
+        :type ext:              str
+        :param digest:          The digests of the gzipped dump
+        :type digest:           ArchiveDigest
+        """
+        raw_ext = ext[:-len(".gz")]
+        current_raw = os.path.join(self._dest_folder, "." + self.full_name + "." + raw_ext + ".current")
+        previous_raw = os.path.join(self._dest_folder, "." + self.full_name + "." + raw_ext + ".previous")
+        decompress_cmd = "pigz" if Pigz.is_installed() else "gzip"
+        check_run_cmd("sh", "-c", "nice -2 " + decompress_cmd + " -dc " + shell_quote(dump_file) + " > " +
+                      shell_quote(current_raw))
+        try:
+            chain_state = self._load_state().get(DbAction._DELTA_STATE_KEY)
+            if self._need_keyframe(chain_state, previous_raw):
+                log.info(self.small_descr + ": " + indent() + "storing a keyframe")
+                archive_file = dump_file
+                archive_ext = ext
+                chain_state = {"base": MemoryStorage.archive_name(self.full_name, ext),
+                               "base_date": TimeReference.get().strftime("%Y%m%d")}
+            else:
+                log.info(self.small_descr + ": " + indent() + "computing delta against previous dump...")
+                archive_ext = raw_ext + "." + DbAction._DELTA_EXTENSION
+                archive_file = os.path.join(self._dest_folder, self.full_name + "." + archive_ext)
+                digest = run_cmd_to_file(["nice", "-2", "xdelta3", "-e", "-c", "-9", "-s", previous_raw, current_raw],
+                                         archive_file)
+            self._save_on_storages(archive_file, archive_ext, digest)
+            chain_state["last"] = MemoryStorage.archive_name(self.full_name, archive_ext)
+            self._save_state(DbAction._DELTA_STATE_KEY, chain_state)
+            os.rename(current_raw, previous_raw)
+        finally:
+            if os.path.exists(current_raw):
+                os.remove(current_raw)
+
+    def _need_keyframe(self, chain_state, previous_raw):
+        if not chain_state or not os.path.exists(previous_raw):
+            return True
+        base_date = datetime.datetime.strptime(chain_state["base_date"], "%Y%m%d").date()
+        if (TimeReference.get().date() - base_date).days >= self._options["delta_storage"]:
+            return True
+        if chain_state["last"].startswith(TimeReference.get().strftime("%Y%m%d") + "_"):
+            return True
+        for storage in self.storage_list:
+            # Start a new chain when a storage is about to expire the base, so it can really be deleted later
+            if storage.should_save() and not storage.should_keep(chain_state["base"]):
+                return True
+        return not self._is_chain_complete(chain_state)
+
+    def _save_on_storages(self, local_archive, ext, digest):
         log.info(self.small_descr + ": " + indent() + "saving data...")
+        self.record_digest(MemoryStorage.archive_name(self.full_name, ext), digest)
         for storage in self.storage_list:
             if not storage.should_save():
                 continue
             log.info(self.small_descr + ": " + indent() + indent() + "saving on " + storage.small_descr + "...")
-            storage.save(local_archive, self.full_name, ext)
+            storage.save(local_archive, self.full_name, ext, digest)
             log.info(self.small_descr + ": " + indent() + indent() + "saved on " + storage.small_descr)
         log.info(self.small_descr + ": " + indent() + "data saved")
-        log.info(self.small_descr + ": Backup completed")
+
+    @property
+    def options(self):
+        return self._options
+
+    def _is_chain_complete(self, chain_state):
+        """
+        Check every storage which will save today's archive already holds the archives of the current chain
+
+        :param chain_state:     The chain information, with the 'base' and 'last' archive names
+        :type chain_state:      dict[str, any]
+        :return:                True if a new chained archive can be stored on every storage
+        :rtype:                 bool
+        """
+        for storage in self.storage_list:
+            if not storage.should_save():
+                continue
+            names = set([AgeEncryption.plain_name(os.path.basename(archive))
+                         for archive in storage.list_archives(self.full_name)])
+            if chain_state["base"] not in names or chain_state["last"] not in names:
+                return False
+        return True
+
+    def _get_options_str(self):
+        if not self._options:
+            return "none"
+        return ", ".join([key + "=" + to_str(self._options[key]) for key in sorted(self._options.keys())])
 
     @property
     def database(self):
@@ -1313,68 +3978,304 @@ class DbAction(Action):
     def _get_extension(self):
         return "sql"
 
+    def _get_dump_cmd(self):
+        """
+        Get the command writing the uncompressed database dump on its standard output
+
+        :rtype:     list[str]
+        """
+        raise NotImplemented(self.__class__.__name__+"::_get_dump_cmd")
+
+    def _get_dump_shell_cmd(self, compress=True):
+        """
+        Get the shell command to run on the database server to dump the database
+
+        :param compress:    Should the dump be gzipped? Optional, default True
+        :type compress:     bool
+        :return:            The shell command, writing the dump on its standard output
+        :rtype:             str
+        """
+        cmd_str = " ".join(map(shell_quote, self._get_dump_cmd()))
+        if compress:
+            cmd_str = "set -o pipefail; " + cmd_str + " | " + Action._REMOTE_COMPRESS_CMD
+        return cmd_str
+
     def _save_database(self, dest_file):
-        raise NotImplemented(self.__class__.__name__+"::_save_database")
+        """
+        Dump the database in a local gzipped file
+
+        :param dest_file:   The local file receiving the dump
+        :type dest_file:    str
+        :return:            The digests of the gzipped dump
+        :rtype:             ArchiveDigest
+        """
+        compression = self._get_transport_compression()
+        start_time = time.time()
+        if self._options.get("delta_transfer", "no") != "no" and not self.is_local:
+            return self._save_database_delta(dest_file, compression)
+        elif compression == Action.TRANSPORT_REMOTE:
+            digest = self._run_dump_cmd(self._get_dump_shell_cmd(), dest_file)
+            if not self.is_local:
+                LinkStats.record_transfer(self._server_name, digest.size, time.time() - start_time)
+        else:
+            byte_count, digest = self._run_raw_dump_cmd(self._get_dump_shell_cmd(False), dest_file,
+                                                        compression == Action.TRANSPORT_SSH)
+            LinkStats.record_transfer(self._server_name, byte_count, time.time() - start_time)
+        return digest
+
+    def _run_raw_dump_cmd(self, dump_cmd_str, dest_file, ssh_compression):
+        """
+        Run a dump command on the database server, fetch its raw output and compress it locally
+
+        :param dump_cmd_str:        The shell command to run on the database server
+        :type dump_cmd_str:         str
+        :param dest_file:           The local file receiving the compressed dump
+        :type dest_file:            str
+        :param ssh_compression:     Should ssh compress the data on the wire?
+        :type ssh_compression:      bool
+        :return:                    The number of bytes received from the server, and the digests of the local file
+        :rtype:                     (int, ArchiveDigest)
+        """
+        cmd = self._get_ssh_args(True, ssh_compression)
+        cmd.append(dump_cmd_str)
+        compress_cmd = ["pigz" if Pigz.is_installed() else "gzip", "-c"]
+        byte_count = 0
+        digest = ArchiveDigest()
+        copy_errors = []
+        dump_finished = False
+        with tempfile.TemporaryFile() as err_fh, tempfile.TemporaryFile() as compress_err_fh:
+            with open(dest_file, "wb") as out_fh:
+                dump_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_fh)
+                compress_process = subprocess.Popen(compress_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                    stderr=compress_err_fh)
+
+                def copy_output():
+                    try:
+                        digest.copy(compress_process.stdout, out_fh)
+                    except BaseException as e:
+                        copy_errors.append(e)
+                        compress_process.kill()
+
+                # The compressed output is hashed and written while the raw dump is fed to the compressor
+                copy_thread = threading.Thread(target=copy_output)
+                copy_thread.daemon = True
+                copy_thread.start()
+                try:
+                    while True:
+                        chunk = dump_process.stdout.read(DbAction._CHUNK_SIZE)
+                        if not chunk:
+                            dump_finished = True
+                            break
+                        byte_count += len(chunk)
+                        try:
+                            compress_process.stdin.write(chunk)
+                        except (IOError, OSError):
+                            # The compressor exited: its exit code and error output are reported below
+                            break
+                finally:
+                    try:
+                        compress_process.stdin.close()
+                    except (IOError, OSError):
+                        pass
+                    if not dump_finished and dump_process.poll() is None:
+                        # Interrupted, or nothing receives the dump anymore: don't wait for the end of the remote dump
+                        dump_process.kill()
+                    dump_process.stdout.close()
+                    dump_exit_code = dump_process.wait()
+                    # With a timeout, so that the main thread stays interruptible on python 2
+                    while copy_thread.is_alive():
+                        copy_thread.join(1.0)
+                    compress_process.stdout.close()
+                    compress_exit_code = compress_process.wait()
+            if copy_errors:
+                raise copy_errors[0]
+            if compress_exit_code != 0:
+                raise RuntimeError(DbAction._format_cmd_error(compress_cmd, compress_exit_code, compress_err_fh))
+            if dump_exit_code != 0 or not dump_finished:
+                raise RuntimeError(DbAction._format_cmd_error(cmd, dump_exit_code, err_fh))
+        return byte_count, digest
+
+    @staticmethod
+    def _format_cmd_error(cmd, exit_code, err_fh):
+        """
+        :param cmd:         The failed command
+        :type cmd:          list[str]
+        :param exit_code:   Its exit code
+        :type exit_code:    int
+        :param err_fh:      The temporary file which received its error output
+        :type err_fh:       any
+        :rtype:             str
+        """
+        err_fh.seek(0)
+        error = "Command failed with exit code " + to_str(exit_code) + os.linesep
+        error += "  Command: " + " ".join(map(shell_quote, cmd))
+        err = to_str(err_fh.read()).strip()
+        if err:
+            error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
+        return error
+
+    def _run_dump_cmd(self, dump_cmd_str, dest_file):
+        """
+        Run a dump command on the database server and write its output in a local file
+
+        :param dump_cmd_str:    The shell command to run on the database server
+        :type dump_cmd_str:     str
+        :param dest_file:       The local file receiving the dump
+        :type dest_file:        str
+        :return:                The digests of the local file
+        :rtype:                 ArchiveDigest
+        """
+        if self.is_local:
+            # bash: the local dump command relies on pipefail
+            cmd = ["bash", "-c", dump_cmd_str]
+        else:
+            cmd = self._get_ssh_args()
+            cmd.append(dump_cmd_str)
+        return run_cmd_to_file(cmd, dest_file)
+
+    def _save_database_delta(self, dest_file, compression):
+        """
+        Dump the database in a staging file on the server, then fetch it with rsync, so only the blocks which changed
+        since the previous dump are transferred.
+        In 'raw' mode, the uncompressed dump is kept in the destination folder as reference for the next transfer and
+        compressed locally. In 'rsyncable' mode, the dump is compressed with gzip --rsyncable on the server.
+
+        :param dest_file:       The local gzipped dump file
+        :type dest_file:        str
+        :param compression:     The transport compression policy
+        :type compression:      str
+        :return:                The digests of the local gzipped dump
+        :rtype:                 ArchiveDigest
+        """
+        if self._options["delta_transfer"] == "rsyncable":
+            local_copy = dest_file
+            dump_cmd_str = "set -o pipefail; " + self._get_dump_shell_cmd(False) + " | gzip --rsyncable"
+            # The delta is already made of compressed data
+            compression = Action.TRANSPORT_LOCAL
+        else:
+            local_copy = dest_file[:-len(".gz")] if dest_file.endswith(".gz") else dest_file + ".raw"
+            dump_cmd_str = self._get_dump_shell_cmd(False)
+        staging_file = DbAction._STAGING_FOLDER + "/" + os.path.basename(local_copy)
+
+        log.info(self.small_descr + ": " + indent() + indent() + "dumping to staging file on server...")
+        cmd = self._get_ssh_args()
+        cmd.append("mkdir -p " + DbAction._STAGING_FOLDER + " && { " + dump_cmd_str + " ; } > " +
+                   shell_quote(staging_file + ".tmp") + " && mv " + shell_quote(staging_file + ".tmp") + " " +
+                   shell_quote(staging_file))
+        check_run_cmd(cmd)
+        try:
+            log.info(self.small_descr + ": " + indent() + indent() + "fetching changes since previous dump...")
+            cmd = ["rsync", "--inplace", "--no-whole-file", "--times", "--stats"]
+            cmd.extend(self._get_rsync_transport_args(compression))
+            cmd.extend([self._ssh_user + "@" + self._server_name + ":" + staging_file, local_copy])
+            start_time = time.time()
+            out = check_run_cmd(cmd)
+            self._record_rsync_stats(out, time.time() - start_time)
+        finally:
+            cmd = self._get_ssh_args()
+            cmd.extend(["rm", "-f", shell_quote(staging_file)])
+            check_run_cmd(cmd)
+
+        if local_copy == dest_file:
+            # Patched in place by rsync: read it once
+            return ArchiveDigest.of_file(dest_file)
+        log.info(self.small_descr + ": " + indent() + indent() + "compressing dump...")
+        compress_cmd = "pigz" if Pigz.is_installed() else "gzip"
+        return run_cmd_to_file(["nice", "-2", compress_cmd, "-c", local_copy], dest_file)
 
 
 class MySqlAction(DbAction):
-    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port):
+    __slots__ = ()
+    # Tables of the current database the current user has no SELECT privilege on, globally, on the schema or on the
+    # table itself
+    _UNREADABLE_TABLES_QUERY = (
+        "SELECT t.TABLE_NAME FROM information_schema.TABLES t "
+        "CROSS JOIN (SELECT CONCAT('''', SUBSTRING_INDEX(CURRENT_USER(), '@', 1), '''@''', "
+        "SUBSTRING_INDEX(CURRENT_USER(), '@', -1), '''') AS name) grantee "
+        "WHERE t.TABLE_SCHEMA = DATABASE() "
+        "AND NOT EXISTS (SELECT 1 FROM information_schema.USER_PRIVILEGES p "
+        "WHERE p.GRANTEE = grantee.name AND p.PRIVILEGE_TYPE = 'SELECT') "
+        "AND NOT EXISTS (SELECT 1 FROM information_schema.SCHEMA_PRIVILEGES p "
+        "WHERE p.GRANTEE = grantee.name AND p.PRIVILEGE_TYPE = 'SELECT' AND t.TABLE_SCHEMA LIKE p.TABLE_SCHEMA) "
+        "AND NOT EXISTS (SELECT 1 FROM information_schema.TABLE_PRIVILEGES p "
+        "WHERE p.GRANTEE = grantee.name AND p.PRIVILEGE_TYPE = 'SELECT' AND p.TABLE_SCHEMA = t.TABLE_SCHEMA "
+        "AND p.TABLE_NAME = t.TABLE_NAME)"
+    )
+
+    # Definition and update times of the tables and routines of the current database
+    _CHANGE_MARKERS_QUERY = (
+        "SELECT TABLE_NAME, TABLE_TYPE, IFNULL(ENGINE, ''), IFNULL(CREATE_TIME, ''), IFNULL(UPDATE_TIME, '') "
+        "FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME; "
+        "SELECT ROUTINE_TYPE, ROUTINE_NAME, LAST_ALTERED FROM information_schema.ROUTINES "
+        "WHERE ROUTINE_SCHEMA = DATABASE() ORDER BY ROUTINE_TYPE, ROUTINE_NAME"
+    )
+
+    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port,
+                 options=None):
         super(MySqlAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name,
-                                          db_port)
+                                          db_port, options)
 
     @property
     def db_type(self):
         return "mysql"
 
-    def _save_database(self, dest_file):
-        dump_cmd = ['mysqldump', '-u', self._db_user, "-h", "localhost", "--port="+to_str(self._db_port),
-                    '--databases', self._db_name]
-
-        if self.is_local:
-            cmd_str = "set -o pipefail; "+" ".join(map(shell_quote, dump_cmd)) + " | gzip > "+shell_quote(dest_file)
-        else:
-            cmd = self._get_ssh_args()
-            cmd.append("set -o pipefail; "+" ".join(map(shell_quote, dump_cmd)) + " | gzip")
-            cmd_str = " ".join(map(shell_quote, cmd)) + " > "+shell_quote(dest_file)
-        pipes = subprocess.Popen(cmd_str, stderr=subprocess.PIPE, shell=True)
-        std_out, std_err = pipes.communicate()
-        exit_code = pipes.returncode
-        if exit_code != 0:
-            error = "Command failed with exit code " + to_str(exit_code) + os.linesep
-            error += "  Command: " + cmd_str
-            err = to_str(std_err).strip()
-            if err:
-                error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
-            raise RuntimeError(error)
+    def _get_dump_cmd(self):
+        return ['mysqldump', '-u', self._db_user, "-h", "localhost", "--port="+to_str(self._db_port),
+                '--databases', self._db_name]
 
     def check_src_access(self):
         server_description = "local machine" if self.is_local else "server " + self._server_name
-        cmd = [] if self.is_local else self._get_ssh_args()
-        cmd.extend(["mysql", '--batch', '-D', self._db_name, '-b', "-s", "-N", "-P", to_str(self._db_port),
-                    '-u', self._db_user, "-e", shell_quote("SHOW TABLES")])
+        cmd = self._get_mysql_cmd(MySqlAction._UNREADABLE_TABLES_QUERY)
         try:
-            table_list = to_str(check_run_cmd(*cmd)).splitlines()
+            candidates = [table for table in to_str(check_run_cmd(*cmd)).splitlines() if table]
         except StandardError as e:
             return ["Unable to connect to mysql database " + self._db_name + " on " + server_description + ": " +
                     to_str(e)]
-        error_list = []
-        for table in table_list:
-            try:
-                cmd = [] if self.is_local else self._get_ssh_args()
-                cmd.extend(["mysql", '--batch', '-D', self._db_name, '-b', "-s", "-N", "-P", to_str(self._db_port),
-                            '-u', self._db_user, "-e", shell_quote("SELECT * FROM `" + table + "` LIMIT 1")])
-                check_run_cmd(*cmd)
-            except StandardError as e:
-                error_list.append("Unable to read mysql table " + self._db_name + "." + table + " on " +
-                                  server_description + ": " + to_str(e))
-        return error_list
+        if not candidates:
+            return []
+
+        # Privileges granted through roles are not listed in the catalog: confirm by reading each table
+        errors = []
+        for table in candidates:
+            code, out, err = run_cmd(*self._get_mysql_cmd("SELECT 1 FROM `" + table.replace("`", "``") + "` LIMIT 0"))
+            if code != 0:
+                errors.append("Unable to read mysql table " + self._db_name + "." + table + " on " +
+                              server_description + ": " + to_str(err))
+        return errors
+
+    def _probe_changes(self):
+        # MySQL 8 caches the table statistics for a day, older servers and MariaDB don't know the setting
+        queries = "SET SESSION information_schema_stats_expiry = 0; " + MySqlAction._CHANGE_MARKERS_QUERY
+        code, out, err = run_cmd(*self._get_mysql_cmd(queries, force=True))
+        if code != 0 and (not out or "information_schema_stats_expiry" not in to_str(err)):
+            raise RuntimeError("Unable to read the change markers: " + to_str(err))
+        # Tables without update time (InnoDB before MySQL 8) are checksummed instead
+        to_checksum = []
+        for line in to_str(out).splitlines():
+            fields = line.split("\t")
+            if len(fields) == 5 and fields[1] == "BASE TABLE" and not fields[4]:
+                to_checksum.append("`" + fields[0].replace("`", "``") + "`")
+        if to_checksum:
+            out += b"\n" + check_run_cmd(*self._get_mysql_cmd("CHECKSUM TABLE " + ", ".join(to_checksum)))
+        return out
+
+    def _get_mysql_cmd(self, query, force=False):
+        cmd = [] if self.is_local else self._get_ssh_args()
+        cmd.extend(["mysql", '--batch', '-D', self._db_name, '-b', "-s", "-N", "-P", to_str(self._db_port),
+                    '-u', self._db_user])
+        if force:
+            cmd.append("--force")
+        cmd.extend(["-e", self._quote_arg(query)])
+        return cmd
 
     def __str__(self):
         details = "database name: " + self._db_name
         details += os.linesep + "database port: " + to_str(self._db_port)
         details += os.linesep + "database user: " + self._db_user
+        details += os.linesep + "options: " + self._get_options_str()
         details += os.linesep + "ssh user: " + (self._ssh_user if self._ssh_user else "Default")
         details += os.linesep + "ssh key: " + (self._ssh_key if self._ssh_key else "Default")
+        details += os.linesep + "transport compression: " + self._transport_compression
         details += os.linesep + "local destination: " + self._dest_folder
         details += os.linesep + "storage_list: "
         if self._storage_list:
@@ -1386,9 +4287,12 @@ class MySqlAction(DbAction):
 
 
 class PostgresAction(DbAction):
-    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port):
+    __slots__ = ()
+
+    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port,
+                 options=None):
         super(PostgresAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key,
-                                             db_user, db_name, db_port)
+                                             db_user, db_name, db_port, options)
 
     @property
     def db_type(self):
@@ -1401,57 +4305,52 @@ class PostgresAction(DbAction):
             db_name, db_schema = self._db_name.split("#", 2)
         else:
             db_name, db_schema = (self._db_name, None)
-        query = "SELECT schemaname || '#!#' || tablename FROM pg_catalog.pg_tables "
+        # Every relation pg_dump will read that the current user (or one of its roles) can't read
+        query = "SELECT n.nspname || '.' || c.relname FROM pg_catalog.pg_class c "
+        query += "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        query += "WHERE c.relkind IN ('r', 'p', 'v', 'm', 'S', 'f') "
         if db_schema is None:
-            query += "WHERE schemaname != 'pg_catalog' AND schemaname != 'information_schema';"
+            query += "AND n.nspname NOT IN ('pg_catalog', 'information_schema') "
+            query += "AND n.nspname NOT LIKE 'pg\\_toast%' AND n.nspname NOT LIKE 'pg\\_temp\\_%' "
         else:
-            query += "WHERE schemaname = '"+db_schema+"';"
-        cmd.extend(["psql", '-p', to_str(self._db_port), "-U", self._db_user, "-d", db_name, "-t", '-c',
-                    shell_quote(query)])
+            query += "AND n.nspname = '" + db_schema.replace("'", "''") + "' "
+        query += "AND (NOT has_schema_privilege(n.oid, 'USAGE') OR NOT has_table_privilege(c.oid, 'SELECT')) "
+        query += "ORDER BY 1;"
+        cmd.extend(["psql", '-p', to_str(self._db_port), "-U", self._db_user, "-d", db_name, "-t", "-A", '-c',
+                    self._quote_arg(query)])
         try:
             table_list = [table.strip() for table in to_str(check_run_cmd(*cmd)).strip().splitlines()]
         except StandardError as e:
             return ["Unable to connect to postgres database " + self._db_name + " on " + server_description + ": " +
                     to_str(e)]
-        error_list = []
-        for table in table_list:
-            try:
-                cmd = [] if self.is_local else self._get_ssh_args()
-                quoted_table = ".".join(['"'+el+'"' for el in table.split("#!#", 2)])
-                cmd.extend(["psql", '-p', to_str(self._db_port), "-U", self._db_user, "-d", db_name, "-t", '-c',
-                            shell_quote("SELECT * FROM " + quoted_table + " LIMIT 1")])
-                check_run_cmd(*cmd)
-            except StandardError as e:
-                error_list.append("Unable to read mysql table " + self._db_name + "." + table + " on " +
-                                  server_description + ": " + to_str(e))
-        return error_list
-
-    def _save_database(self, dest_file):
-        dump_cmd = ['pg_dump', "-h", "localhost", "-p", to_str(self._db_port), "-d", self._db_name]
+        return ["Unable to read postgres table " + db_name + "." + table + " on " + server_description
+                for table in table_list if table]
+
+    def _probe_changes(self):
+        # Tuples written in the database since the statistics were reset, including the catalogs (schema changes).
+        # A standby doesn't count the replayed changes: its replay position is used instead.
+        query = "SELECT d.tup_inserted, d.tup_updated, d.tup_deleted, d.stats_reset, pg_postmaster_start_time(), "
+        query += "CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()::text ELSE '' END "
+        query += "FROM pg_stat_database d WHERE d.datname = current_database();"
+        cmd = [] if self.is_local else self._get_ssh_args()
+        cmd.extend(["psql", '-p', to_str(self._db_port), "-U", self._db_user, "-d", self._db_name.split("#", 1)[0],
+                    "-t", "-A", '-c', self._quote_arg(query)])
+        out = check_run_cmd(*cmd)
+        if not out:
+            raise RuntimeError("No statistics for database " + self._db_name)
+        return out
 
-        if self.is_local:
-            cmd_str = "set -o pipefail; "+" ".join(map(shell_quote, dump_cmd)) + " | gzip > "+shell_quote(dest_file)
-        else:
-            cmd = self._get_ssh_args()
-            cmd.append("set -o pipefail; "+" ".join(map(shell_quote, dump_cmd)) + " | gzip")
-            cmd_str = " ".join(map(shell_quote, cmd)) + " > "+shell_quote(dest_file)
-        pipes = subprocess.Popen(cmd_str, stderr=subprocess.PIPE, shell=True)
-        std_out, std_err = pipes.communicate()
-        exit_code = pipes.returncode
-        if exit_code != 0:
-            error = "Command failed with exit code " + to_str(exit_code) + os.linesep
-            error += "  Command: " + cmd_str
-            err = to_str(std_err).strip()
-            if err:
-                error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
-            raise RuntimeError(error)
+    def _get_dump_cmd(self):
+        return ['pg_dump', "-h", "localhost", "-p", to_str(self._db_port), "-d", self._db_name]
 
     def __str__(self):
         details = "database name: " + self._db_name
         details += os.linesep + "database port: " + to_str(self._db_port)
         details += os.linesep + "database user: " + self._db_user
+        details += os.linesep + "options: " + self._get_options_str()
         details += os.linesep + "ssh user: " + (self._ssh_user if self._ssh_user else "Default")
         details += os.linesep + "ssh key: " + (self._ssh_key if self._ssh_key else "Default")
+        details += os.linesep + "transport compression: " + self._transport_compression
         details += os.linesep + "local destination: " + self._dest_folder
         details += os.linesep + "storage_list: "
         if self._storage_list:
@@ -1463,9 +4362,39 @@ class PostgresAction(DbAction):
 
 
 class MongoDbAction(DbAction):
-    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port):
+    __slots__ = ("_oplog_since",)
+    ALL_DATABASES = "*"
+    READ_PREFERENCES = ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest")
+    _OPLOG_EXTENSION = "mongo-oplog"
+    # Print the collections of the 'dbNames' databases the connected user has no 'find' privilege on
+    _UNREADABLE_COLLECTIONS_SCRIPT = (
+        "var authInfo = db.runCommand({connectionStatus: 1, showPrivileges: true}).authInfo;"
+        "var privileges = authInfo.authenticatedUserPrivileges || [];"
+        "var authEnabled = authInfo.authenticatedUsers.length > 0;"
+        "function canFind(dbName, coll) {"
+        "  return privileges.some(function(p) {"
+        "    var r = p.resource;"
+        "    if (p.actions.indexOf('find') < 0) { return false; }"
+        "    if (r.anyResource) { return true; }"
+        "    if (r.cluster || r.db === undefined) { return false; }"
+        "    if (r.db !== '' && r.db !== dbName) { return false; }"
+        "    if (r.collection === '') { return coll.indexOf('system.') !== 0; }"
+        "    return r.collection === coll;"
+        "  });"
+        "}"
+        "dbNames.forEach(function(dbName) {"
+        "  db.getSiblingDB(dbName).getCollectionInfos({}, true).forEach(function(c) {"
+        "    if (authEnabled && c.type !== 'view' && !canFind(dbName, c.name)) { print(dbName + '.' + c.name); }"
+        "  });"
+        "});"
+    )
+    _OPLOG_STATE_KEY = "mongo_oplog"
+
+    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name, db_port,
+                 options=None):
         super(MongoDbAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_user, db_name,
-                                            db_port)
+                                            db_port, options)
+        self._oplog_since = None
 
     @property
     def db_type(self):
@@ -1474,42 +4403,146 @@ class MongoDbAction(DbAction):
     def check_src_access(self):
         server_description = "local machine" if self.is_local else "server " + self._server_name
         cmd = [] if self.is_local else self._get_ssh_args()
-        cmd.extend(["mongo", '--port', to_str(self._db_port), self._db_name, '--eval',
-                    shell_quote("printjson(db.getCollectionNames())")])
+        if self._db_name == MongoDbAction.ALL_DATABASES:
+            script = "var dbNames = db.adminCommand({listDatabases: 1, nameOnly: true}).databases"
+            script += ".map(function(d) { return d.name; }).filter(function(n) { return n != 'local'; });"
+        else:
+            script = "var dbNames = [" + json.dumps(self._db_name) + "];"
+        script += MongoDbAction._UNREADABLE_COLLECTIONS_SCRIPT
+        cmd.extend(["mongo", "--quiet", "--host", self._get_db_host(), '--port', to_str(self._db_port), "admin",
+                    '--eval', self._quote_arg(script)])
         try:
-            check_run_cmd(*cmd)
+            collection_list = [line.strip() for line in to_str(check_run_cmd(*cmd)).splitlines()]
         except StandardError as e:
             return ["Unable to connect to mongo database " + self._db_name + " on " + server_description + ": " +
                     to_str(e)]
-        return []
+        return ["Unable to read mongo collection " + collection + " on " + server_description
+                for collection in collection_list if collection]
 
-    def _save_database(self, dest_file):
-        dump_cmd = ['mongodump', "--archive", "--gzip", "--host", "localhost", "--port="+to_str(self._db_port),
-                    "--db", self._db_name]
+    def run_backup(self):
+        if not self._options.get("incremental"):
+            return super(MongoDbAction, self).run_backup()
 
-        if self.is_local:
-            cmd_str = " ".join(map(shell_quote, dump_cmd)) + " > "+shell_quote(dest_file)
+        log.info(self.small_descr+": Starting backup...")
+        log.info(self.small_descr + ": " + indent() + "fetching data...")
+        chain_state = self._load_state().get(MongoDbAction._OPLOG_STATE_KEY)
+        oplog_ts = self._get_last_oplog_ts()
+        if self._need_full_dump(chain_state):
+            ext = self._get_extension() + ".gz"
+            self._dump_and_save(ext)
+            archive_name = MemoryStorage.archive_name(self.full_name, ext)
+            chain_state = {"base": archive_name, "base_date": TimeReference.get().strftime("%Y%m%d")}
         else:
-            cmd = self._get_ssh_args()
-            cmd.append(" ".join(map(shell_quote, dump_cmd)))
-            cmd_str = " ".join(map(shell_quote, cmd)) + " > "+shell_quote(dest_file)
-        pipes = subprocess.Popen(cmd_str, stderr=subprocess.PIPE, shell=True)
-        std_out, std_err = pipes.communicate()
-        exit_code = pipes.returncode
-        if exit_code != 0:
-            error = "Command failed with exit code " + to_str(exit_code) + os.linesep
-            error += "  Command: " + cmd_str
-            err = to_str(std_err).strip()
-            if err:
-                error += os.linesep + "  Error output:" + os.linesep + indent(err, indent_str="    ")
-            raise RuntimeError(error)
+            log.info(self.small_descr + ": " + indent() + "dumping oplog since last backup...")
+            ext = MongoDbAction._OPLOG_EXTENSION + ".gz"
+            self._oplog_since = chain_state["last_ts"]
+            try:
+                self._dump_and_save(ext)
+            finally:
+                self._oplog_since = None
+            archive_name = MemoryStorage.archive_name(self.full_name, ext)
+
+        chain_state["last"] = archive_name
+        chain_state["last_ts"] = oplog_ts
+        self._save_state(MongoDbAction._OPLOG_STATE_KEY, chain_state)
+        log.info(self.small_descr + ": Backup completed")
+
+    def is_chained_archive(self, archive):
+        if os.path.basename(archive).endswith("." + MongoDbAction._OPLOG_EXTENSION + ".gz"):
+            return True
+        return super(MongoDbAction, self).is_chained_archive(archive)
+
+    def _need_full_dump(self, chain_state):
+        if not chain_state:
+            return True
+        base_date = datetime.datetime.strptime(chain_state["base_date"], "%Y%m%d").date()
+        if (TimeReference.get().date() - base_date).days >= self._options.get("full_dump_interval", 7):
+            return True
+        if chain_state["last"].startswith(TimeReference.get().strftime("%Y%m%d") + "_"):
+            # Already saved today: the new archive would replace a link of the chain
+            return True
+        return not self._is_chain_complete(chain_state)
+
+    def _get_db_host(self):
+        return self._options.get("host", "localhost")
+
+    def _get_last_oplog_ts(self):
+        """
+        Get the timestamp of the last operation written in the replica set oplog
+
+        :return:        The timestamp as a [seconds, increment] list
+        :rtype:         list[int]
+        """
+        query = 'var op = db.getSiblingDB("local").oplog.rs.find({}, {ts: 1}).sort({$natural: -1}).limit(1).next();'
+        query += ' print(op.ts.t + " " + op.ts.i);'
+        cmd = [] if self.is_local else self._get_ssh_args()
+        cmd.extend(["mongo", "--quiet", "--host", self._get_db_host(), '--port', to_str(self._db_port)])
+        if self._options.get("read_preference"):
+            query = "db.getMongo().setReadPref('" + self._options["read_preference"] + "'); " + query
+        cmd.extend(["--eval", self._quote_arg(query)])
+        try:
+            seconds, increment = to_str(check_run_cmd(*cmd)).strip().splitlines()[-1].split()
+            return [int(seconds), int(increment)]
+        except (ValueError, IndexError):
+            raise RuntimeError("Unable to read the oplog of mongo database " + self._db_name +
+                               ", incremental backups require a replica set")
+
+    def _probe_changes(self):
+        # Last write in the oplog, ignoring the periodic no-op entries and the session bookkeeping
+        if self._db_name == MongoDbAction.ALL_DATABASES:
+            ns_regex = "^(?!config\\.)"
+        else:
+            ns_regex = "^" + re.escape(self._db_name) + "\\."
+        oplog_filter = json.dumps({"op": {"$ne": "n"}, "ns": {"$regex": ns_regex}}, sort_keys=True)
+        query = 'var local = db.getSiblingDB("local");'
+        query += ' if (local.getCollectionNames().indexOf("oplog.rs") < 0) { throw new Error("no oplog"); }'
+        query += ' var ops = local.oplog.rs.find(' + oplog_filter + ', {ts: 1})'
+        query += '.sort({$natural: -1}).limit(1).toArray();'
+        query += ' print(ops.length ? ops[0].ts.t + " " + ops[0].ts.i : "none");'
+        if self._options.get("read_preference"):
+            query = "db.getMongo().setReadPref('" + self._options["read_preference"] + "'); " + query
+        cmd = [] if self.is_local else self._get_ssh_args()
+        cmd.extend(["mongo", "--quiet", "--host", self._get_db_host(), '--port', to_str(self._db_port),
+                    "--eval", self._quote_arg(query)])
+        lines = to_str(check_run_cmd(*cmd)).strip().splitlines()
+        if not lines:
+            raise RuntimeError("Unable to read the oplog, change detection requires a replica set")
+        return lines[-1].encode("utf-8")
+
+    def _get_dump_cmd(self):
+        oplog_since = self._oplog_since
+        dump_cmd = ['mongodump', "--archive", "--host", self._get_db_host(), "--port="+to_str(self._db_port)]
+        if self._options.get("read_preference"):
+            dump_cmd.append("--readPreference=" + self._options["read_preference"])
+        if self._options.get("parallel_collections"):
+            dump_cmd.append("--numParallelCollections=" + to_str(self._options["parallel_collections"]))
+        if oplog_since is None:
+            if self._db_name != MongoDbAction.ALL_DATABASES:
+                dump_cmd.extend(["--db", self._db_name])
+            if self._options.get("oplog"):
+                dump_cmd.append("--oplog")
+        else:
+            query = {"ts": {"$gt": {"$timestamp": {"t": oplog_since[0], "i": oplog_since[1]}}}}
+            if self._db_name != MongoDbAction.ALL_DATABASES:
+                query["ns"] = {"$regex": "^" + re.escape(self._db_name) + "\\."}
+            dump_cmd.extend(["--db", "local", "--collection", "oplog.rs", "--query", json.dumps(query, sort_keys=True)])
+        return dump_cmd
+
+    def _get_dump_shell_cmd(self, compress=True):
+        # mongodump compresses the archive itself, so that it can be restored with mongorestore --gzip
+        dump_cmd = self._get_dump_cmd()
+        if compress:
+            dump_cmd.insert(2, "--gzip")
+        return " ".join(map(shell_quote, dump_cmd))
 
     def __str__(self):
         details = "database name: " + self._db_name
         details += os.linesep + "database port: " + to_str(self._db_port)
         details += os.linesep + "database user: " + self._db_user
+        details += os.linesep + "options: " + self._get_options_str()
         details += os.linesep + "ssh user: " + (self._ssh_user if self._ssh_user else "Default")
         details += os.linesep + "ssh key: " + (self._ssh_key if self._ssh_key else "Default")
+        details += os.linesep + "transport compression: " + self._transport_compression
         details += os.linesep + "local destination: " + self._dest_folder
         details += os.linesep + "storage_list: "
         if self._storage_list:
@@ -1523,9 +4556,92 @@ class MongoDbAction(DbAction):
         return "mongo"
 
 
+class SqliteAction(DbAction):
+    __slots__ = ()
+    # Copy the database with the online backup API, a few pages at a time so that writers are only blocked briefly,
+    # then write the copy on the standard output. Requires python 3.7+ on the database server.
+    _BACKUP_SCRIPT = """import os, shutil, sqlite3, sys, tempfile
+path, pages = sys.argv[1], int(sys.argv[2])
+if not os.path.isfile(path):
+    sys.exit("No sqlite database " + path)
+fd, tmp = tempfile.mkstemp(".sqlite")
+os.close(fd)
+try:
+    src = sqlite3.connect(path)
+    dst = sqlite3.connect(tmp)
+    src.backup(dst, pages=pages, sleep=0.05)
+    dst.close()
+    src.close()
+    with open(tmp, "rb") as fh:
+        shutil.copyfileobj(fh, sys.stdout.buffer)
+finally:
+    os.remove(tmp)
+"""
+    _CHECK_SCRIPT = """import sqlite3, sys
+sqlite3.Connection.backup
+open(sys.argv[1], "rb").close()
+sqlite3.connect(sys.argv[1]).execute("SELECT count(*) FROM sqlite_master").fetchall()
+"""
+    # Size and modification time of the database and of its write-ahead log
+    _PROBE_SCRIPT = """import os, sys
+for path in (sys.argv[1], sys.argv[1] + "-wal"):
+    if os.path.exists(path):
+        print(path + " " + str(os.stat(path).st_size) + " " + repr(os.stat(path).st_mtime))
+"""
+    DEFAULT_PAGES_PER_STEP = 256
+
+    def __init__(self, server_name, prefix, name, dest_folder, ssh_user, ssh_key, db_file, options=None):
+        super(SqliteAction, self).__init__(server_name, prefix, name, dest_folder, ssh_user, ssh_key, None, db_file,
+                                           None, options)
+
+    @property
+    def db_type(self):
+        return "sqlite"
+
+    def check_src_access(self):
+        server_description = "local machine" if self.is_local else "server " + self._server_name
+        try:
+            check_run_cmd(*self._get_python_cmd(SqliteAction._CHECK_SCRIPT))
+        except StandardError as e:
+            return ["Unable to read sqlite database " + self._db_name + " on " + server_description + ": " +
+                    to_str(e)]
+        return []
+
+    def _probe_changes(self):
+        return check_run_cmd(*self._get_python_cmd(SqliteAction._PROBE_SCRIPT))
+
+    def _get_python_cmd(self, script):
+        cmd = [] if self.is_local else self._get_ssh_args()
+        cmd.extend(["python3", "-c", self._quote_arg(script), self._quote_arg(self._db_name)])
+        return cmd
+
+    def _get_dump_cmd(self):
+        pages = self._options.get("pages_per_step", SqliteAction.DEFAULT_PAGES_PER_STEP)
+        return ["python3", "-c", SqliteAction._BACKUP_SCRIPT, self._db_name, to_str(pages)]
+
+    def __str__(self):
+        details = "database file: " + self._db_name
+        details += os.linesep + "options: " + self._get_options_str()
+        details += os.linesep + "ssh user: " + (self._ssh_user if self._ssh_user else "Default")
+        details += os.linesep + "ssh key: " + (self._ssh_key if self._ssh_key else "Default")
+        details += os.linesep + "transport compression: " + self._transport_compression
+        details += os.linesep + "local destination: " + self._dest_folder
+        details += os.linesep + "storage_list: "
+        if self._storage_list:
+            for storage in self._storage_list:
+                details += os.linesep + indent(to_str(storage))
+        else:
+            details += "none"
+        return "Sqlite action " + self.full_name + " on " + self.server_name + ": " + os.linesep + indent(details)
+
+    def _get_extension(self):
+        return "sqlite"
+
+
 class WriteTestCache(object):
     _folder_cache = {}
     _glacier_vault_cache = {}
+    _s3_cache = {}
 
     @staticmethod
     def is_folder_success(folder):
@@ -1553,6 +4669,19 @@ class WriteTestCache(object):
     def set_glacier_success(vault, value):
         WriteTestCache._glacier_vault_cache[vault] = value
 
+    @staticmethod
+    def is_s3_success(location):
+        """
+        :return: True if well tested, False if test failed, and None if not tested
+        """
+        if location in WriteTestCache._s3_cache.keys():
+            return WriteTestCache._s3_cache[location]
+        return None
+
+    @staticmethod
+    def set_s3_success(location, value):
+        WriteTestCache._s3_cache[location] = value
+
 
 class ReportTarget(object):
     def __init__(self):
@@ -1645,6 +4774,7 @@ class SyslogReportTarget(ReportTarget):
         if report.is_empty:
             return
 
+        import syslog
         _, content = self._format_report(report)
         syslog.openlog("backuper", logoption=syslog.LOG_PID)
         try:
@@ -1745,6 +4875,9 @@ class EmailReportTarget(ReportTarget):
     def report(self, report):
         if report.is_empty:
             return
+        import email.mime.text
+        import email.utils
+        import smtplib
         subject, content = self._format_report(report)
         msg = email.mime.text.MIMEText(content)
         msg['Subject'] = (self._email_prefix if self._email_prefix else "") + subject
@@ -1821,6 +4954,8 @@ class BackupFrequency(object):
         self._week = week
         self._month = month
         self._year = year
+        # Reference date and limits of the rules
+        self._limits = None
 
     def is_empty(self):
         for freq in [self._day, self._week, self._month, self._year]:
@@ -1842,47 +4977,59 @@ class BackupFrequency(object):
         :return:
         :rtype:             bool
         """
-        if self._day == BackupFrequency.ALL_VALUE:
+        day_limit, week_limit, month_limit, year_limit = self.get_limits()
+        if day_limit is not None and date >= day_limit:
+            return True
+        if week_limit is not None and date.isoweekday() == 1 and date >= week_limit:
             return True
-        if self._day != BackupFrequency.NO_VALUE:
-            elapsed_days = (TimeReference.get().date() - date).days + 1
-            if elapsed_days <= self._day:
-                return True
-        if date.isoweekday() == 1:
-            if self._week == BackupFrequency.ALL_VALUE:
-                return True
-            if self._week != BackupFrequency.NO_VALUE:
-                last_allowed_date = TimeReference.get().date()
-                delta = datetime.timedelta(days=last_allowed_date.isoweekday() + (7 * self._week) - 8)
-                last_allowed_date = last_allowed_date - delta
-                if date >= last_allowed_date:
-                    return True
         if date.day == 1:
-            if self._month == BackupFrequency.ALL_VALUE:
+            if month_limit is not None and date >= month_limit:
+                return True
+            if year_limit is not None and date.month == 1 and date >= year_limit:
                 return True
-            if self._month != BackupFrequency.NO_VALUE:
-                now = TimeReference.get().date()
-                last_allowed_date = datetime.date(
-                    year=now.year + int(math.floor((now.month - self._month)/12)),
-                    month=((now.month - self._month) % 12)+1,
-                    day=1
-                )
-                if date >= last_allowed_date:
-                    return True
-            if date.month == 1:
-                if self._year == BackupFrequency.ALL_VALUE:
-                    return True
-                if self._year != BackupFrequency.NO_VALUE:
-                    now = TimeReference.get().date()
-                    last_allowed_date = datetime.date(
-                        year=now.year - self._year + 1,
-                        month=1,
-                        day=1
-                    )
-                    if date >= last_allowed_date:
-                        return True
         return False
 
+    def is_strict(self, date):
+        """
+        Tell if an archive is required by the daily rule: the minimum history, kept whatever the free space
+
+        :type date:         datetime.date
+        :rtype:             bool
+        """
+        day_limit = self.get_limits()[0]
+        return day_limit is not None and date >= day_limit
+
+    def get_limits(self):
+        """
+        Get the oldest date kept by each rule, computed once per reference date
+
+        :return:    The day, week (mondays), month (first days) and year (first days) limits,
+                    None for a rule keeping nothing
+        :rtype:     (datetime.date|None, datetime.date|None, datetime.date|None, datetime.date|None)
+        """
+        now = TimeReference.get().date()
+        if self._limits is not None and self._limits[0] == now:
+            return self._limits[1]
+        day_limit = self._get_limit(self._day, lambda: now - datetime.timedelta(days=self._day - 1))
+        week_limit = self._get_limit(self._week, lambda: now - datetime.timedelta(
+            days=now.isoweekday() + (7 * self._week) - 8))
+        month_limit = self._get_limit(self._month, lambda: datetime.date(
+            year=now.year + int(math.floor((now.month - self._month)/12)),
+            month=((now.month - self._month) % 12)+1,
+            day=1
+        ))
+        year_limit = self._get_limit(self._year, lambda: datetime.date(year=now.year - self._year + 1, month=1, day=1))
+        self._limits = (now, (day_limit, week_limit, month_limit, year_limit))
+        return self._limits[1]
+
+    @staticmethod
+    def _get_limit(value, compute):
+        if value == BackupFrequency.ALL_VALUE:
+            return datetime.date.min
+        if value == BackupFrequency.NO_VALUE:
+            return None
+        return compute()
+
     @staticmethod
     def freq_to_str(value):
         if value == BackupFrequency.ALL_VALUE:
@@ -1903,6 +5050,7 @@ class MappingFunction(object):
     def __init__(self, filename, function_name=None):
         self._filename = filename
         self._function_name = function_name
+        import importlib
         old_path = copy.deepcopy(sys.path)
         try:
             module_name = os.path.splitext(os.path.basename(filename))[0]
@@ -1925,7 +5073,138 @@ class MappingFunction(object):
         return self._function(*args, **kwargs)
 
 
+class ConfigCache(object):
+    """
+    Static class keeping, from one run to another, the content of the config files once parsed and their includes
+    expanded. An entry is reused as long as none of the files it was read from changed, and every include pattern
+    matches the same files.
+    """
+    CACHE_FILE = os.path.expanduser("~/.backuper_config_cache")
+    # To change when the format of the cached data changes
+    _VERSION = 1
+
+    @staticmethod
+    def new_sources(config_file):
+        """
+        :param config_file:     The main config file
+        :type config_file:      str
+        :return:                The sources of a config, to fill with add_file and add_glob while it is read
+        :rtype:                 dict[str, any]
+        """
+        sources = {"files": {}, "globs": []}
+        ConfigCache.add_file(sources, config_file)
+        return sources
+
+    @staticmethod
+    def add_file(sources, filename):
+        stat = os.stat(filename)
+        sources["files"][os.path.abspath(filename)] = (stat.st_mtime, stat.st_size)
+
+    @staticmethod
+    def add_glob(sources, path, pattern, filenames):
+        sources["globs"].append((path, pattern, filenames))
+
+    @staticmethod
+    def get(config_file):
+        """
+        :param config_file:     The main config file
+        :type config_file:      str
+        :return:                The cached config data, None if it is not cached or outdated
+        :rtype:                 dict[str, any]|None
+        """
+        try:
+            with open(ConfigCache.CACHE_FILE, "rb") as fh:
+                cache = pickle.load(fh)
+            if cache["version"] != ConfigCache._VERSION:
+                return None
+            entry = cache.get("entries", {}).get(os.path.realpath(config_file))
+        except (IOError, OSError):
+            return None
+        except StandardError as e:
+            log.warning("Ignoring invalid config cache " + ConfigCache.CACHE_FILE + ": " + to_str(e))
+            return None
+        if entry is None or not ConfigCache._is_valid(entry["sources"]):
+            return None
+        return entry["data"]
+
+    @staticmethod
+    def put(config_file, data, sources):
+        """
+        Record the config data read from its sources. Should be called before the data is modified.
+        """
+        cache = {"version": ConfigCache._VERSION, "entries": {}}
+        try:
+            with open(ConfigCache.CACHE_FILE, "rb") as fh:
+                previous = pickle.load(fh)
+            if previous["version"] == ConfigCache._VERSION and isinstance(previous.get("entries"), dict):
+                cache = previous
+        except StandardError:
+            pass
+        cache["entries"][os.path.realpath(config_file)] = {"sources": sources, "data": data}
+        tmp_filename = None
+        try:
+            # A temp file per run, as several runs can save the cache at the same time (mkstemp creates it 0600)
+            fd, tmp_filename = tempfile.mkstemp(".tmp", os.path.basename(ConfigCache.CACHE_FILE) + ".",
+                                                os.path.dirname(ConfigCache.CACHE_FILE))
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(cache, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_filename, ConfigCache.CACHE_FILE)
+        except (IOError, OSError, pickle.PicklingError) as e:
+            log.warning("Unable to save config cache " + ConfigCache.CACHE_FILE + ": " + to_str(e))
+            if tmp_filename is not None and os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @staticmethod
+    def _is_valid(sources):
+        import glob
+        for filename, signature in sources["files"].items():
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                return False
+            if (stat.st_mtime, stat.st_size) != tuple(signature):
+                return False
+        for path, pattern, filenames in sources["globs"]:
+            if not os.path.isdir(path):
+                return False
+            with using_cwd(path):
+                if glob.glob(pattern) != filenames:
+                    return False
+        return True
+
+
+class PyYamlLoader(object):
+    """
+    The PyYAML loader: its module level load() requires an explicit Loader since PyYAML 6
+    """
+    @staticmethod
+    def load(fh):
+        import yaml
+        return yaml.safe_load(fh)
+
+
 class BackupConfig(object):
+    # Optional database settings: name => (value type, database types accepting it)
+    _DB_OPTIONS = {
+        "host": ("str", ("mongo",)),
+        "read_preference": (MongoDbAction.READ_PREFERENCES, ("mongo",)),
+        "parallel_collections": ("int", ("mongo",)),
+        "oplog": ("bool", ("mongo",)),
+        "incremental": ("bool", ("mongo",)),
+        "full_dump_interval": ("int", ("mongo",)),
+        "delta_transfer": (DbAction.DELTA_TRANSFER_MODES, ("mysql", "postgres", "mongo", "sqlite")),
+        "delta_storage": ("int", ("mysql", "postgres", "sqlite")),
+        "pages_per_step": ("int", ("sqlite",)),
+        "stream": ("bool", ("mysql", "postgres", "mongo", "sqlite")),
+        "keep_dump": ("bool", ("mysql", "postgres", "mongo", "sqlite")),
+        "skip_unchanged": ("bool", ("mysql", "postgres", "mongo", "sqlite")),
+    }
+    _S3_KEYS = ("bucket", "prefix", "memory", "storage_class", "endpoint_url", "region", "part_size",
+                "upload_threads", "encrypt_to")
+    _SSH_REMOTE_KEYS = ("destination", "memory", "port", "ssh_key", "transfers", "bwlimit", "encrypt_to")
+    # The yaml (or json) loader, found on the first config load
+    _loader = None
+
     def __init__(self, config_file):
         """
         :param config_file: 	The config file to load
@@ -1933,6 +5212,7 @@ class BackupConfig(object):
         """
         super(BackupConfig, self).__init__()
         self._actions, self._report_list = self._load_conf(config_file)
+        self._target_index = None
 
     @property
     def server_list(self):
@@ -1945,6 +5225,12 @@ class BackupConfig(object):
     def get_actions(self):
         return self._actions
 
+    def get_target_index(self):
+        """:rtype: TargetIndex"""
+        if self._target_index is None:
+            self._target_index = TargetIndex(self._actions)
+        return self._target_index
+
     def show(self, targets):
         output = "Actions: "+os.linesep
         output += (os.linesep+os.linesep).join([indent(to_str(a)) for a in targets])
@@ -1955,16 +5241,18 @@ class BackupConfig(object):
 
     @staticmethod
     def _get_loader():
+        if BackupConfig._loader is not None:
+            return BackupConfig._loader
         try:
             from ruamel.yaml import YAML
-            return YAML(typ='safe')
+            BackupConfig._loader = YAML(typ='safe')
         except ImportError:
             try:
-                import yaml
-                return yaml
+                import yaml  # noqa: F401
+                BackupConfig._loader = PyYamlLoader()
             except ImportError:
-                import json
-                return json
+                BackupConfig._loader = json
+        return BackupConfig._loader
 
     @staticmethod
     def _load_conf(config_file):
@@ -1976,23 +5264,26 @@ class BackupConfig(object):
         """
         actions = []
         report_targets = []
-        data = None
 
-        loader = BackupConfig._get_loader()
-        with open(config_file, "r") as fh:
-            try:
-                data = loader.load(fh)
-            except StandardError as e:
-                raise ConfigError("Invalid format for config file " + to_str(e))
+        data = ConfigCache.get(config_file)
+        if data is None:
+            sources = ConfigCache.new_sources(config_file)
+            loader = BackupConfig._get_loader()
+            with open(config_file, "r") as fh:
+                try:
+                    data = loader.load(fh)
+                except StandardError as e:
+                    raise ConfigError("Invalid format for config file " + to_str(e))
 
-        # First parsing, interpret the 'include' directives
-        data = BackupConfig._parse_includes(data, config_file, loader)
+            # First parsing, interpret the 'include' directives
+            data = BackupConfig._parse_includes(data, config_file, loader, sources)
+            ConfigCache.put(config_file, data, sources)
 
         # Secondary parsing, just organise data
         common_info = {}
         server_info_dict = {}
         report_info_list = []
-        common_keys = extract_keys(data, "ssh_user", "ssh_key", "dest_folder", "db_user")
+        common_keys = extract_keys(data, "ssh_user", "ssh_key", "dest_folder", "db_user", "transport_compression")
         for key, info in data.items():
             key = key.lower().strip()
             if not key:
@@ -2010,17 +5301,28 @@ class BackupConfig(object):
         # Third parsing: creating structures for data
         for server_name, info_list in server_info_dict.items():
             for info in info_list:
-                # Merge common information
-                server_info = copy.deepcopy(common_info)
+                # Merge common information, the sections are shared by the servers and must not be modified
+                server_info = dict(common_info)
                 server_info.update(info)
 
                 # Generate storage objects
                 storage_list = []
-                store_info = extract_keys(server_info, "local_history", "local_history_folder", "local_history_memory")
+                store_info = extract_keys(server_info, "local_history", "local_history_folder", "local_history_memory",
+                                          "local_history_encrypt_to", "local_history_index_file",
+                                          "local_history_min_free")
                 storage_list.extend(BackupConfig._parse_local_storage_list(store_info, server_name))
                 store_info = extract_keys(server_info, "aws_glacier", "aws_glacier_memory", "aws_glacier_vault",
-                                          "aws-glacier_index_file")
+                                          "aws_glacier_index_file", "aws_glacier_part_size",
+                                          "aws_glacier_upload_threads", "aws_glacier_encrypt_to")
                 storage_list.extend(BackupConfig._parse_glacier_storage_list(store_info, server_name))
+                store_info = extract_keys(server_info, "s3", *["s3_" + key for key in BackupConfig._S3_KEYS])
+                storage_list.extend(BackupConfig._parse_s3_storage_list(store_info, server_name))
+                store_info = extract_keys(server_info, "ssh_remote",
+                                          *["ssh_remote_" + key for key in BackupConfig._SSH_REMOTE_KEYS])
+                storage_list.extend(BackupConfig._parse_ssh_remote_storage_list(store_info, server_name))
+
+                transport_compression = BackupConfig._parse_transport_compression(
+                    extract_keys(server_info, "transport_compression"), server_name)
 
                 # Extract special information
                 files_info = extract_keys(server_info, "files")
@@ -2038,6 +5340,7 @@ class BackupConfig(object):
                     if is_dict(files_info):
                         if "exclude" in files_info.keys():
                             file_excludes = files_info['exclude']
+                            files_info = dict(files_info)
                             del files_info['exclude']
                     else:
                         raise ConfigError("Invalid 'files' section for server "+server_name+": "+repr(files_info))
@@ -2046,6 +5349,7 @@ class BackupConfig(object):
                     for name, file_info in files_info.items():
                         action = BackupConfig._parse_file_action_conf(server_name, name, server_info, file_info,
                                                                       file_excludes)
+                        action.set_transport_compression(transport_compression)
                         for storage in storage_list:
                             action.add_storage(storage)
                         actions.append(action)
@@ -2070,20 +5374,20 @@ class BackupConfig(object):
 
                     for name, db_info in databases_info.items():
                         action = BackupConfig._parse_db_action_conf(server_name, name, server_info, db_info, db_user)
+                        action.set_transport_compression(transport_compression)
                         for storage in storage_list:
                             action.add_storage(storage)
                         actions.append(action)
 
         # check if two actions does'nt have the same full_name
+        actions_by_name = {}
         for action in actions:
-            for other_action in actions:
-                if id(action) == id(other_action):
-                    continue
-                if action.full_name == other_action.full_name:
-                    raise ConfigError("Two actions have the same final archive name: " + os.linesep +
-                                      indent(to_str(action)) + os.linesep +
-                                      "is incompatible with:" + os.linesep +
-                                      indent(to_str(other_action)))
+            other_action = actions_by_name.setdefault(action.full_name, action)
+            if other_action is not action:
+                raise ConfigError("Two actions have the same final archive name: " + os.linesep +
+                                  indent(to_str(other_action)) + os.linesep +
+                                  "is incompatible with:" + os.linesep +
+                                  indent(to_str(action)))
 
         # Fourth parsing: creating structures for reports
         for report_info in report_info_list:
@@ -2115,47 +5419,55 @@ class BackupConfig(object):
         return actions, report_targets
 
     @staticmethod
-    def _parse_includes(data, config_file, loader):
+    def _parse_includes(data, config_file, loader, sources):
+        """
+        :param sources:     The sources of the config, updated with the included files, see ConfigCache.new_sources
+        :type sources:      dict[str, any]
+        """
         if is_array(data):
             result = []
             for element in data:
-                result = deep_merge(result, BackupConfig._parse_includes(element, config_file, loader))
+                result = deep_merge(result, BackupConfig._parse_includes(element, config_file, loader, sources))
             return result
         elif is_dict(data):
             if data.keys() == ["include"]:
                 path = os.path.abspath(os.path.dirname(config_file))
-                return BackupConfig._include(data["include"], path, loader)
+                return BackupConfig._include(data["include"], path, loader, sources)
             result = {}
             for key, val in data.items():
                 if key == "include":
                     continue
-                result[key] = BackupConfig._parse_includes(val, config_file, loader)
+                result[key] = BackupConfig._parse_includes(val, config_file, loader, sources)
             if "include" in data.keys():
                 path = os.path.abspath(os.path.dirname(config_file))
-                result = deep_merge(result, BackupConfig._include(data["include"], path, loader))
+                result = deep_merge(result, BackupConfig._include(data["include"], path, loader, sources))
             return result
         elif is_string(data):
             m = re.match(r"^include *(.*)$", data)
             if m:
                 path = os.path.abspath(os.path.dirname(config_file))
-                return BackupConfig._include(m.group(0), path, loader)
+                return BackupConfig._include(m.group(0), path, loader, sources)
             return data
         else:
             return data
 
     @staticmethod
-    def _include(file_pattern, path, loader):
+    def _include(file_pattern, path, loader, sources):
+        import glob
         results = None
         with using_cwd(path):
-            for filename in glob.glob(file_pattern):
+            filenames = glob.glob(file_pattern)
+            ConfigCache.add_glob(sources, path, file_pattern, filenames)
+            for filename in filenames:
                 full_filename = os.path.abspath(filename)
+                ConfigCache.add_file(sources, full_filename)
                 with open(filename, "r") as fh:
                     try:
                         result = loader.load(fh)
                     except Exception as e:
                         raise ConfigError("Invalid format for config file " + full_filename + ": " +
                                           os.linesep + indent(to_str(e)))
-                after_include = BackupConfig._parse_includes(result, full_filename, loader)
+                after_include = BackupConfig._parse_includes(result, full_filename, loader, sources)
                 results = deep_merge(results, after_include)
         return results
 
@@ -2170,7 +5482,9 @@ class BackupConfig(object):
                 raise ConfigError("Invalid 'local_history' parameter for server " + server_name)
             for key, val in sub_values.items():
                 key = to_str(key).lower().strip()
-                if key not in ("folder", "memory", "local_history_folder", "local_history_memory"):
+                if key not in ("folder", "memory", "encrypt_to", "index_file", "min_free", "local_history_folder",
+                               "local_history_memory", "local_history_encrypt_to", "local_history_index_file",
+                               "local_history_min_free"):
                     raise ConfigError("Unknown key local_history." + key + " for server " + server_name)
                 new_key = key if key.startswith("local_history_") else "local_history_"+key
                 info[new_key] = val
@@ -2186,7 +5500,18 @@ class BackupConfig(object):
         if not os.path.isabs(folder):
             raise ConfigError("local_history_folder for server " + server_name + " should be an absolute path")
         freq = BackupConfig._parse_freq(info["local_history_memory"])
-        return [LocalFolderStorage(freq, folder)]
+        index_file = info.get("local_history_index_file", False)
+        if not ll_bool(index_file):
+            raise ConfigError("Invalid 'local_history_index_file' parameter for server " + server_name)
+        min_free = None
+        if info.get("local_history_min_free") is not None:
+            try:
+                min_free = DiskSpace.parse_quota(info["local_history_min_free"])
+            except ValueError:
+                raise ConfigError("Invalid 'local_history_min_free' parameter for server " + server_name)
+        storage = LocalFolderStorage(freq, folder, to_bool(index_file), min_free)
+        storage.set_encryption(BackupConfig._parse_encryption(info, "local_history", server_name))
+        return [storage]
 
     @staticmethod
     def _parse_glacier_storage_list(info, server_name):
@@ -2199,8 +5524,9 @@ class BackupConfig(object):
                 raise ConfigError("Invalid 'aws_glacier' parameter for server " + server_name)
             for key, val in sub_values.items():
                 key = to_str(key).lower().strip()
-                if key not in ("vault", "memory", "index_file", "glacier_vault", "glacier_memory",
-                               "glacier_index_file"):
+                if key not in ("vault", "memory", "index_file", "part_size", "upload_threads", "encrypt_to",
+                               "glacier_vault", "glacier_memory", "glacier_index_file", "glacier_part_size",
+                               "glacier_upload_threads", "glacier_encrypt_to"):
                     raise ConfigError("Unknown key glacier." + key + " for server " + server_name)
                 new_key = key if key.startswith("aws_glacier_") else "aws_glacier_" + key
                 info[new_key] = val
@@ -2217,7 +5543,159 @@ class BackupConfig(object):
         index_file = os.path.expanduser("~/.glacier_index")
         if "aws_glacier_index_file" in info.keys():
             index_file = os.path.realpath(os.path.abspath(os.path.expanduser(info["aws_glacier_index_file"])))
-        return [GlacierStorage(freq, vault, index_file)]
+        part_size = None
+        if "aws_glacier_part_size" in info.keys():
+            # In MiB, glacier requires a power of two between 1MiB and 4GiB
+            part_size = info["aws_glacier_part_size"]
+            if not ll_int(part_size) or int(part_size) < 1 or int(part_size) > 4096 or \
+                    int(part_size) & (int(part_size) - 1):
+                raise ConfigError("invalid glacier part size for server " + server_name + ", it should be a power " +
+                                  "of two between 1 and 4096 (MiB): " + repr(part_size))
+            part_size = int(part_size) * 1024 * 1024
+        upload_threads = None
+        if "aws_glacier_upload_threads" in info.keys():
+            upload_threads = info["aws_glacier_upload_threads"]
+            if not ll_int(upload_threads) or int(upload_threads) < 1:
+                raise ConfigError("invalid glacier upload threads for server " + server_name + ": " +
+                                  repr(upload_threads))
+            upload_threads = int(upload_threads)
+        storage = GlacierStorage(freq, vault, index_file, part_size, upload_threads)
+        storage.set_encryption(BackupConfig._parse_encryption(info, "aws_glacier", server_name))
+        return [storage]
+
+    @staticmethod
+    def _parse_s3_storage_list(info, server_name):
+        if not info:
+            return []
+        if "s3" in info.keys():
+            sub_values = info["s3"]
+            del info["s3"]
+            if not is_dict(sub_values):
+                raise ConfigError("Invalid 's3' parameter for server " + server_name)
+            for key, val in sub_values.items():
+                key = to_str(key).lower().strip()
+                if key.startswith("s3_"):
+                    key = key[3:]
+                if key not in BackupConfig._S3_KEYS:
+                    raise ConfigError("Unknown key s3." + key + " for server " + server_name)
+                info["s3_" + key] = val
+
+        if "s3_bucket" not in info.keys():
+            raise ConfigError("Missing s3 bucket parameter for server " + server_name)
+        if "s3_memory" not in info.keys():
+            raise ConfigError("Missing s3 memory parameter for server " + server_name)
+        for key in ("bucket", "prefix", "storage_class", "endpoint_url", "region"):
+            if "s3_" + key in info.keys() and (not is_string(info["s3_" + key]) or
+                                               (key != "prefix" and not info["s3_" + key].strip())):
+                raise ConfigError("invalid s3 " + key + " parameter for server " + server_name)
+        freq = BackupConfig._parse_freq(info["s3_memory"])
+        prefix = info.get("s3_prefix", "").strip().lstrip("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        part_size = None
+        if "s3_part_size" in info.keys():
+            # In MiB, s3 parts can't be smaller than 5MiB
+            part_size = info["s3_part_size"]
+            if not ll_int(part_size) or int(part_size) < 5:
+                raise ConfigError("invalid s3 part size for server " + server_name + ", it should be at least " +
+                                  "5 (MiB): " + repr(part_size))
+            part_size = int(part_size) * 1024 * 1024
+        upload_threads = None
+        if "s3_upload_threads" in info.keys():
+            upload_threads = info["s3_upload_threads"]
+            if not ll_int(upload_threads) or int(upload_threads) < 1:
+                raise ConfigError("invalid s3 upload threads for server " + server_name + ": " +
+                                  repr(upload_threads))
+            upload_threads = int(upload_threads)
+        storage = S3Storage(freq, info["s3_bucket"].strip(), prefix, info.get("s3_storage_class"),
+                            info.get("s3_endpoint_url"), info.get("s3_region"), part_size, upload_threads)
+        storage.set_encryption(BackupConfig._parse_encryption(info, "s3", server_name))
+        return [storage]
+
+
+    @staticmethod
+    def _parse_ssh_remote_storage_list(info, server_name):
+        if not info:
+            return []
+        if "ssh_remote" in info.keys():
+            sub_values = info["ssh_remote"]
+            del info["ssh_remote"]
+            if not is_dict(sub_values):
+                raise ConfigError("Invalid 'ssh_remote' parameter for server " + server_name)
+            for key, val in sub_values.items():
+                key = to_str(key).lower().strip()
+                if key.startswith("ssh_remote_"):
+                    key = key[len("ssh_remote_"):]
+                if key not in BackupConfig._SSH_REMOTE_KEYS:
+                    raise ConfigError("Unknown key ssh_remote." + key + " for server " + server_name)
+                info["ssh_remote_" + key] = val
+
+        if "ssh_remote_destination" not in info.keys():
+            raise ConfigError("Missing ssh remote destination parameter for server " + server_name)
+        if "ssh_remote_memory" not in info.keys():
+            raise ConfigError("Missing ssh remote memory parameter for server " + server_name)
+        destination = info["ssh_remote_destination"]
+        match = re.match(r"^([^@:/]+)@([^@:/]+):(/.*)$", destination) if is_string(destination) else None
+        if not match:
+            raise ConfigError("invalid ssh remote destination for server " + server_name + ", it should look like " +
+                              "user@host:/absolute/path: " + repr(destination))
+        user, host, folder = match.groups()
+        freq = BackupConfig._parse_freq(info["ssh_remote_memory"])
+        ssh_key = info.get("ssh_remote_ssh_key")
+        if ssh_key is not None:
+            if not is_string(ssh_key):
+                raise ConfigError("invalid ssh remote ssh_key parameter for server " + server_name)
+            ssh_key = os.path.abspath(os.path.expanduser(ssh_key))
+        values = {}
+        for key, minimum in (("port", 1), ("transfers", 1), ("bwlimit", 1)):
+            if "ssh_remote_" + key not in info.keys():
+                values[key] = None
+                continue
+            val = info["ssh_remote_" + key]
+            if not ll_int(val) or int(val) < minimum:
+                raise ConfigError("invalid ssh remote " + key + " parameter for server " + server_name + ": " +
+                                  repr(val))
+            values[key] = int(val)
+        storage = SshRemoteStorage(freq, user, host, folder, values["port"], ssh_key, values["transfers"],
+                                   values["bwlimit"])
+        storage.set_encryption(BackupConfig._parse_encryption(info, "ssh_remote", server_name))
+        return [storage]
+
+
+    @staticmethod
+    def _parse_encryption(info, storage_type, server_name):
+        """
+        Read the encryption settings of a storage
+
+        :param info:            The storage parameters
+        :type info:             dict[str, any]
+        :param storage_type:    The storage type, prefix of the parameter names
+        :type storage_type:     str
+        :param server_name:     The name of the server (or local) we are reading the params
+        :type server_name:      str
+        :return:                The encryption, None if the archives are stored in plain
+        :rtype:                 AgeEncryption|None
+        """
+        recipients = info.get(storage_type + "_encrypt_to")
+        if recipients is None:
+            return None
+        if is_string(recipients):
+            recipients = [recipients]
+        if not is_array(recipients) or not recipients or \
+                [recipient for recipient in recipients if not is_string(recipient) or not recipient.strip()]:
+            raise ConfigError("invalid " + storage_type + " encrypt_to parameter for server " + server_name +
+                              ", it should be an age recipient or a list of recipients: " + repr(recipients))
+        return AgeEncryption([recipient.strip() for recipient in recipients])
+
+    @staticmethod
+    def _parse_transport_compression(info, server_name):
+        if "transport_compression" not in info.keys():
+            return Action.TRANSPORT_REMOTE
+        value = info["transport_compression"]
+        if not is_string(value) or value.strip().lower() not in Action.TRANSPORT_COMPRESSIONS:
+            raise ConfigError("invalid 'transport_compression' parameter for server " + server_name + ": " +
+                              repr(value) + ", allowed values: " + ", ".join(Action.TRANSPORT_COMPRESSIONS))
+        return value.strip().lower()
 
     @staticmethod
     def _parse_action_common(params, server_name):
@@ -2279,6 +5757,8 @@ class BackupConfig(object):
 
     @staticmethod
     def _db_to_prefix(db_info):
+        if is_dict(db_info):
+            db_info = db_info.get("db", "")
         db_name = db_info.split(":", 2)[0]
         return re.sub(r'_+', "_", re.sub(r"[^a-zA-Z0-9]+", "_", db_name)).strip("_")
 
@@ -2307,26 +5787,45 @@ class BackupConfig(object):
 
     @staticmethod
     def _parse_db_action_conf(server_name, name, params, db_info, db_user):
+        options = {}
+        if is_dict(db_info):
+            options = {to_str(k).strip().lower(): v for k, v in db_info.items()}
+            if "db" not in options.keys():
+                raise ConfigError("Missing 'db' field in database information for server " + server_name + ": " +
+                                  repr(db_info))
+            db_info = options["db"]
+            del options["db"]
         if db_info is None:
             raise ConfigError("Missing database information for server " + server_name)
         if not is_string(db_info):
             raise ConfigError("invalid database information for server " + server_name + ": " + repr(db_info))
-        db_info_parts = db_info.split(":")
-        if len(db_info_parts) != 3:
-            raise ConfigError("invalid database information for server " + server_name + ": " + db_info)
-        db_type = db_info_parts[0].strip().lower()
-        if db_type not in ("mysql", "postgres", "mongo"):
-            raise ConfigError("invalid database type " + db_type + " for server " + server_name)
-        if not ll_int(db_info_parts[1].strip()):
-            raise ConfigError("invalid database port for server " + server_name + ": " + db_info_parts[1])
-        db_port = int(db_info_parts[1].strip())
-        if 0 > db_port or db_port > 65534:
-            raise ConfigError("invalid database port for server " + server_name + ": " + to_str(db_port))
-        db_name = db_info_parts[2].strip()
-        if not db_name:
-            raise ConfigError("missing database name for server " + server_name + ": " + to_str(db_info))
+        db_type = db_info.split(":", 1)[0].strip().lower()
+        if db_type == "sqlite":
+            # sqlite:/path/to/database
+            db_port = None
+            db_name = db_info.split(":", 1)[1].strip() if ":" in db_info else ""
+            if not db_name:
+                raise ConfigError("missing sqlite database file for server " + server_name + ": " + to_str(db_info))
+            if not db_name.startswith("/"):
+                raise ConfigError("sqlite database file should be an absolute path for server " + server_name + ": " +
+                                  db_name)
+        else:
+            db_info_parts = db_info.split(":")
+            if len(db_info_parts) != 3:
+                raise ConfigError("invalid database information for server " + server_name + ": " + db_info)
+            if db_type not in ("mysql", "postgres", "mongo"):
+                raise ConfigError("invalid database type " + db_type + " for server " + server_name)
+            if not ll_int(db_info_parts[1].strip()):
+                raise ConfigError("invalid database port for server " + server_name + ": " + db_info_parts[1])
+            db_port = int(db_info_parts[1].strip())
+            if 0 > db_port or db_port > 65534:
+                raise ConfigError("invalid database port for server " + server_name + ": " + to_str(db_port))
+            db_name = db_info_parts[2].strip()
+            if not db_name:
+                raise ConfigError("missing database name for server " + server_name + ": " + to_str(db_info))
 
         prefix, dest_folder, ssh_user, ssh_key = BackupConfig._parse_action_common(params, server_name)
+        options = BackupConfig._parse_db_options(db_type, db_name, options, server_name)
 
         if name is None:
             name = BackupConfig._db_to_prefix(db_info)
@@ -2334,16 +5833,76 @@ class BackupConfig(object):
             raise ConfigError("invalid prefix for database " + db_name + " of server " + server_name + ": "+repr(name))
         if db_type == "mysql":
             return MySqlAction(server_name, prefix.strip("_"), name, dest_folder, ssh_user, ssh_key,
-                               db_user, db_name, db_port)
+                               db_user, db_name, db_port, options)
         elif db_type == "postgres":
             return PostgresAction(server_name, prefix.strip("_"), name, dest_folder, ssh_user, ssh_key,
-                                  db_user, db_name, db_port)
+                                  db_user, db_name, db_port, options)
         elif db_type == "mongo":
             return MongoDbAction(server_name, prefix.strip("_"), name, dest_folder, ssh_user, ssh_key,
-                                 db_user, db_name, db_port)
+                                 db_user, db_name, db_port, options)
+        elif db_type == "sqlite":
+            return SqliteAction(server_name, prefix.strip("_"), name, dest_folder, ssh_user, ssh_key, db_name, options)
         else:
             raise ConfigError("Unknown database type " + db_type + " for server " + server_name)
 
+    @staticmethod
+    def _parse_db_options(db_type, db_name, options, server_name):
+        """
+        Check and convert the optional settings of a database
+
+        :param db_type:         The database type (mysql, postgres, mongo)
+        :type db_type:          str
+        :param db_name:         The database name
+        :type db_name:          str
+        :param options:         The raw options, read from the configuration
+        :type options:          dict[str, any]
+        :param server_name:     The name of the server (or local) we are reading the params
+        :type server_name:      str
+        :return:                The options, converted to their expected types
+        :rtype:                 dict[str, any]
+        """
+        result = {}
+        for key, val in options.items():
+            if key not in BackupConfig._DB_OPTIONS.keys():
+                raise ConfigError("Unknown database option " + key + " for server " + server_name)
+            val_type, db_types = BackupConfig._DB_OPTIONS[key]
+            if db_type not in db_types:
+                raise ConfigError("Option " + key + " is not available for " + db_type + " databases on server " +
+                                  server_name)
+            if val_type == "int":
+                if not ll_int(val) or int(val) < 0:
+                    raise ConfigError("Invalid database option " + key + " for server " + server_name + ": " +
+                                      repr(val))
+                result[key] = int(val)
+            elif val_type == "bool":
+                if not ll_bool(val):
+                    raise ConfigError("Invalid database option " + key + " for server " + server_name + ": " +
+                                      repr(val))
+                result[key] = to_bool(val)
+            elif is_array(val_type):
+                if to_str(val).strip() not in val_type:
+                    raise ConfigError("Invalid database option " + key + " for server " + server_name + ": " +
+                                      repr(val) + ", allowed values: " + ", ".join(val_type))
+                result[key] = to_str(val).strip()
+            else:
+                if not is_string(val) or not val.strip():
+                    raise ConfigError("Invalid database option " + key + " for server " + server_name + ": " +
+                                      repr(val))
+                result[key] = val.strip()
+
+        if result.get("stream") and (result.get("delta_transfer", "no") != "no" or result.get("delta_storage")):
+            raise ConfigError("database option 'stream' can't be used with delta transfer or delta storage on server " +
+                              server_name)
+        if "keep_dump" in result.keys() and not result.get("stream"):
+            raise ConfigError("database option 'keep_dump' requires the 'stream' option on server " + server_name)
+        if result.get("skip_unchanged") and (result.get("delta_storage") or result.get("incremental")):
+            raise ConfigError("database option 'skip_unchanged' can't be used with delta storage or incremental dumps "
+                              "on server " + server_name)
+        if result.get("oplog") and db_name != MongoDbAction.ALL_DATABASES:
+            raise ConfigError("mongo 'oplog' option requires a full instance dump, use '" +
+                              MongoDbAction.ALL_DATABASES + "' as database name on server " + server_name)
+        return result
+
     @staticmethod
     def _parse_freq(config):
         """
@@ -2406,6 +5965,7 @@ class BackupConfig(object):
 
     @staticmethod
     def _parse_email_report(config_file, report_config):
+        import email.utils
         if is_string(report_config):
             report_config = {"to": [report_config]}
         elif is_array(report_config):
@@ -2593,6 +6153,160 @@ class BackupConfig(object):
 # Command functions
 # ----------------------------------------------------------------------------
 
+class TargetIndex(object):
+    """
+    Index of actions by the fields the target identifiers are matched against, with the fnmatch syntax.
+    Identifiers without wildcard are looked up in dictionaries. Wildcard patterns are compiled once, and only
+    matched against the distinct values of a field starting with their literal prefix, or containing their longest
+    literal fragment.
+    """
+    # The fields matched by an identifier, in the order they explain a selection
+    _FIELDS = ("server", "name", "full name", "prefix", "folder", "database", "db type")
+    # The fields matched by the two parts of a 'server:target' identifier
+    _SERVER_FIELDS = ("server", "prefix")
+    _TARGET_FIELDS = ("name", "full name", "folder", "database", "db type")
+    _WILDCARDS = re.compile(r"[*?\[]")
+
+    def __init__(self, actions):
+        """
+        :param actions:     The actions of the config
+        :type actions:      list[Action]
+        """
+        self._actions = list(actions)
+        # The positions of the actions, by value, by field
+        self._values = dict([(field, {}) for field in TargetIndex._FIELDS])
+        # The values of the first fields, that every action has, by position
+        self._columns = dict([(field, []) for field in (TargetIndex._FIELDS[0], TargetIndex._TARGET_FIELDS[0])])
+        for position, action in enumerate(self._actions):
+            for field, value in TargetIndex._get_fields(action):
+                value = os.path.normcase(value)
+                self._values[field].setdefault(value, []).append(position)
+                if field in self._columns:
+                    self._columns[field].append(value)
+        # The distinct values of each field, sorted for the prefix searches
+        self._sorted_values = dict([(field, sorted(values.keys())) for field, values in self._values.items()])
+        # The compiled patterns, with their longest literal fragment
+        self._regexes = {}
+
+    @staticmethod
+    def _get_fields(action):
+        fields = [("server", action.server_name), ("name", action.name), ("full name", action.full_name),
+                  ("prefix", action.prefix)]
+        if isinstance(action, FileAction):
+            fields.append(("folder", action.remote_folder))
+        elif isinstance(action, DbAction):
+            fields.extend([("database", action.database), ("db type", action.db_type)])
+        return fields
+
+    @staticmethod
+    def _get_fragment(pattern):
+        """
+        :return:    The longest part of a wildcard pattern matched literally, parsed as fnmatch.translate does
+        :rtype:     str
+        """
+        fragments = [""]
+        position = 0
+        while position < len(pattern):
+            char = pattern[position]
+            position += 1
+            if char in "*?":
+                fragments.append("")
+            elif char == "[":
+                end = position
+                if end < len(pattern) and pattern[end] == "!":
+                    end += 1
+                if end < len(pattern) and pattern[end] == "]":
+                    end += 1
+                end = pattern.find("]", end)
+                if end == -1:
+                    # Unclosed class: a literal bracket
+                    fragments[-1] += char
+                else:
+                    fragments.append("")
+                    position = end + 1
+            else:
+                fragments[-1] += char
+        return max(fragments, key=len)
+
+    def select(self, identifier):
+        """
+        Select the actions matching a target identifier: a pattern matched against every field, or a
+        'server:target' pattern matched against the server name or prefix, then the other fields
+
+        :param identifier:  The target identifier
+        :type identifier:   str
+        :return:            The selected actions, in config order, with the reason they were selected
+        :rtype:             list[(Action, str)]
+        """
+        if ":" in identifier:
+            first_part, second_part = identifier.split(":", 2)
+            # The part matching every action is only explained for the actions the other part matches
+            if TargetIndex._matches_all(first_part):
+                targets = self._match_fields(TargetIndex._TARGET_FIELDS, second_part)
+                servers = self._match_fields(TargetIndex._SERVER_FIELDS, first_part, targets)
+            else:
+                servers = self._match_fields(TargetIndex._SERVER_FIELDS, first_part)
+                targets = self._match_fields(TargetIndex._TARGET_FIELDS, second_part, servers)
+            matches = [(position, servers[position] + ", " + reason) for position, reason in targets.items()
+                       if position in servers]
+        else:
+            matches = self._match_fields(TargetIndex._FIELDS, identifier).items()
+        return [(self._actions[position], reason) for position, reason in sorted(matches)]
+
+    @staticmethod
+    def _matches_all(pattern):
+        return pattern != "" and pattern.strip("*") == ""
+
+    def _match_fields(self, fields, pattern, positions=None):
+        """
+        :param positions:   The only actions to explain, when the pattern matches every value
+        :type positions:    collections.Iterable[int] | None
+        :return:            The positions of the matching actions, with the first matching field
+        :rtype:             dict[int, str]
+        """
+        if TargetIndex._matches_all(pattern):
+            # Explained by the first field, that every action has
+            column = self._columns[fields[0]]
+            positions = range(len(self._actions)) if positions is None else positions
+            return dict([(position, fields[0] + " " + column[position] + " matches " + pattern)
+                         for position in positions])
+        matches = {}
+        for field in fields:
+            for value, value_positions in self._match(field, os.path.normcase(pattern)):
+                reason = field + " " + value + " matches " + pattern
+                for position in value_positions:
+                    if position not in matches:
+                        matches[position] = reason
+        return matches
+
+    def _match(self, field, pattern):
+        """
+        :return:    The matching values of a field, with the positions of their actions
+        :rtype:     list[(str, list[int])]
+        """
+        values = self._values[field]
+        wildcard = TargetIndex._WILDCARDS.search(pattern)
+        if wildcard is None:
+            return [(pattern, values[pattern])] if pattern in values else []
+        if pattern not in self._regexes:
+            self._regexes[pattern] = (re.compile(fnmatch.translate(pattern)), TargetIndex._get_fragment(pattern))
+        regex, fragment = self._regexes[pattern]
+        literal_prefix = pattern[:wildcard.start()]
+        sorted_values = self._sorted_values[field]
+        if literal_prefix:
+            candidates = []
+            for position in range(bisect.bisect_left(sorted_values, literal_prefix), len(sorted_values)):
+                if not sorted_values[position].startswith(literal_prefix):
+                    break
+                candidates.append(sorted_values[position])
+        else:
+            # A leading wildcard: only the values containing a literal part of the pattern can match
+            candidates = [value for value in sorted_values if fragment in value]
+            if pattern == "*" + fragment + "*":
+                return [(value, values[value]) for value in candidates]
+        return [(value, values[value]) for value in candidates if regex.match(value)]
+
+
 def glob_target(conf, identifier):
     """
 
@@ -2603,44 +6317,35 @@ def glob_target(conf, identifier):
     :return:
     :rtype:             list[Action]
     """
-
-    results = []
-    actions = conf.get_actions()
-    if ":" in identifier:
-        first_part, second_part = identifier.split(":", 2)
-        for action in actions:
-            if fnmatch.fnmatch(action.server_name, first_part) or fnmatch.fnmatch(action.prefix, first_part):
-                if fnmatch.fnmatch(action.name, second_part) or fnmatch.fnmatch(action.full_name, second_part):
-                    results.append(action)
-                elif isinstance(action, FileAction) and fnmatch.fnmatch(action.remote_folder, second_part):
-                    results.append(action)
-                elif isinstance(action, DbAction):
-                    if fnmatch.fnmatch(action.database, second_part):
-                        results.append(action)
-                    elif fnmatch.fnmatch(action.db_type, second_part):
-                        results.append(action)
-    else:
-        for action in actions:
-            if fnmatch.fnmatch(action.server_name, identifier):
-                results.append(action)
-            elif fnmatch.fnmatch(action.name, identifier):
-                results.append(action)
-            elif fnmatch.fnmatch(action.full_name, identifier):
-                results.append(action)
-            elif fnmatch.fnmatch(action.prefix, identifier):
-                results.append(action)
-            elif isinstance(action, FileAction) and fnmatch.fnmatch(action.remote_folder, identifier):
-                results.append(action)
-            elif isinstance(action, DbAction):
-                if fnmatch.fnmatch(action.database, identifier):
-                    results.append(action)
-                elif fnmatch.fnmatch(action.db_type, identifier):
-                    results.append(action)
+    results = [action for action, reason in conf.get_target_index().select(identifier)]
     if not results:
         raise RuntimeError("Unknown target "+identifier)
     return results
 
 
+def explain_targets(conf, identifier_list):
+    """
+    Select the actions matching target identifiers
+
+    :param conf:
+    :type conf:                 BackupConfig
+    :param identifier_list:
+    :type identifier_list:      list[str]
+    :return:                    The selected actions, in config order, with the reasons they were selected
+    :rtype:                     list[(Action, list[str])]
+    """
+    index = conf.get_target_index()
+    selected = {}
+    for identifier in identifier_list:
+        matches = index.select(identifier)
+        if not matches:
+            raise RuntimeError("Unknown target "+identifier)
+        for action, reason in matches:
+            selected.setdefault(id(action), (action, []))[1].append(reason)
+    positions = dict([(id(action), position) for position, action in enumerate(conf.get_actions())])
+    return sorted(selected.values(), key=lambda selection: positions[id(selection[0])])
+
+
 def glob_targets(conf, identifier_list, all_on_empty=True):
     """
 
@@ -2655,38 +6360,545 @@ def glob_targets(conf, identifier_list, all_on_empty=True):
     """
     if not identifier_list and all_on_empty:
         return conf.get_actions()
-    results = []
-    for identifier in identifier_list:
-        results.extend(glob_target(conf, identifier))
-    return list(set(results))
+    return [action for action, reasons in explain_targets(conf, identifier_list)]
+
+
+class RetentionPlanner(object):
+    """
+    Retention decisions of several actions computed in a single pass: each storage is listed once, the archive names
+    are parsed once into a table, and the retention rules are evaluated once per distinct date.
+    The resulting plan is a json serializable dict, which can be reviewed before being executed.
+    """
+    def __init__(self, actions, storage_filter=None):
+        """
+        :param actions:         The actions to clean
+        :type actions:          list[Action]
+        :param storage_filter:  Select the storages to clean, every storage by default. The digests of the actions
+                                are only pruned when every storage is cleaned.
+        :type storage_filter:   callable|None
+        """
+        self._actions = actions
+        self._storage_filter = storage_filter
+        self._kept_names = {}
+        # The storages of the actions, by location: a location shared by several actions is listed once
+        self._locations = []
+        locations = {}
+        for action in actions:
+            for storage in action.storage_list:
+                if storage_filter is not None and not storage_filter(storage):
+                    continue
+                if storage.listing_key not in locations:
+                    locations[storage.listing_key] = []
+                    self._locations.append(locations[storage.listing_key])
+                locations[storage.listing_key].append((action, storage))
+
+    def plan(self):
+        """
+        List the storages and decide which archives to remove
+
+        :return:    The reference date and, for each storage, its actions, the number of kept archives and the expired
+                    archives
+        :rtype:     dict[str, any]
+        """
+        self._kept_names = dict([(action.full_name, set()) for action in self._actions])
+        entries = []
+        for location in self._locations:
+            expired = []
+            kept_count = 0
+            for action, storage, rows in self._decide(location):
+                for filename, archive, kept in rows:
+                    if kept:
+                        kept_count += 1
+                        self._kept_names[action.full_name].add(AgeEncryption.plain_name(filename))
+                    else:
+                        expired.append(archive)
+            entries.append({"storage": location[0][1].small_descr,
+                            "actions": [action.full_name for action, storage in location],
+                            "kept": kept_count, "expired": sorted(expired)})
+        return {"reference_date": TimeReference.get().strftime("%Y-%m-%d"), "storages": entries}
+
+    def list_archives(self):
+        """
+        List the storages and apply the retention rules, without removing anything
+
+        :return:    The archives of each action on each of its storages, with True for the archives to keep
+        :rtype:     list[(Action, MemoryStorage, list[(str, bool)])]
+        """
+        return [(action, storage, [(archive, kept) for filename, archive, kept in rows])
+                for location in self._locations for action, storage, rows in self._decide(location)]
+
+    @staticmethod
+    def _decide(location):
+        """
+        List a storage location once, and apply the retention rules of each of its actions
+
+        :param location:    The actions sharing a storage location, with their storage
+        :type location:     list[(Action, MemoryStorage)]
+        :return:            The base name and the archive of each action on the location, with True for the
+                            archives to keep
+        :rtype:             list[(Action, MemoryStorage, list[(str, str, bool)])]
+        """
+        actions = [action for action, storage in location]
+        archives = location[0][1].list_archives(actions[0].full_name if len(actions) == 1 else None)
+        table = RetentionPlanner._parse_archives(archives, actions)
+        decisions = {}
+        results = []
+        for action, storage in location:
+            rows = table.get(action.full_name, [])
+            kept = RetentionPlanner._get_kept(action, storage.freq, rows, decisions.setdefault(id(storage.freq), {}))
+            results.append((action, storage, [(filename, archive, archive in kept)
+                                              for filename, date_str, archive in rows]))
+        return results
+
+    def restrict(self, reviewed_plan):
+        """
+        Compute the plan again, and only keep the expired archives of a reviewed plan: an archive is only removed if it
+        still expires under the current retention rules and chains, and if it belongs to the storages of the actions.
+
+        :param reviewed_plan:   A plan computed by RetentionPlanner.plan, maybe by a previous run or on other actions
+        :type reviewed_plan:    dict[str, any]
+        :return:                The plan to execute
+        :rtype:                 dict[str, any]
+        """
+        reviewed = {}
+        reviewed_count = 0
+        for entry in reviewed_plan["storages"]:
+            reviewed.setdefault(entry["storage"], set()).update(entry["expired"])
+            reviewed_count += len(entry["expired"])
+        plan = self.plan()
+        expired_count = 0
+        for entry in plan["storages"]:
+            entry["expired"] = [archive for archive in entry["expired"]
+                                if archive in reviewed.get(entry["storage"], ())]
+            expired_count += len(entry["expired"])
+        if expired_count < reviewed_count:
+            log.warning(to_str(reviewed_count - expired_count) + " archives of the plan are not removed: they are " +
+                        "still kept by the retention rules, or they are not archives of the selected actions")
+        return plan
+
+    def execute(self, plan, throttled=False):
+        """
+        Remove the expired archives of a plan. Every archive is tried, even if some removals fail.
+
+        :param plan:        A plan computed by RetentionPlanner.plan or RetentionPlanner.restrict
+        :type plan:         dict[str, any]
+        :param throttled:   Should the removals be slowed down, not to compete with the archives being sent?
+        :type throttled:    bool
+        :return:            The number of archives which couldn't be removed
+        :rtype:             int
+        """
+        failure_count = 0
+        actions = dict([(action.full_name, action) for action in self._actions])
+        for entry in plan["storages"]:
+            if not entry["expired"]:
+                continue
+            storage = self._find_storage(entry)
+            if storage is None:
+                log.error("Unknown storage " + entry["storage"] + " for " + ", ".join(entry["actions"]) +
+                          ": " + to_str(len(entry["expired"])) + " archives not removed")
+                failure_count += len(entry["expired"])
+                continue
+            names = [name for name in entry["actions"] if name in actions]
+            descr = actions[names[0]].small_descr if len(names) == 1 else to_str(len(names)) + " actions"
+            log.info(descr + ": removing " + to_str(len(entry["expired"])) + " old archives from " +
+                     storage.small_descr + "...")
+            start_time = time.time()
+            logged_step = [0]
+
+            def progress(finished, total):
+                step = finished * 10 // total
+                if step > logged_step[0] and finished < total:
+                    logged_step[0] = step
+                    log.info(descr + ": " + indent() + to_str(finished) + "/" + to_str(total) + " removed")
+
+            errors = storage.remove_many(entry["expired"], progress, throttled)
+            for archive in sorted(errors.keys()):
+                log.error(descr + ": unable to remove " + archive + ": " + to_str(errors[archive]))
+                for name in entry["actions"]:
+                    if name in self._kept_names:
+                        self._kept_names[name].add(AgeEncryption.plain_name(os.path.basename(archive)))
+            log.info(descr + ": " + to_str(len(entry["expired"]) - len(errors)) + " old archives removed from " +
+                     storage.small_descr + ", " + to_str(len(errors)) + " failed, in " +
+                     to_str(int(time.time() - start_time)) + "s")
+            failure_count += len(errors)
+        if self._storage_filter is not None:
+            return failure_count
+        for action in self._actions:
+            if action.full_name in self._kept_names:
+                action.prune_digests(self._kept_names[action.full_name])
+        return failure_count
+
+    def _find_storage(self, entry):
+        for location in self._locations:
+            for action, storage in location:
+                if storage.small_descr == entry["storage"] and action.full_name in entry["actions"]:
+                    return storage
+        return None
+
+    @staticmethod
+    def _parse_archives(archives, actions):
+        """
+        Split the archives of a storage by action
+
+        :return:    The base name, date and archive of the valid archives, by action full name
+        :rtype:     dict[str, list[(str, str, str)]]
+        """
+        full_names = set([action.full_name for action in actions])
+        table = {}
+        for archive in archives:
+            filename = os.path.basename(archive)
+            date_str, _, archive_name = filename.partition("_")
+            # The longest action name followed by an extension
+            position = len(archive_name)
+            while position > 0:
+                position = archive_name.rfind(".", 0, position)
+                if position > 0 and archive_name[:position] in full_names:
+                    table.setdefault(archive_name[:position], []).append((filename, date_str, archive))
+                    break
+        return table
+
+    @staticmethod
+    def _get_kept(action, freq, rows, decisions):
+        """
+        Apply the retention rules of a storage on the archives of an action.
+        Archives needed to restore a kept chained archive (incremental dumps, deltas) are kept too.
+
+        :param rows:        The base name, date and archive of the archives of the action
+        :type rows:         list[(str, str, str)]
+        :param decisions:   The decisions already taken for the storage, by date, updated
+        :type decisions:    dict[str, bool]
+        :return:            The archives to keep
+        :rtype:             set[str]
+        """
+        kept = set()
+        previous_needed = False
+        for filename, date_str, archive in sorted(rows, reverse=True):
+            keep = decisions.get(date_str)
+            if keep is None:
+                keep = decisions[date_str] = RetentionPlanner._should_keep_date(freq, date_str)
+            if previous_needed or keep:
+                kept.add(archive)
+                previous_needed = action.is_chained_archive(AgeEncryption.plain_name(filename))
+            else:
+                previous_needed = False
+        return kept
+
+    @staticmethod
+    def _should_keep_date(freq, date_str):
+        date = RetentionPlanner.parse_date(date_str)
+        return date is not None and freq.should_keep(date)
+
+    @staticmethod
+    def parse_date(date_str):
+        """
+        :param date_str:    The date prefix of an archive name
+        :type date_str:     str
+        :return:            The archive date, None if the prefix is not a valid date
+        :rtype:             datetime.date|None
+        """
+        if len(date_str) != 8 or not date_str.isdigit():
+            return None
+        try:
+            return datetime.date(year=int(date_str[0:4]), month=int(date_str[4:6]), day=int(date_str[6:8]))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def get_chains(action, archives):
+        """
+        Group the archives of an action on a storage by restore chain: an independent archive followed by the
+        archives which can only be restored on top of it
+
+        :param archives:    The archives of the action, as returned by MemoryStorage.list_archives
+        :type archives:     list[str]
+        :return:            The date and archive of the valid archives, by chain, oldest first
+        :rtype:             list[list[(datetime.date|None, str)]]
+        """
+        chains = []
+        rows = RetentionPlanner._parse_archives(archives, [action]).get(action.full_name, [])
+        for filename, date_str, archive in sorted(rows):
+            if chains and action.is_chained_archive(AgeEncryption.plain_name(filename)):
+                chains[-1].append((RetentionPlanner.parse_date(date_str), archive))
+            else:
+                chains.append([(RetentionPlanner.parse_date(date_str), archive)])
+        return chains
+
+
+class CleanWorker(object):
+    """
+    Remove the expired archives of the actions of a run in a background thread, while the backups proceed.
+    The archives of an action are never removed while it is backed up, so that an archive being aliased or chained is
+    not removed: an action whose backup starts before it is cleaned is cleaned once every backup and pending save is
+    finished. The actions are cleaned from the last one to be backed up, with throttled removals.
+    """
+    _WAITING = "waiting"
+    _CLEANING = "cleaning"
+    _CLEANED = "cleaned"
+    _BACKUP = "backup"
+
+    def __init__(self, actions):
+        """
+        :param actions:     The actions of the run, in backup order
+        :type actions:      list[Action]
+        """
+        self._actions = actions
+        self._states = dict([(action.full_name, CleanWorker._WAITING) for action in actions])
+        self._condition = threading.Condition()
+        self._finishing = False
+        self._errors = {}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def begin_backup(self, action):
+        """
+        Wait for the end of the cleaning of an action if it is in progress, and prevent it until finish is called
+
+        :param action:
+        :type action:   Action
+        :return:        True if the expired archives of the action have been removed
+        :rtype:         bool
+        """
+        with self._condition:
+            while self._states[action.full_name] == CleanWorker._CLEANING:
+                # With a timeout, so that the main thread stays interruptible on python 2
+                self._condition.wait(1.0)
+            if self._states[action.full_name] == CleanWorker._CLEANED:
+                return True
+            self._states[action.full_name] = CleanWorker._BACKUP
+            return False
+
+    def finish(self):
+        """
+        Clean the actions which were backed up before being cleaned, and wait for the end of the cleaning.
+        To call once every backup and pending save is finished.
+
+        :return:    The errors, by action full name
+        :rtype:     dict[str, Exception]
+        """
+        with self._condition:
+            self._finishing = True
+            self._condition.notify_all()
+        while self._thread.is_alive():
+            self._thread.join(1.0)
+        return self._errors
+
+    def _work(self):
+        pending = list(reversed(self._actions))
+        while pending:
+            with self._condition:
+                while not self._finishing and \
+                        all([self._states[action.full_name] != CleanWorker._WAITING for action in pending]):
+                    self._condition.wait()
+                if self._finishing:
+                    action = pending[0]
+                else:
+                    action = [action for action in pending if self._states[action.full_name] == CleanWorker._WAITING][0]
+                pending.remove(action)
+                self._states[action.full_name] = CleanWorker._CLEANING
+                # Nothing is sent anymore once finishing
+                throttled = not self._finishing
+            try:
+                clean_archives(action, throttled=throttled)
+            except StandardError as e:
+                log.exception(e)
+                self._errors[action.full_name] = e
+            finally:
+                with self._condition:
+                    self._states[action.full_name] = CleanWorker._CLEANED
+                    self._condition.notify_all()
+
+
+def rebuild_archive(archives, output_file):
+    """
+    Rebuild an uncompressed dump from a keyframe followed by the binary deltas of its chain
+
+    :param archives:        The local archive files: a gzipped keyframe, then the deltas in chronological order
+    :type archives:         list[str]
+    :param output_file:     The file receiving the rebuilt dump
+    :type output_file:      str
+    """
+    if not archives[0].endswith(".gz"):
+        raise RuntimeError("The first archive should be a gzipped keyframe: " + archives[0])
+    for archive in archives[1:]:
+        if not archive.endswith("." + DbAction._DELTA_EXTENSION):
+            raise RuntimeError("Not a delta archive: " + archive)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    with temp_filename(prefix="bkp_rebuild_", dir=output_dir) as current_file:
+        check_run_cmd("sh", "-c", "gzip -dc " + shell_quote(archives[0]) + " > " + shell_quote(current_file))
+        for archive in archives[1:]:
+            log.info("applying " + archive + "...")
+            with temp_filename(prefix="bkp_rebuild_", dir=output_dir) as next_file:
+                check_run_cmd("xdelta3", "-d", "-f", "-s", current_file, archive, next_file)
+                os.rename(next_file, current_file)
+        os.rename(current_file, output_file)
+
+
+def list_archives(actions):
+    """
+    Show the archives of actions, the archives the retention rules don't keep anymore being marked as old
+
+    :param actions:
+    :type actions:  list[Action]
+    """
+    listed = {}
+    for action, storage, archives in RetentionPlanner(actions).list_archives():
+        listed[(id(action), id(storage))] = archives
+    for action in actions:
+        for storage in action.storage_list:
+            for archive, kept in listed.get((id(action), id(storage)), []):
+                if kept:
+                    log.info(archive + ": "+action.small_descr)
+                else:
+                    log.info(archive+" [old]: "+action.small_descr)
 
 
-def list_archives(action):
+def clean_archives(action, storage_filter=None, throttled=False):
     """
+    Remove the archives of an action the retention rules don't keep anymore.
+    Every archive is tried, even if some removals fail.
+
+    :param action:
+    :type action:           Action
+    :param storage_filter:  Select the storages to clean, every storage by default
+    :type storage_filter:   callable|None
+    :param throttled:       Should the removals be slowed down, not to compete with the archives being sent?
+    :type throttled:        bool
+    """
+    planner = RetentionPlanner([action], storage_filter)
+    failure_count = planner.execute(planner.plan(), throttled)
+    if failure_count:
+        raise RuntimeError("Unable to remove " + to_str(failure_count) + " old archives of " + action.small_descr)
+
+
+def check_disk_space(action):
+    """
+    Make sure the file systems of the local storages with a free space quota can receive the next archive of an
+    action, with its size projected from the previous archives. When a quota is not met, the oldest archives of the
+    action the daily retention rule doesn't require are removed from the storages.
 
     :param action:
     :type action:   Action
+    :return:        The reasons preventing the backup, empty if there is enough space
+    :rtype:         list[str]
     """
-    for storage in action.storage_list:
-        archives = storage.list_archives(action.full_name)
-        for archive in archives:
-            if storage.should_keep(archive):
-                log.info(archive + ": "+action.small_descr)
-            else:
-                log.info(archive+" [old]: "+action.small_descr)
+    local_storages = [storage for storage in action.storage_list if storage.is_local() and storage.should_save()]
+    if all([storage.min_free is None for storage in local_storages]):
+        return []
+    projected = action.get_projected_size()
+    if not projected:
+        return []
+    # Free space, space to keep free, space required and local storages, by file system
+    needs = {}
+    for storage in local_storages:
+        free, reserved, device = storage.get_space()
+        need = needs.setdefault(device, {"folder": storage.small_descr, "free": free, "reserved": None,
+                                         "required": 0, "storages": []})
+        need["required"] += projected
+        if storage.min_free is not None:
+            need["reserved"] = max(need["reserved"] or 0, reserved)
+        need["storages"].append(storage)
+    for folder in action.get_work_folders():
+        device = DiskSpace.get_usage(folder)[2]
+        if device in needs:
+            needs[device]["required"] += projected
+
+    problems = []
+    for device in sorted(needs.keys()):
+        need = needs[device]
+        if need["reserved"] is None:
+            continue
+        missing = need["required"] + need["reserved"] - need["free"]
+        for storage in need["storages"]:
+            if missing <= 0:
+                break
+            missing -= free_disk_space(action, storage, missing)
+        if missing > 0:
+            problems.append("Not enough disk space for " + need["folder"] + ": " + DiskSpace.format_size(missing) +
+                            " missing for an archive of about " + DiskSpace.format_size(projected))
+    return problems
+
+
+def free_disk_space(action, storage, size):
+    """
+    Remove the oldest archives of an action from a local storage, until enough space is freed. The archives are
+    removed by restore chain, the newest chain and the archives required by the daily rule are always kept.
 
+    :param action:
+    :type action:   Action
+    :param storage: A local storage
+    :type storage:  LocalFolderStorage
+    :param size:    The number of bytes to free
+    :type size:     int
+    :return:        The number of bytes freed
+    :rtype:         int
+    """
+    removed = []
+    freed = 0
+    for chain in RetentionPlanner.get_chains(action, storage.list_archives(action.full_name))[:-1]:
+        if freed >= size:
+            break
+        if any([date is None or storage.freq.is_strict(date) for date, archive in chain]):
+            continue
+        for date, archive in chain:
+            freed += os.path.getsize(archive)
+            removed.append(archive)
+    if not removed:
+        return 0
+    log.warning(action.small_descr + ": removing " + to_str(len(removed)) + " old archives from " +
+                storage.small_descr + " to free " + DiskSpace.format_size(freed))
+    errors = storage.remove_many(removed)
+    for archive in sorted(errors.keys()):
+        log.error(action.small_descr + ": unable to remove " + archive + ": " + to_str(errors[archive]))
+        freed -= os.path.getsize(archive) if os.path.exists(archive) else 0
+    return freed
+
+
+def show_retention_plan(plan):
+    """
 
-def clean_archives(action):
+    :param plan:    A plan computed by RetentionPlanner.plan
+    :type plan:     dict[str, any]
     """
+    output = "Retention plan on " + plan["reference_date"] + ":"
+    for entry in plan["storages"]:
+        details = to_str(entry["kept"]) + " archives kept, " + to_str(len(entry["expired"])) + " to remove"
+        if entry["expired"]:
+            details += os.linesep + indent(os.linesep.join(entry["expired"]))
+        output += os.linesep + indent(entry["storage"] + " (" + ", ".join(entry["actions"]) + "):" + os.linesep +
+                                      indent(details))
+    log.info(output)
+
+
+def verify_archives(action):
+    """
+    Check the stored archives of an action against the digests recorded when they were produced.
+    Encrypted archives and the archives stored before the digests were recorded are not checked.
 
     :param action:
     :type action:   Action
     """
+    digests = action.get_digests()
+    failure_count = 0
     for storage in action.storage_list:
         archives = storage.list_archives(action.full_name)
-        for archive in archives:
-            if not storage.should_keep(archive):
-                storage.remove(archive)
+        checked = [archive for archive in archives if os.path.basename(archive) in digests]
+        if not checked:
+            continue
+        log.info(action.small_descr + ": verifying " + to_str(len(checked)) + " archives on " +
+                 storage.small_descr + "...")
+        errors = storage.verify_many(checked, digests)
+        for archive in sorted(errors.keys()):
+            log.error(action.small_descr + ": " + archive + " is corrupted: " + to_str(errors[archive]))
+        log.info(action.small_descr + ": " + to_str(len(checked) - len(errors)) + " archives verified on " +
+                 storage.small_descr + ", " + to_str(len(errors)) + " failed, " +
+                 to_str(len(archives) - len(checked)) + " without digest")
+        failure_count += len(errors)
+    if failure_count:
+        raise RuntimeError(to_str(failure_count) + " archives of " + action.small_descr + " don't match their digests")
 
 
 def test_backup(actions):
@@ -2741,22 +6953,57 @@ def do_report(conf, report):
             log.error("Unable to send backup test report: " + to_str(e))
 
 
-def do_backup(action, report):
+def do_backup(action, report, can_defer=False, clean_worker=None):
     """
 
     :param action:
     :type action:       Action
     :param report:
     :type report:       Report
+    :param can_defer:   Can the backup be deferred when there is not enough disk space for it?
+    :type can_defer:    bool
+    :param clean_worker: The worker cleaning the actions in background, None to clean the action first
+    :type clean_worker: CleanWorker|None
+    :return:            False if the backup was deferred
+    :rtype:             bool
     """
     try:
-        clean_archives(action)
+        if clean_worker is None:
+            clean_archives(action)
+        elif not clean_worker.begin_backup(action):
+            # The local storages are quick to clean, and the disk space check needs them cleaned
+            clean_archives(action, lambda storage: storage.is_local())
+        problems = check_disk_space(action)
+        if problems and can_defer:
+            log.warning(action.small_descr + ": " + "; ".join(problems) + ", backup deferred to the end of the run")
+            return False
+        if problems:
+            raise RuntimeError("; ".join(problems))
         action.run_backup()
     except StandardError as e:
         report.add_issue(action.server_name, "Unable to save data for "+action.small_descr+": "+to_str(e))
         log.exception(e)
     else:
         report.add_success(action.server_name, action.small_descr + " have been successfully backuped")
+    return True
+
+
+def wait_pending_saves(actions, report):
+    """
+    Wait for the archives still being sent in background, and report the failed ones
+
+    :param actions:
+    :type actions:      list[Action]
+    :param report:
+    :type report:       Report
+    """
+    for action in actions:
+        for storage in action.storage_list:
+            errors = storage.wait_pending(action.full_name)
+            for archive in sorted(errors.keys()):
+                report.add_issue(action.server_name, "Unable to save " + archive + " of " + action.small_descr +
+                                 " on " + storage.small_descr + ": " + to_str(errors[archive]))
+                log.error("Unable to save " + archive + " on " + storage.small_descr + ": " + to_str(errors[archive]))
 
 
 # Main function
@@ -2781,6 +7028,8 @@ def main():
             check-reports           Send a test message to each report target
             list                    List existing backup
             clean                   Clean old backups
+            verify                  Check the stored archives against the digests computed when they were produced
+            rebuild                 Rebuild a dump from a keyframe and its deltas
             
         Common optional arguments:
           -h, --help            show this help message and exit
@@ -2832,10 +7081,14 @@ Targets are """
         try:
             conf = BackupConfig(config_file)
             try:
-                targets = glob_targets(conf, args.target)
+                selection = explain_targets(conf, args.target) if args.target else []
+                targets = [action for action, reasons in selection] if args.target else conf.get_actions()
             except RuntimeError as e:
                 parser.error(e)
                 return 1
+            if selection:
+                log.info("Selected targets:" + os.linesep + indent(os.linesep.join(
+                    [action.small_descr + ": " + "; ".join(reasons) for action, reasons in selection])))
             conf.show(targets)
         except KeyboardInterrupt:
             log.warning("Aborted.")
@@ -2928,8 +7181,7 @@ Targets are """
             except RuntimeError as e:
                 parser.error(e)
                 return 1
-            for action in actions:
-                list_archives(action)
+            list_archives(actions)
         except KeyboardInterrupt:
             log.warning("Aborted.")
             return 0
@@ -2942,6 +7194,75 @@ Targets are """
     elif args.command == "clean":
         usage_str = '''Usage: python backup.py clean [options] [server[:target,target2,...] [server[:target] ...]]'''
         parser = argparse.ArgumentParser(description='Clean old backup achives', usage=usage_str)
+        parser.add_argument('--config', '-c', default="backup.config",
+                            help="Specify a config file. Default: backup.config")
+        parser.add_argument('--plan', action='store_true',
+                            help="Only show the archives which would be removed")
+        parser.add_argument('--json', action='store_true',
+                            help="With --plan, write the plan on the standard output as json, to execute it later")
+        parser.add_argument('--execute', metavar="PLAN_FILE",
+                            help="Remove the archives of a json plan written by --plan --json ('-' for stdin) " +
+                                 "which still expire")
+        parser.add_argument('--log', '-l',
+                            help="Specify a log file. " +
+                                 "You can specify 'stdout', 'stderr', 'syslog' or a file path. " +
+                                 "Default: /var/log/backup.log")
+        parser.add_argument('target', nargs=argparse.REMAINDER, default=[], help=target_str)
+        args = parser.parse_args(sys.argv[2:])
+        init_log(args.log)
+
+        config_file = args.config
+        if not os.path.isabs(config_file) and not os.path.exists(config_file):
+            config_file = os.path.join(script_path, config_file)
+
+        if not os.path.exists(config_file):
+            log.error("Unable to locate config file " + args.config)
+            return 1
+
+        try:
+            conf = BackupConfig(config_file)
+            try:
+                actions = glob_targets(conf, args.target)
+            except RuntimeError as e:
+                parser.error(e)
+                return 1
+            planner = RetentionPlanner(actions)
+            if args.execute:
+                if args.execute == "-":
+                    plan = json.load(sys.stdin)
+                else:
+                    with open(args.execute, "r") as fh:
+                        plan = json.load(fh)
+                if plan["reference_date"] != TimeReference.get().strftime("%Y-%m-%d"):
+                    log.warning("Executing a plan computed on " + plan["reference_date"])
+                failure_count = planner.execute(planner.restrict(plan))
+                if failure_count:
+                    log.error(to_str(failure_count) + " old archives couldn't be removed")
+                    return 3
+            elif args.plan:
+                plan = planner.plan()
+                if args.json:
+                    json.dump(plan, sys.stdout, indent=2, sort_keys=True)
+                    sys.stdout.write(os.linesep)
+                else:
+                    show_retention_plan(plan)
+            else:
+                failure_count = planner.execute(planner.plan())
+                if failure_count:
+                    log.error(to_str(failure_count) + " old archives couldn't be removed")
+                    return 3
+        except KeyboardInterrupt:
+            log.warning("Aborted.")
+            return 0
+        except ConfigError as e:
+            log.error("Configuration file "+os.path.abspath(config_file)+" is invalid:" + os.linesep + to_str(e))
+            return 1
+        except StandardError as e:
+            log.error(to_str(e))
+            return 1
+    elif args.command == "verify":
+        usage_str = '''Usage: python backup.py verify [options] [server[:target,target2,...] [server[:target] ...]]'''
+        parser = argparse.ArgumentParser(description='Verify backup archives', usage=usage_str)
         parser.add_argument('--config', '-c', default="backup.config",
                             help="Specify a config file. Default: backup.config")
         parser.add_argument('--log', '-l',
@@ -2967,8 +7288,15 @@ Targets are """
             except RuntimeError as e:
                 parser.error(e)
                 return 1
+            failure_count = 0
             for action in actions:
-                clean_archives(action)
+                try:
+                    verify_archives(action)
+                except StandardError as e:
+                    log.error(to_str(e))
+                    failure_count += 1
+            if failure_count:
+                return 3
         except KeyboardInterrupt:
             log.warning("Aborted.")
             return 0
@@ -3011,6 +7339,27 @@ Targets are """
         except StandardError as e:
             log.error(to_str(e))
             return 1
+    elif args.command == "rebuild":
+        usage_str = '''Usage: python backup.py rebuild [options] output keyframe [delta delta2 ...]'''
+        parser = argparse.ArgumentParser(description='Rebuild a database dump stored as binary deltas',
+                                         usage=usage_str)
+        parser.add_argument('--log', '-l',
+                            help="Specify a log file. " +
+                                 "You can specify 'stdout', 'stderr', 'syslog' or a file path. " +
+                                 "Default: /var/log/backup.log")
+        parser.add_argument('output', help="The uncompressed dump to write")
+        parser.add_argument('archives', nargs='+', help="The keyframe archive then the delta archives, in order")
+        args = parser.parse_args(sys.argv[2:])
+        init_log(args.log)
+
+        try:
+            rebuild_archive(args.archives, args.output)
+        except KeyboardInterrupt:
+            log.warning("Aborted.")
+            return 0
+        except StandardError as e:
+            log.error(to_str(e))
+            return 1
     elif args.command == "run":
         usage_str = '''Usage: python backup.py run [options] [server[:target,target2,...] [server[:target] ...]]'''
         parser = argparse.ArgumentParser(description='Run backups', usage=usage_str)
@@ -3040,8 +7389,20 @@ Targets are """
                 parser.error(e)
                 return 1
             report = Report()
+            clean_worker = CleanWorker(actions)
+            clean_worker.start()
+            deferred = [action for action in actions if not do_backup(action, report, True, clean_worker)]
+            if deferred:
+                # The archives still being sent in background may hold the missing space
+                wait_pending_saves(actions, report)
+                for action in deferred:
+                    do_backup(action, report, False, clean_worker)
+            wait_pending_saves(actions, report)
+            clean_errors = clean_worker.finish()
             for action in actions:
-                do_backup(action, report)
+                if action.full_name in clean_errors:
+                    report.add_issue(action.server_name, "Unable to clean old archives of " + action.small_descr +
+                                     ": " + to_str(clean_errors[action.full_name]))
             do_report(conf, report)
         except KeyboardInterrupt:
             log.warning("Backup aborted. Sending reports...")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generate a configuration of thousands of actions, spread on include files, and check it is loaded within a time
+budget, with and without the config cache.
+
+Usage: python benchmarks/bench_config_load.py [--actions 10000] [--budget 5]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+
+def generate_config(folder, action_count, actions_per_server=4, servers_per_file=25):
+    """
+    Write a main config file including the server files, json being valid yaml
+
+    :return:    The main config file
+    :rtype:     str
+    """
+    os.makedirs(os.path.join(folder, "servers"))
+    main_file = os.path.join(folder, "backup.config")
+    with open(main_file, "w") as fh:
+        json.dump({
+            "common": {
+                "dest_folder": os.path.join(folder, "current"),
+                "ssh_user": "backuper",
+                "local_history": {"folder": os.path.join(folder, "past"),
+                                  "memory": {"day": 4, "week": 2, "month": 3, "year": "all"}},
+                "s3": {"bucket": "backups", "prefix": "fleet/", "memory": "week"},
+            },
+            "include": "servers/*.config",
+        }, fh)
+    server_count = (action_count + actions_per_server - 1) // actions_per_server
+    for first in range(0, server_count, servers_per_file):
+        servers = {}
+        for index in range(first, min(first + servers_per_file, server_count)):
+            servers["srv%05d.example.com" % index] = {
+                "prefix": "srv%05d_" % index,
+                "files": {"etc": "/etc", "www": "/var/www", "exclude": ["/etc/ssh"]},
+                "databases": {"app": "mysql:3306:app", "wiki": {"db": "postgres:5432:wiki", "delta_storage": 7}},
+            }
+        with open(os.path.join(folder, "servers", "%05d.config" % first), "w") as fh:
+            json.dump(servers, fh)
+    return main_file
+
+
+def measure(config_file):
+    start = time.time()
+    config = backup.BackupConfig(config_file)
+    return time.time() - start, len(config.get_actions())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the loading of a large configuration")
+    parser.add_argument("--actions", type=int, default=10000, help="Number of actions to generate, default 10000")
+    parser.add_argument("--budget", type=float, default=5.0, help="Maximum load time in seconds, default 5")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="bkp_bench_")
+    try:
+        backup.ConfigCache.CACHE_FILE = os.path.join(folder, "config_cache")
+        config_file = generate_config(folder, args.actions)
+        cold_time, action_count = measure(config_file)
+        cached_time, _ = measure(config_file)
+    finally:
+        shutil.rmtree(folder)
+
+    print("%d actions loaded in %.2fs, %.2fs from the config cache (budget %.2fs)" %
+          (action_count, cold_time, cached_time, args.budget))
+    if action_count < args.actions:
+        print("Only %d actions were loaded instead of %d" % (action_count, args.actions))
+        return 1
+    if max(cold_time, cached_time) > args.budget:
+        print("Load time over budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
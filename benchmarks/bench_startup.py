@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure the cold start of the command line for each subcommand: the wall time of a whole run on a small config, and
+the module imports reported by python -X importtime (python 3.7+).
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--budget 500]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKUP_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backup.py")
+COMMANDS = (["config"], ["list"], ["clean", "--plan"], ["config", "local:etc"])
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)$")
+
+
+def generate_config(folder):
+    """
+    :return:    A config backing up a local folder, json being valid yaml
+    :rtype:     str
+    """
+    config_file = os.path.join(folder, "backup.config")
+    with open(config_file, "w") as fh:
+        json.dump({
+            "common": {
+                "dest_folder": os.path.join(folder, "current"),
+                "local_history": {"folder": os.path.join(folder, "past"), "memory": "week"},
+            },
+            "local": {"prefix": "local_", "files": {"etc": "/etc"}},
+        }, fh)
+    os.makedirs(os.path.join(folder, "current"))
+    os.makedirs(os.path.join(folder, "past"))
+    return config_file
+
+
+def run_command(command, config_file, env, import_times=False):
+    """
+    :return:    The wall time of the command in seconds, and its stderr
+    :rtype:     (float, str)
+    """
+    args = [sys.executable]
+    if import_times:
+        args.extend(["-X", "importtime"])
+    args.extend([BACKUP_SCRIPT, command[0], "--config", config_file] + command[1:])
+    start = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    _, err = process.communicate()
+    duration = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError(" ".join(command) + " failed: " + err.decode("utf-8", "replace")[-2000:])
+    return duration, err.decode("utf-8", "replace")
+
+
+def parse_import_times(output):
+    """
+    :return:    The total import time in seconds, and the cumulative time of the top level imports, by module
+    :rtype:     (float, dict[str, float])
+    """
+    modules = {}
+    for line in output.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            modules[match.group(4)] = modules.get(match.group(4), 0) + int(match.group(2)) / 1000000.0
+    return sum(modules.values()), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup of each subcommand")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per subcommand, the fastest is kept. Default 5")
+    parser.add_argument("--budget", type=float, help="Maximum wall time of a subcommand in milliseconds")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="bkp_bench_")
+    over_budget = []
+    try:
+        config_file = generate_config(folder)
+        # The caches of the user are not used, nor modified
+        env = dict(os.environ, HOME=folder)
+        # Fills the config cache
+        run_command(COMMANDS[0], config_file, env)
+        print("%-24s %10s %10s   %s" % ("command", "wall (ms)", "imports", "slowest top level imports (ms)"))
+        for command in COMMANDS:
+            wall_time = min([run_command(command, config_file, env)[0] for _ in range(args.runs)])
+            import_time, modules = parse_import_times(run_command(command, config_file, env, True)[1])
+            slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:4]
+            print("%-24s %10.1f %10.1f   %s" % (" ".join(command), wall_time * 1000, import_time * 1000,
+                                                ", ".join(["%s %.1f" % (name, duration * 1000)
+                                                           for name, duration in slowest])))
+            if args.budget is not None and wall_time * 1000 > args.budget:
+                over_budget.append(" ".join(command))
+    finally:
+        shutil.rmtree(folder)
+
+    if over_budget:
+        print("Over the %.0fms budget: %s" % (args.budget, ", ".join(over_budget)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
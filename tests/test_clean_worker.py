@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background cleaning of the actions of a run: an action is never cleaned while it is backed up.
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+
+class CleanWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.clean_archives = backup.clean_archives
+        backup.clean_archives = self.fake_clean
+        self.actions = [backup.FileAction("local", "local", name, "/tmp/current", None, None, "/" + name, [])
+                        for name in ("etc", "www", "home")]
+        self.lock = threading.Lock()
+        # The backups in progress, and the cleanings made: action name, throttled, backups in progress
+        self.running = set()
+        self.cleaned = []
+        self.blocked = {}
+
+    def tearDown(self):
+        backup.clean_archives = self.clean_archives
+        for event in self.blocked.values():
+            event.set()
+
+    def fake_clean(self, action, storage_filter=None, throttled=False):
+        with self.lock:
+            self.cleaned.append((action.name, throttled, action.name in self.running))
+        if action.name in self.blocked:
+            self.blocked[action.name].wait(10)
+
+    def begin_backup(self, worker, action):
+        cleaned = worker.begin_backup(action)
+        with self.lock:
+            self.running.add(action.name)
+        return cleaned
+
+    def wait_cleaned(self, count):
+        deadline = time.time() + 10
+        while len(self.cleaned) < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.cleaned), count)
+
+    def test_from_the_last_action(self):
+        worker = backup.CleanWorker(self.actions)
+        worker.start()
+        self.wait_cleaned(3)
+        self.assertEqual(worker.finish(), {})
+        self.assertEqual(self.cleaned, [("home", True, False), ("www", True, False), ("etc", True, False)])
+
+    def test_backed_up_action_cleaned_at_finish(self):
+        worker = backup.CleanWorker(self.actions)
+        self.assertFalse(self.begin_backup(worker, self.actions[0]))
+        worker.start()
+        self.wait_cleaned(2)
+        time.sleep(0.1)
+        # Still waiting for the end of the backups
+        self.assertEqual(len(self.cleaned), 2)
+        with self.lock:
+            self.running.clear()
+        self.assertEqual(worker.finish(), {})
+        # Not throttled anymore: nothing is sent once the run finishes
+        self.assertEqual(self.cleaned, [("home", True, False), ("www", True, False), ("etc", False, False)])
+
+    def test_backup_waits_for_cleaning(self):
+        self.blocked["home"] = threading.Event()
+        worker = backup.CleanWorker(self.actions)
+        worker.start()
+        self.wait_cleaned(1)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.begin_backup(worker, self.actions[2])))
+        thread.start()
+        thread.join(0.2)
+        # The backup starts once the cleaning is over
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(self.running, set())
+        self.blocked["home"].set()
+        thread.join(10)
+        self.assertEqual(results, [True])
+        self.assertEqual(worker.finish(), {})
+        self.assertEqual([cleaned for name, throttled, cleaned in self.cleaned], [False, False, False])
+
+    def test_errors(self):
+        def failing_clean(action, storage_filter=None, throttled=False):
+            if action.name == "www":
+                raise RuntimeError("unable to remove")
+            self.fake_clean(action, storage_filter, throttled)
+        backup.clean_archives = failing_clean
+        worker = backup.CleanWorker(self.actions)
+        worker.start()
+        errors = worker.finish()
+        self.assertEqual(list(errors.keys()), ["local_www"])
+        # The other actions are still cleaned
+        self.assertEqual(sorted([name for name, throttled, running in self.cleaned]), ["etc", "home"])
+
+
+if __name__ == "__main__":
+    unittest.main()
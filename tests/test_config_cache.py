@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reuse and invalidation of the parsed config kept between runs.
+
+Usage: python -m unittest discover tests
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+
+class CountingLoader(object):
+    """
+    Json loader counting the files it reads
+    """
+    def __init__(self):
+        self.count = 0
+
+    def load(self, fh):
+        self.count += 1
+        return json.load(fh)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ConfigCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="bkp_test_")
+        self.cache_file = backup.ConfigCache.CACHE_FILE
+        self.loader = backup.BackupConfig._loader
+        backup.ConfigCache.CACHE_FILE = os.path.join(self.folder, "config_cache")
+        backup.BackupConfig._loader = CountingLoader()
+        os.makedirs(os.path.join(self.folder, "servers"))
+        self.config_file = self.write("backup.config", {
+            "common": {"dest_folder": os.path.join(self.folder, "current")},
+            "include": "servers/*.config",
+        })
+        self.write("servers/a.config", {"a.example.com": {"prefix": "a_", "files": {"etc": "/etc"}}})
+
+    def tearDown(self):
+        backup.ConfigCache.CACHE_FILE = self.cache_file
+        backup.BackupConfig._loader = self.loader
+        shutil.rmtree(self.folder)
+
+    def write(self, filename, data):
+        filename = os.path.join(self.folder, filename)
+        with open(filename, "w") as fh:
+            json.dump(data, fh)
+        return filename
+
+    def load(self):
+        """
+        :return:    The full name of the actions, and the number of files read
+        :rtype:     (list[str], int)
+        """
+        backup.BackupConfig._loader.count = 0
+        conf = backup.BackupConfig(self.config_file)
+        return [action.full_name for action in conf.get_actions()], backup.BackupConfig._loader.count
+
+    def test_hit(self):
+        self.assertEqual(self.load(), (["a_etc"], 2))
+        self.assertEqual(self.load(), (["a_etc"], 0))
+
+    def test_miss_is_silent(self):
+        other_file = self.write("other.config", {"b.example.com": {"prefix": "b_", "files": {"etc": "/etc"}}})
+        self.load()
+        handler = RecordingHandler()
+        backup.log.addHandler(handler)
+        try:
+            self.assertIsNone(backup.ConfigCache.get(other_file))
+        finally:
+            backup.log.removeHandler(handler)
+        self.assertEqual(handler.messages, [])
+        # Every config has its entry
+        self.config_file = other_file
+        self.assertEqual(self.load(), (["b_etc"], 1))
+        self.assertEqual(self.load(), (["b_etc"], 0))
+
+    def test_modified_file(self):
+        self.load()
+        included_file = os.path.join(self.folder, "servers", "a.config")
+        self.write("servers/a.config", {"a.example.com": {"prefix": "a_", "files": {"www": "/var/www"}}})
+        mtime = time.time() - 10
+        os.utime(included_file, (mtime, mtime))
+        self.assertEqual(self.load(), (["a_www"], 2))
+        self.assertEqual(self.load(), (["a_www"], 0))
+
+    def test_added_file(self):
+        self.load()
+        self.write("servers/b.config", {"b.example.com": {"prefix": "b_", "files": {"etc": "/etc"}}})
+        self.assertEqual(sorted(self.load()[0]), ["a_etc", "b_etc"])
+
+    def test_removed_file(self):
+        self.write("servers/b.config", {"b.example.com": {"prefix": "b_", "files": {"etc": "/etc"}}})
+        self.load()
+        os.remove(os.path.join(self.folder, "servers", "b.config"))
+        self.assertEqual(self.load(), (["a_etc"], 2))
+
+    def test_invalid_cache_file(self):
+        with open(backup.ConfigCache.CACHE_FILE, "w") as fh:
+            fh.write("not a cache")
+        self.assertEqual(self.load(), (["a_etc"], 2))
+        self.assertEqual(self.load(), (["a_etc"], 0))
+
+    def test_cache_file_only_readable_by_owner(self):
+        self.load()
+        self.assertEqual(os.stat(backup.ConfigCache.CACHE_FILE).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(self.folder).count("config_cache"), 1)
+        self.assertEqual([name for name in os.listdir(self.folder) if name.endswith(".tmp")], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+deep_merge must never modify its arguments: the config loading shares the merged values between the actions instead
+of copying them.
+
+Usage: python -m unittest discover tests
+"""
+import copy
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+
+class DeepMergeTest(unittest.TestCase):
+    def assert_merge(self, src, new, expected):
+        src_copy = copy.deepcopy(src)
+        new_copy = copy.deepcopy(new)
+        self.assertEqual(backup.deep_merge(src, new), expected)
+        self.assertEqual(src, src_copy)
+        self.assertEqual(new, new_copy)
+
+    def test_none(self):
+        self.assert_merge(None, {"a": 1}, {"a": 1})
+        self.assert_merge({"a": 1}, None, {"a": 1})
+
+    def test_scalars(self):
+        self.assert_merge("a", "b", ["a", "b"])
+
+    def test_lists(self):
+        self.assert_merge(["a"], ["b", "c"], ["a", "b", "c"])
+        self.assert_merge(["a"], "b", ["a", "b"])
+
+    def test_dict_and_list(self):
+        self.assert_merge({"a": 1}, ["b"], ["b", {"a": 1}])
+        self.assert_merge({"a": 1}, "b", [{"a": 1}, "b"])
+
+    def test_nested_dicts(self):
+        src = {"common": {"dest_folder": "/backups", "files": {"etc": "/etc"}, "exclude": ["/tmp"]}}
+        new = {"common": {"files": {"www": "/var/www"}, "exclude": ["/var/tmp"]}, "other": {"a": 1}}
+        self.assert_merge(src, new, {
+            "common": {"dest_folder": "/backups", "files": {"etc": "/etc", "www": "/var/www"},
+                       "exclude": ["/tmp", "/var/tmp"]},
+            "other": {"a": 1},
+        })
+
+    def test_result_is_not_src(self):
+        src = {"files": {"etc": "/etc"}, "exclude": ["/tmp"]}
+        result = backup.deep_merge(src, {"files": {"www": "/var/www"}, "exclude": ["/var/tmp"]})
+        result["files"]["data"] = "/data"
+        result["exclude"].append("/data/tmp")
+        self.assertEqual(src, {"files": {"etc": "/etc"}, "exclude": ["/tmp"]})
+
+    def test_shared_values(self):
+        # Only the containers along the merged keys are copied
+        untouched = {"a": [1, 2]}
+        result = backup.deep_merge({"untouched": untouched, "merged": {}}, {"merged": {"b": 1}})
+        self.assertIs(result["untouched"], untouched)
+
+
+if __name__ == "__main__":
+    unittest.main()
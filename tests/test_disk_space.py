@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Free space quotas of the local history folders: old archives removed to make room, and backups deferred when the
+quota still can't be met.
+"""
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+NO = backup.BackupFrequency.NO_VALUE
+ARCHIVE_SIZE = 1000
+
+
+class RecordingAction(backup.FileAction):
+    """
+    File action recording its backups instead of fetching the files
+    """
+    def run_backup(self):
+        self.backup_count = getattr(self, "backup_count", 0) + 1
+
+
+class DiskSpaceTest(unittest.TestCase):
+    def setUp(self):
+        self.now = backup.TimeReference._now
+        self.get_usage = backup.DiskSpace.__dict__["get_usage"]
+        self.folder = tempfile.mkdtemp(prefix="bkp_test_")
+        self.history_folder = os.path.join(self.folder, "past")
+        os.makedirs(os.path.join(self.folder, "current"))
+        os.makedirs(self.history_folder)
+        backup.TimeReference._now = datetime.datetime(2024, 3, 10)
+        for day in range(1, 10):
+            with open(os.path.join(self.history_folder, "202403%02d_local_etc.tgz" % day), "wb") as fh:
+                fh.write(b"x" * ARCHIVE_SIZE)
+        self.free = 0
+
+    def tearDown(self):
+        backup.TimeReference._now = self.now
+        backup.DiskSpace.get_usage = self.get_usage
+        shutil.rmtree(self.folder)
+
+    def make_action(self, min_free):
+        # The same file system for every folder, with the free space set by the test
+        backup.DiskSpace.get_usage = staticmethod(lambda path: (self.free, 10 ** 9, 1))
+        # The daily rule keeps the last two days: the 9th and the 10th
+        storage = backup.LocalFolderStorage(backup.BackupFrequency(2, NO, NO, NO), self.history_folder,
+                                            min_free=None if min_free is None else (min_free, False))
+        action = RecordingAction("local", "local", "etc", os.path.join(self.folder, "current"), None, None, "/etc",
+                                 [])
+        action.add_storage(storage)
+        return action
+
+    def remaining_days(self):
+        return [int(filename[6:8]) for filename in sorted(os.listdir(self.history_folder))]
+
+    def test_enough_space(self):
+        # The tarball is written in place in the history folder
+        self.free = 5000 + ARCHIVE_SIZE
+        self.assertEqual(backup.check_disk_space(self.make_action(5000)), [])
+        self.assertEqual(self.remaining_days(), list(range(1, 10)))
+
+    def test_oldest_archives_removed(self):
+        self.free = 5000 - 2 * ARCHIVE_SIZE
+        self.assertEqual(backup.check_disk_space(self.make_action(5000)), [])
+        self.assertEqual(self.remaining_days(), list(range(4, 10)))
+
+    def test_daily_rule_kept(self):
+        self.free = 0
+        problems = backup.check_disk_space(self.make_action(20000))
+        self.assertEqual(len(problems), 1)
+        self.assertTrue(problems[0].startswith("Not enough disk space for local folder " + self.history_folder +
+                                               ": 12.7KiB missing"), problems[0])
+        self.assertEqual(self.remaining_days(), [9])
+
+    def test_without_quota(self):
+        self.assertEqual(backup.check_disk_space(self.make_action(None)), [])
+        self.assertEqual(self.remaining_days(), list(range(1, 10)))
+
+    def test_backup_deferred(self):
+        action = self.make_action(20000)
+        report = backup.Report()
+        self.assertFalse(backup.do_backup(action, report, can_defer=True))
+        self.assertEqual(getattr(action, "backup_count", 0), 0)
+        self.assertEqual(report.all_issues, {})
+        # Not deferred again at the end of the run
+        self.assertTrue(backup.do_backup(action, report))
+        self.assertEqual(getattr(action, "backup_count", 0), 0)
+        self.assertEqual(list(report.all_issues.keys()), ["local"])
+        self.assertIn("Not enough disk space", report.all_issues["local"][0])
+
+    def test_backup_run_with_enough_space(self):
+        self.free = 5000 + ARCHIVE_SIZE
+        action = self.make_action(5000)
+        self.assertTrue(backup.do_backup(action, backup.Report(), can_defer=True))
+        self.assertEqual(action.backup_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Import of the legacy ini glacier index into the sqlite index.
+
+Usage: python -m unittest discover tests
+"""
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+VAULT = "eu-west-1:vault"
+
+
+class GlacierIndexLegacyImportTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="bkp_test_")
+        self.legacy_file = os.path.join(self.folder, "glacier.ini")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_legacy_file(self, archives):
+        # Written the way the storage wrote its index before the sqlite one
+        try:
+            import configparser
+        except ImportError:
+            import ConfigParser as configparser
+        file_list = configparser.ConfigParser()
+        file_list.add_section("glacier")
+        for archive_name, archive_id in archives:
+            file_list.set("glacier", archive_name, archive_id)
+        with open(self.legacy_file, "w") as fh:
+            file_list.write(fh)
+
+    def test_import(self):
+        self.write_legacy_file([("20240101_srv_etc.tgz", "id-1"), ("20240102_srv_etc.tgz", "id-2")])
+        index = backup.GlacierIndex(self.legacy_file)
+        self.assertEqual(index.list_names(VAULT), ["20240101_srv_etc.tgz", "20240102_srv_etc.tgz"])
+        self.assertEqual(index.get_archive_ids(VAULT), {"20240101_srv_etc.tgz": "id-1", "20240102_srv_etc.tgz": "id-2"})
+        self.assertEqual(index.get_archive_id(VAULT, "20240102_srv_etc.tgz"), "id-2")
+        # Imported without vault: visible from every vault
+        self.assertEqual(index.get_archive_id("us-east-1:other", "20240101_srv_etc.tgz"), "id-1")
+        self.assertTrue(os.path.exists(index.filename))
+        # The legacy file is left untouched
+        self.assertTrue(os.path.exists(self.legacy_file))
+
+    def test_imported_once(self):
+        self.write_legacy_file([("20240101_srv_etc.tgz", "id-1")])
+        backup.GlacierIndex(self.legacy_file).list_names(VAULT)
+        self.write_legacy_file([("20240101_srv_etc.tgz", "id-1"), ("20240102_srv_etc.tgz", "id-2")])
+        self.assertEqual(backup.GlacierIndex(self.legacy_file).list_names(VAULT), ["20240101_srv_etc.tgz"])
+
+    def test_removed_legacy_archive_not_imported_again(self):
+        self.write_legacy_file([("20240101_srv_etc.tgz", "id-1"), ("20240102_srv_etc.tgz", "id-2")])
+        backup.GlacierIndex(self.legacy_file).remove(VAULT, "20240101_srv_etc.tgz")
+        self.assertEqual(backup.GlacierIndex(self.legacy_file).list_names(VAULT), ["20240102_srv_etc.tgz"])
+
+    def test_recorded_archive_replaces_legacy_one(self):
+        self.write_legacy_file([("20240101_srv_etc.tgz", "id-1")])
+        index = backup.GlacierIndex(self.legacy_file)
+        index.add(VAULT, "20240101_srv_etc.tgz", "id-new", 10, "abc")
+        self.assertEqual(index.get_archive_ids(VAULT), {"20240101_srv_etc.tgz": "id-new"})
+        self.assertEqual(index.get_entries(VAULT), {"20240101_srv_etc.tgz": (10, "abc")})
+        self.assertEqual(index.find_payloads(VAULT, "abc", 10), [("20240101_srv_etc.tgz", "id-new")])
+
+    def test_without_legacy_file(self):
+        index = backup.GlacierIndex(self.legacy_file)
+        self.assertEqual(index.list_names(VAULT), [])
+        index.add(VAULT, "20240101_srv_etc.tgz", "id-1", 10, None)
+        self.assertEqual(index.list_names(VAULT), ["20240101_srv_etc.tgz"])
+        self.assertEqual(index.list_names("us-east-1:other"), [])
+
+    def test_payloads_by_reference_time(self):
+        now = backup.TimeReference._now
+        index = backup.GlacierIndex(self.legacy_file)
+        try:
+            backup.TimeReference._now = datetime.datetime(2024, 1, 2, 3, 0)
+            index.add(VAULT, "20240102_srv_etc.tgz", "id-1", 10, "abc")
+            # Recorded by a later run, under an older archive name
+            backup.TimeReference._now = datetime.datetime(2024, 1, 3, 3, 0)
+            index.add(VAULT, "20240101_srv_etc.tgz", "id-2", 10, "abc")
+        finally:
+            backup.TimeReference._now = now
+        self.assertEqual(index.find_payloads(VAULT, "abc", 10), [("20240101_srv_etc.tgz", "id-2"),
+                                                                 ("20240102_srv_etc.tgz", "id-1")])
+
+    def test_legacy_file_without_section(self):
+        with open(self.legacy_file, "w") as fh:
+            fh.write("[other]\nkey = value\n")
+        self.assertEqual(backup.GlacierIndex(self.legacy_file).list_names(VAULT), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Archives listed by the local history folders.
+"""
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+
+class LocalFolderStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="bkp_test_")
+        self.freq = backup.BackupFrequency(4, 0, 0, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def touch(self, filename, size=0):
+        with open(os.path.join(self.folder, filename), "wb") as fh:
+            fh.write(b"x" * size)
+        return os.path.join(self.folder, filename)
+
+    def test_partial_archives_are_ignored(self):
+        archive = self.touch("20240101_srv.db.sql.gz", 10)
+        self.touch("20240102_srv.db.sql.gz.part", 5)
+        storage = backup.LocalFolderStorage(self.freq, self.folder)
+        self.assertEqual(storage.list_archives("srv.db"), [archive])
+        self.assertEqual(storage.list_archives(), [archive])
+
+    def test_interrupted_stream_leaves_no_archive(self):
+        storage = backup.LocalFolderStorage(self.freq, self.folder)
+        writer = storage.open_writer("srv.db", "sql.gz")
+        writer.write(b"partial dump")
+        # The folder is scanned while the archive is written
+        self.assertEqual(storage.list_archives("srv.db"), [])
+        writer.abort()
+        self.assertEqual(storage.list_archives("srv.db"), [])
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_stream_checked_against_quota(self):
+        free = backup.DiskSpace.get_usage(self.folder)[0]
+        storage = backup.LocalFolderStorage(self.freq, self.folder, min_free=(0, False))
+        self.assertRaises(RuntimeError, storage.open_writer, "srv.db", "sql.gz", free + 1)
+        self.assertEqual(os.listdir(self.folder), [])
+        storage.open_writer("srv.db", "sql.gz", 1).abort()
+        # Without quota, nothing is checked before writing
+        storage = backup.LocalFolderStorage(self.freq, self.folder)
+        storage.open_writer("srv.db", "sql.gz", free + 1).abort()
+
+
+class LocalFolderIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.now = backup.TimeReference._now
+        self.indexes = backup.LocalFolderIndex._indexes
+        backup.LocalFolderIndex._indexes = {}
+        backup.TimeReference._now = datetime.datetime(2024, 1, 3)
+        self.folder = tempfile.mkdtemp(prefix="bkp_test_")
+        self.source_file = os.path.join(self.folder, "source.tgz")
+        with open(self.source_file, "wb") as fh:
+            fh.write(b"archive")
+        self.history_folder = os.path.join(self.folder, "past")
+        os.makedirs(self.history_folder)
+        for filename in ("20240101_srv_etc.tgz", "20240102_srv_etc.tgz", "20240101_srv_www.tgz"):
+            open(os.path.join(self.history_folder, filename), "w").close()
+
+    def tearDown(self):
+        backup.TimeReference._now = self.now
+        backup.LocalFolderIndex._indexes = self.indexes
+        shutil.rmtree(self.folder)
+
+    def path(self, filename):
+        return os.path.join(self.history_folder, filename)
+
+    def new_storage(self, index_file=False):
+        return backup.LocalFolderStorage(backup.BackupFrequency(4, 0, 0, 0), self.history_folder, index_file)
+
+    def test_updated_without_scan(self):
+        storage = self.new_storage()
+        self.assertEqual(storage.list_archives("srv_etc"), [self.path("20240101_srv_etc.tgz"),
+                                                            self.path("20240102_srv_etc.tgz")])
+        # Written by another process: only seen by the next processes
+        open(self.path("20240102_srv_www.tgz"), "w").close()
+        storage.save(self.source_file, "srv_etc", "tgz")
+        writer = storage.open_writer("srv_www", "tgz")
+        writer.write(b"streamed")
+        writer.close()
+        storage.remove(self.path("20240101_srv_etc.tgz"))
+        self.assertEqual(storage.list_archives("srv_etc"), [self.path("20240102_srv_etc.tgz"),
+                                                            self.path("20240103_srv_etc.tgz")])
+        self.assertEqual(storage.list_archives("srv_www"), [self.path("20240101_srv_www.tgz"),
+                                                            self.path("20240103_srv_www.tgz")])
+
+    def test_shared_by_storages(self):
+        self.new_storage().list_archives()
+        self.new_storage().remove_many([self.path("20240101_srv_etc.tgz"), self.path("20240101_srv_www.tgz")])
+        self.assertEqual(self.new_storage().list_archives(), [self.path("20240102_srv_etc.tgz")])
+
+    def test_index_file(self):
+        storage = self.new_storage(True)
+        storage.list_archives()
+        storage.save(self.source_file, "srv_etc", "tgz")
+        storage.remove_many([self.path("20240101_srv_etc.tgz")])
+        expected = [self.path("20240101_srv_www.tgz"), self.path("20240102_srv_etc.tgz"),
+                    self.path("20240103_srv_etc.tgz")]
+        # The next process reads the index file instead of scanning the folder
+        backup.LocalFolderIndex._indexes = {}
+        scan = backup.LocalFolderIndex._scan
+        backup.LocalFolderIndex._scan = None
+        try:
+            self.assertEqual(self.new_storage(True).list_archives(), expected)
+        finally:
+            backup.LocalFolderIndex._scan = scan
+        # Unless another process modified the folder
+        backup.LocalFolderIndex._indexes = {}
+        os.remove(self.path("20240102_srv_etc.tgz"))
+        self.assertEqual(self.new_storage(True).list_archives(), [expected[0], expected[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The retention rules computed once per reference date, and the retention plans, must keep exactly the archives the
+original per archive evaluation kept.
+
+Usage: python -m unittest discover tests
+"""
+import datetime
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+ALL = backup.BackupFrequency.ALL_VALUE
+NO = backup.BackupFrequency.NO_VALUE
+FREQUENCIES = [
+    (4, 2, 3, ALL),
+    (7, 4, 12, 2),
+    (1, NO, NO, NO),
+    (NO, 1, NO, NO),
+    (NO, NO, 1, NO),
+    (NO, NO, NO, 1),
+    (ALL, NO, NO, NO),
+    (NO, ALL, ALL, NO),
+    (3, 5, 13, 3),
+    (30, 52, 24, 10),
+]
+REFERENCE_DATES = [datetime.datetime(2023, 12, 25) + datetime.timedelta(days=days) for days in range(0, 500, 23)] + [
+    datetime.datetime(2024, 1, 1), datetime.datetime(2024, 2, 29), datetime.datetime(2024, 3, 1),
+    datetime.datetime(2024, 12, 31), datetime.datetime(2025, 1, 1),
+]
+
+
+def old_should_keep(freq, date):
+    """
+    The retention rules as they were evaluated for each archive, before the limits were computed once per date
+    """
+    day, week, month, year = freq
+    now = backup.TimeReference.get().date()
+    if day == ALL:
+        return True
+    if day != NO:
+        elapsed_days = (now - date).days + 1
+        if elapsed_days <= day:
+            return True
+    if date.isoweekday() == 1:
+        if week == ALL:
+            return True
+        if week != NO:
+            last_allowed_date = now - datetime.timedelta(days=now.isoweekday() + (7 * week) - 8)
+            if date >= last_allowed_date:
+                return True
+    if date.day == 1:
+        if month == ALL:
+            return True
+        if month != NO:
+            last_allowed_date = datetime.date(year=now.year + int(math.floor((now.month - month)/12)),
+                                              month=((now.month - month) % 12)+1, day=1)
+            if date >= last_allowed_date:
+                return True
+        if date.month == 1:
+            if year == ALL:
+                return True
+            if year != NO:
+                last_allowed_date = datetime.date(year=now.year - year + 1, month=1, day=1)
+                if date >= last_allowed_date:
+                    return True
+    return False
+
+
+def old_kept_archives(action, freq, archives):
+    """
+    The archives kept on a storage: the archives of the kept dates, and the archives their restore chains need
+    """
+    kept = set()
+    previous_needed = False
+    for archive in sorted(archives, key=os.path.basename, reverse=True):
+        date_str = os.path.basename(archive)[0:8]
+        date = datetime.date(int(date_str[0:4]), int(date_str[4:6]), int(date_str[6:8]))
+        if previous_needed or old_should_keep(freq, date):
+            kept.add(archive)
+            previous_needed = action.is_chained_archive(archive)
+        else:
+            previous_needed = False
+    return kept
+
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.now = backup.TimeReference._now
+        self.folder = tempfile.mkdtemp(prefix="bkp_test_")
+
+    def tearDown(self):
+        backup.TimeReference._now = self.now
+        shutil.rmtree(self.folder)
+
+    def test_should_keep(self):
+        for reference_date in REFERENCE_DATES:
+            backup.TimeReference._now = reference_date
+            start = reference_date.date() - datetime.timedelta(days=800)
+            dates = [start + datetime.timedelta(days=days) for days in range(805)]
+            for values in FREQUENCIES:
+                freq = backup.BackupFrequency(*values)
+                for date in dates:
+                    self.assertEqual(freq.should_keep(date), old_should_keep(values, date),
+                                     "%r on %s, reference %s" % (values, date, reference_date.date()))
+
+    def test_plan(self):
+        history_folder = os.path.join(self.folder, "past")
+        os.makedirs(history_folder)
+        files = backup.FileAction("local", "local", "etc", self.folder, None, None, "/etc", [])
+        database = backup.SqliteAction("local", "local", "app", self.folder, None, None, "/var/lib/app.db",
+                                       {"delta_storage": 7})
+        start = datetime.date(2023, 11, 1)
+        for days in range(420):
+            date_str = (start + datetime.timedelta(days=days)).strftime("%Y%m%d")
+            names = [date_str + "_local_etc.tgz"]
+            # Keyframes on sundays, deltas against the previous dump the other days
+            if (start + datetime.timedelta(days=days)).isoweekday() == 7:
+                names.append(date_str + "_local_app.sqlite.gz")
+            else:
+                names.append(date_str + "_local_app.sqlite.xdelta")
+            for name in names:
+                open(os.path.join(history_folder, name), "w").close()
+        # Not archives of these actions
+        open(os.path.join(history_folder, "20231201_local_other.tgz"), "w").close()
+        open(os.path.join(history_folder, "notes.txt"), "w").close()
+
+        for values in FREQUENCIES[:5]:
+            freq = backup.BackupFrequency(*values)
+            storage = backup.LocalFolderStorage(freq, history_folder)
+            files.storage_list[:] = [storage]
+            database.storage_list[:] = [storage]
+            for reference_date in REFERENCE_DATES[5:15]:
+                backup.TimeReference._now = reference_date
+                plan = backup.RetentionPlanner([files, database]).plan()
+                listed = dict([(action.full_name, set([archive for archive, kept in archives if kept]))
+                               for action, listed_storage, archives in
+                               backup.RetentionPlanner([files, database]).list_archives()])
+                self.assertEqual(plan["reference_date"], reference_date.strftime("%Y-%m-%d"))
+                self.assertEqual(len(plan["storages"]), 1)
+                expired = set(plan["storages"][0]["expired"])
+                for action in (files, database):
+                    archives = storage.list_archives(action.full_name)
+                    kept = old_kept_archives(action, values, archives)
+                    self.assertEqual(set(archives) - kept, expired & set(archives),
+                                     "%r, reference %s" % (values, reference_date.date()))
+                    self.assertEqual(kept, listed[action.full_name])
+                self.assertEqual(plan["storages"][0]["kept"] + len(expired), 840)
+
+    def test_restrict(self):
+        history_folder = os.path.join(self.folder, "past")
+        os.makedirs(history_folder)
+        for name in ("20240101_local_etc.tgz", "20240102_local_etc.tgz", "20240301_local_etc.tgz",
+                     "20240102_local_www.tgz"):
+            open(os.path.join(history_folder, name), "w").close()
+        backup.TimeReference._now = datetime.datetime(2024, 3, 1)
+        storage = backup.LocalFolderStorage(backup.BackupFrequency(1, NO, NO, NO), history_folder)
+        action = backup.FileAction("local", "local", "etc", self.folder, None, None, "/etc", [])
+        action.add_storage(storage)
+        reviewed_plan = {"reference_date": "2024-02-01", "storages": [{
+            "storage": storage.small_descr, "actions": ["local_etc", "local_www"], "kept": 0,
+            "expired": [os.path.join(history_folder, name) for name in (
+                "20240101_local_etc.tgz", "20240301_local_etc.tgz", "20240102_local_www.tgz")] + ["/etc/passwd"],
+        }]}
+        plan = backup.RetentionPlanner([action]).restrict(reviewed_plan)
+        # Still kept, not an archive of the action, or not in the storage
+        self.assertEqual(plan["storages"][0]["expired"], [os.path.join(history_folder, "20240101_local_etc.tgz")])
+
+
+if __name__ == "__main__":
+    unittest.main()
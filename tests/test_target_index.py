@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The target index must select the same actions as matching every action against the identifier with fnmatch.
+
+Usage: python -m unittest discover tests
+"""
+import fnmatch
+import os
+import sys
+import timeit
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backup  # noqa: E402
+
+IDENTIFIERS = [
+    "*", "?", "a.example.com", "b.example.com", "*.example.com", "[ab].example.com", "[!a]*", "a", "b*", "etc",
+    "a_etc", "*_etc", "/etc", "/var/*", "/var/lib/*/data", "wiki", "wik?", "mysql", "mongo", "sqlite", "*sql*",
+    "/srv/app.db", "unknown", "srv[", "a.example.com:*", "*:etc", "a:etc", "a:*", "b:mysql", "*:/var/*",
+    "*.example.com:w*", "c.example.com:db*", "[bc]*:*log*", "unknown:*", "a.example.com:unknown", "*:a_*",
+    "local:*", "local", "*:", ":*", "",
+    # Leading wildcards
+    "**", "*:*", "*ki", "*w?k*", "*[!a]_etc", "*.example.com", "*[", "*]*", "*[a]*", "?[", "*/lib/*", "*:**", "*:app*",
+]
+
+
+def old_glob_target(actions, identifier):
+    """
+    The selection as it was made before the index: every action matched against the identifier
+    """
+    results = []
+    if ":" in identifier:
+        first_part, second_part = identifier.split(":", 2)
+        for action in actions:
+            if fnmatch.fnmatch(action.server_name, first_part) or fnmatch.fnmatch(action.prefix, first_part):
+                if fnmatch.fnmatch(action.name, second_part) or fnmatch.fnmatch(action.full_name, second_part):
+                    results.append(action)
+                elif isinstance(action, backup.FileAction) and fnmatch.fnmatch(action.remote_folder, second_part):
+                    results.append(action)
+                elif isinstance(action, backup.DbAction):
+                    if fnmatch.fnmatch(action.database, second_part):
+                        results.append(action)
+                    elif fnmatch.fnmatch(action.db_type, second_part):
+                        results.append(action)
+    else:
+        for action in actions:
+            if fnmatch.fnmatch(action.server_name, identifier):
+                results.append(action)
+            elif fnmatch.fnmatch(action.name, identifier):
+                results.append(action)
+            elif fnmatch.fnmatch(action.full_name, identifier):
+                results.append(action)
+            elif fnmatch.fnmatch(action.prefix, identifier):
+                results.append(action)
+            elif isinstance(action, backup.FileAction) and fnmatch.fnmatch(action.remote_folder, identifier):
+                results.append(action)
+            elif isinstance(action, backup.DbAction):
+                if fnmatch.fnmatch(action.database, identifier):
+                    results.append(action)
+                elif fnmatch.fnmatch(action.db_type, identifier):
+                    results.append(action)
+    return results
+
+
+def make_actions():
+    dest_folder = "/tmp/current"
+    actions = []
+    for server_name, prefix in (("a.example.com", "a"), ("b.example.com", "b"), ("c.example.com", "c"),
+                                ("local", "local")):
+        actions.extend([
+            backup.FileAction(server_name, prefix, "etc", dest_folder, None, None, "/etc", []),
+            backup.FileAction(server_name, prefix, "www", dest_folder, None, None, "/var/www", []),
+            backup.FileAction(server_name, prefix, "data", dest_folder, None, None, "/var/lib/" + prefix + "/data",
+                              []),
+            backup.MySqlAction(server_name, prefix, "wiki", dest_folder, None, None, "backup", "wiki", 3306),
+            backup.PostgresAction(server_name, prefix, "crm", dest_folder, None, None, "backup", "crm", 5432),
+            backup.MongoDbAction(server_name, prefix, "log", dest_folder, None, None, "backup", "logs", 27017),
+            backup.SqliteAction(server_name, prefix, "db_app", dest_folder, None, None, "/srv/app.db"),
+        ])
+    # Same name as a server
+    actions.append(backup.FileAction("d.example.com", "d", "a", dest_folder, None, None, "/a", []))
+    return actions
+
+
+def make_many_actions(count):
+    """
+    The actions of a large config, two folders and two databases by server
+    """
+    dest_folder = "/tmp/current"
+    actions = []
+    for number in range(count // 4):
+        server_name, prefix = "srv%05d.example.com" % number, "srv%05d" % number
+        actions.extend([
+            backup.FileAction(server_name, prefix, "etc", dest_folder, None, None, "/etc", []),
+            backup.FileAction(server_name, prefix, "www", dest_folder, None, None, "/var/www", []),
+            backup.MySqlAction(server_name, prefix, "app", dest_folder, None, None, "backup", "app", 3306),
+            backup.PostgresAction(server_name, prefix, "wiki", dest_folder, None, None, "backup", "wiki", 5432),
+        ])
+    return actions
+
+
+class TargetIndexTest(unittest.TestCase):
+    def test_same_selection(self):
+        actions = make_actions()
+        index = backup.TargetIndex(actions)
+        for identifier in IDENTIFIERS:
+            selected = [action for action, reason in index.select(identifier)]
+            self.assertEqual([action.full_name for action in selected],
+                             [action.full_name for action in old_glob_target(actions, identifier)], identifier)
+            # The same actions, not only the same names
+            self.assertEqual([id(action) for action in selected],
+                             [id(action) for action in old_glob_target(actions, identifier)], identifier)
+
+    def test_reasons(self):
+        index = backup.TargetIndex(make_actions())
+        self.assertEqual([(action.full_name, reason) for action, reason in index.select("b:w*")],
+                         [("b_www", "prefix b matches b, name www matches w*"),
+                          ("b_wiki", "prefix b matches b, name wiki matches w*")])
+        self.assertEqual([(action.full_name, reason) for action, reason in index.select("/srv/*")][0],
+                         ("a_db_app", "database /srv/app.db matches /srv/*"))
+
+    def test_repeated_patterns(self):
+        actions = make_actions()
+        index = backup.TargetIndex(actions)
+        for _ in range(2):
+            self.assertEqual(len(index.select("*.example.com:*")), 22)
+
+    def test_leading_wildcard_duration(self):
+        index = backup.TargetIndex(make_many_actions(10000))
+
+        def duration(identifier):
+            return min(timeit.repeat(lambda: index.select(identifier), number=5, repeat=5)) / 5
+
+        for pattern, literal in (("*wiki*", "wiki"), ("*:app", "app")):
+            self.assertEqual(len(index.select(pattern)), 2500)
+            # Not much slower than selecting the same actions without wildcard
+            self.assertLess(duration(pattern), 5 * duration(literal), pattern)
+        for pattern in ("*:db", "*:unknown"):
+            self.assertEqual(index.select(pattern), [])
+            self.assertLess(duration(pattern), 0.001, pattern)
+
+
+if __name__ == "__main__":
+    unittest.main()